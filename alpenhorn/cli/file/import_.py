@@ -4,6 +4,7 @@ import pathlib
 
 import click
 
+from ...common import wakeup
 from ...db import ArchiveFileImportRequest, database_proxy
 from ..cli import echo
 from ..options import resolve_node
@@ -42,3 +43,4 @@ def import_(path, node_name, register_new):
         )
 
     echo("Added new import request.")
+    wakeup.poke()
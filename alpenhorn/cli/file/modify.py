@@ -2,7 +2,7 @@
 
 import click
 
-from ...db import ArchiveFile, ArchiveFileCopy, database_proxy
+from ...db import ArchiveFile, ArchiveFileCopy, database_proxy, utcnow
 from ..cli import echo, update_or_remove
 from ..options import cli_option, file_from_path, validate_md5
 
@@ -63,7 +63,7 @@ def modify(ctx, path, md5, no_reverify, size):
         if not no_reverify:
             # This re-verifies both good ('Y') copies and corrupt ('X') ones.
             count = (
-                ArchiveFileCopy.update(has_file="M")
+                ArchiveFileCopy.update(has_file="M", last_update=utcnow())
                 .where(
                     ArchiveFileCopy.file == file_,
                     ArchiveFileCopy.has_file != "N",
@@ -3,7 +3,7 @@
 import click
 import peewee as pw
 
-from ...db import ArchiveFileCopy, database_proxy
+from ...db import ArchiveFileCopy, database_proxy, utcnow
 from ..cli import echo
 from ..options import file_from_path, not_both, resolve_node
 
@@ -95,7 +95,10 @@ def _update_state(ctx, path, node_name, set_, ready, unready):
             )
             echo("State updated.")
         else:
-            # Otherwise, update
+            # Otherwise, update.  The daemon's file inventory relies on
+            # last_update changing with has_file.
+            if updates.get("has_file", copy.has_file) != copy.has_file:
+                updates["last_update"] = utcnow()
             if (
                 ArchiveFileCopy.update(**updates)
                 .where(ArchiveFileCopy.id == copy.id)
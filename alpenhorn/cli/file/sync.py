@@ -2,6 +2,7 @@
 
 import click
 
+from ...common import wakeup
 from ...db import ArchiveFileCopyRequest, database_proxy
 from ..cli import echo
 from ..options import cli_option, file_from_path, resolve_group, resolve_node
@@ -121,3 +122,5 @@ def sync(ctx, path, cancel, force, from_, to):
             file=file_, node_from=src, group_to=dest, completed=0, cancelled=0
         )
         echo("Request submitted.")
+
+    wakeup.poke()
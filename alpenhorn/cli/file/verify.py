@@ -3,7 +3,7 @@
 import click
 import peewee as pw
 
-from ...db import ArchiveFileCopy, database_proxy
+from ...db import ArchiveFileCopy, database_proxy, utcnow
 from ..cli import echo
 from ..options import file_from_path, resolve_node
 
@@ -49,7 +49,7 @@ def verify(ctx, path, node_name):
             descriptor = ""
 
         # Update
-        ArchiveFileCopy.update(has_file="M").where(
+        ArchiveFileCopy.update(has_file="M", last_update=utcnow()).where(
             ArchiveFileCopy.id == copy.id
         ).execute()
 
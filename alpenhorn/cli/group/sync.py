@@ -7,6 +7,7 @@ from collections import defaultdict
 import click
 import peewee as pw
 
+from ...common import wakeup
 from ...common.util import pretty_bytes
 from ...db import (
     ArchiveAcq,
@@ -342,6 +343,7 @@ def _run_sync(
 
         requests = "request" if len(new_requests) == 1 else "requests"
         echo(f"\nAdded {len(new_requests)} new copy {requests}.")
+        wakeup.poke()
 
 
 def run_query(
@@ -4,6 +4,7 @@ import pathlib
 
 import click
 
+from ...common import wakeup
 from ...db import ArchiveFileImportRequest, database_proxy
 from ..cli import echo
 from ..options import resolve_node
@@ -58,3 +59,5 @@ def scan(name, path, register_new):
         )
 
         echo(f'Added request for scan of "{path}" on Node "{node.name}".')
+
+    wakeup.poke()
@@ -6,7 +6,7 @@ import click
 import peewee as pw
 
 from ...common.util import pretty_bytes
-from ...db import ArchiveFile, ArchiveFileCopy, database_proxy
+from ...db import ArchiveFile, ArchiveFileCopy, database_proxy, utcnow
 from ..cli import check_then_update, echo
 from ..options import (
     check_if_from_stdin,
@@ -122,7 +122,7 @@ def _run_query(
         if update:
             # Do the update
             count = (
-                ArchiveFileCopy.update(has_file=verify_goal)
+                ArchiveFileCopy.update(has_file=verify_goal, last_update=utcnow())
                 .where(ArchiveFileCopy.id << copies)
                 .execute()
             )
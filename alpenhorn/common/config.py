@@ -109,9 +109,32 @@ Example config:
         # Default number of worker threads
         num_workers: 4
 
+        # Time (in seconds) after which a task waiting in the task queue is
+        # run as if it had the highest priority
+        queue_starvation_time: 600
+
+        # How to compute MD5 hashes of files: "thread" computes them in the
+        # worker thread doing the I/O; "process" offloads them to a pool of
+        # hash_processes worker processes (default: one per CPU).
+        hash_engine: thread
+        hash_processes: 8
+
+        # Size of the reads used when computing MD5 hashes.  May include a
+        # suffix: k, M, or G.
+        hash_block_size: 8M
+
         # Minimum time length (in seconds) between updates
         update_interval: 60
 
+        # Optional path to a UNIX socket on which the daemon listens for
+        # wake-ups.  The alpenhorn CLI pokes this socket after creating new
+        # requests, causing the daemon to start its next update early.
+        wakeup_socket: /run/alpenhorn/wakeup.sock
+
+        # Minimum time length (in seconds) between updates when woken up
+        # via the wakeup_socket
+        min_update_interval: 1
+
         # Minimum number of copies of a file which must exist on archive nodes
         # before any other copy of the file can be deleted.
         #
@@ -125,10 +148,26 @@ Example config:
         # import.
         auto_import_interval: 30
 
+        # Number of seconds without filesystem events for a file before the
+        # auto-import watchdog imports it.  Events for the same file within
+        # this period are coalesced into a single import.  Setting this to
+        # zero imports files as soon as they appear.
+        auto_import_quiet_period: 2
+
+        # Maximum number of new files found by a node scan or the auto-import
+        # watchdog to import in a single task.  The database records for these
+        # files are looked up and created in bulk.  Setting this to one imports
+        # files one at a time.
+        import_batch_size: 100
+
         # Minimum number of days to wait from the last update of a file copy
         # record before auto-verifying the file
         auto_verify_min_days: 7
 
+        # Maximum number of suspect file copies (has_file == 'M') on a node
+        # to dispatch for checking per update loop
+        max_checks_per_update: 1000
+
         # Maximum time (in seconds) to run serial I/O per update loop (these
         # are I/O run tasks in the main thread, in cases when there are no
         # worker threads
@@ -10,6 +10,11 @@ from __future__ import annotations
 import importlib
 import logging
 import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+from typing import Any
 
 from click import ClickException
 
@@ -209,3 +214,67 @@ def io_extension(name: str) -> extapi.IOClassExtension | InternalIO | None:
     """
 
     return _io_ext.get(name, None)
+
+
+class DetectCache:
+    """A thread-safe LRU cache with expiring entries.
+
+    Intended for use by import-detect extensions to memoise the results of
+    expensive detection steps, e.g. per acquisition directory, since
+    alpenhorn typically imports many files from the same directory in
+    quick succession.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        The maximum number of entries in the cache.  When full, the least
+        recently used entry is evicted to make room for a new one.
+    ttl : float or None, optional
+        The maximum time, in seconds, an entry remains valid after being
+        added.  If None, entries don't expire.
+    """
+
+    __slots__ = ["_entries", "_lock", "maxsize", "ttl"]
+
+    def __init__(self, maxsize: int = 1024, ttl: float | None = 600) -> None:
+        if maxsize < 1:
+            raise ValueError(f"maxsize non-positive (={maxsize})")
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        # Values are (expiry, value) pairs
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any:
+        """Return the cached value for `key`.
+
+        Raises
+        ------
+        KeyError
+            `key` isn't in the cache, or its entry has expired.
+        """
+        with self._lock:
+            expiry, value = self._entries[key]
+            if expiry is not None and expiry < time.monotonic():
+                del self._entries[key]
+                raise KeyError(key)
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Add `value` to the cache under `key`."""
+        expiry = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[key] = (expiry, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Empty the cache."""
+        with self._lock:
+            self._entries.clear()
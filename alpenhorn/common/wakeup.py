@@ -0,0 +1,131 @@
+"""Wake-up channel between the alpenhorn CLI and alpenhornd.
+
+If the config parameter "daemon.wakeup_socket" is set to a path, alpenhornd
+listens for datagrams on a UNIX socket at that path while waiting between
+update loops.  Receiving anything on the socket causes the daemon to start
+its next update loop early (though no sooner than "daemon.min_update_interval"
+seconds after the start of the previous update loop).
+
+The alpenhorn CLI pokes the socket after creating new requests which the
+daemon needs to handle, if the socket exists.  Poking the socket is always
+optional: if the daemon isn't listening (or is running on another host), the
+new requests will be handled in the next regular update loop.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import pathlib
+import select
+import socket
+
+from . import config
+
+log = logging.getLogger(__name__)
+
+
+def socket_path() -> pathlib.Path | None:
+    """Return the path to the wake-up socket, or None if not configured."""
+
+    path = config.get("daemon.wakeup_socket", default=None, as_type=str)
+    if not path:
+        return None
+    return pathlib.Path(path)
+
+
+def poke() -> bool:
+    """Poke the daemon's wake-up socket, if there is one.
+
+    Failure to poke the socket is not an error.
+
+    Returns
+    -------
+    bool
+        True if the socket was poked.  False otherwise.
+    """
+
+    path = socket_path()
+    if path is None:
+        return False
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.setblocking(False)
+            sock.sendto(b"\0", str(path))
+    except OSError as e:
+        # Socket missing, no one listening, socket buffer full, etc.
+        log.debug(f"Unable to poke wake-up socket {path}: {e}")
+        return False
+
+    return True
+
+
+class WakeupListener:
+    """The daemon side of the wake-up channel.
+
+    Creates and binds the wake-up socket.  If a file already exists
+    at `path`, it is replaced.
+
+    Parameters
+    ----------
+    path : pathlib.Path
+        The path to the socket.
+
+    Raises
+    ------
+    OSError
+        The socket couldn't be created.
+    """
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+
+        # Remove stale socket left behind by a previous daemon
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.setblocking(False)
+        self._sock.bind(str(path))
+
+        # Allow any local user who can reach the socket to poke it
+        os.chmod(path, 0o777)
+
+    def wait(self, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for a poke.
+
+        Any pending pokes are consumed.
+
+        Parameters
+        ----------
+        timeout : float
+            Maximum time to wait, in seconds.
+
+        Returns
+        -------
+        bool
+            True if the socket was poked.  False on timeout.
+        """
+        ready, _, _ = select.select([self._sock], [], [], max(timeout, 0))
+        if not ready:
+            return False
+
+        # Drain the socket, so many pokes result in a single wake-up.
+        while True:
+            try:
+                self._sock.recv(64)
+            except BlockingIOError:
+                break
+
+        return True
+
+    def close(self) -> None:
+        """Close and remove the socket."""
+        self._sock.close()
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
@@ -6,4 +6,4 @@ from .update import host
 
 # These classes are used by extensions, so let's import them into the daemon
 # base
-from .update import UpdateableNode, UpdateableGroup, RemoteNode
+from .update import UpdateableNode, UpdateableGroup, RemoteNode, remote_node
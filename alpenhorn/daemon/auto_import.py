@@ -10,7 +10,9 @@ from __future__ import annotations
 import logging
 import os
 import pathlib
-from collections.abc import Generator
+import threading
+import time
+from collections.abc import Callable, Generator
 
 import peewee as pw
 from watchdog.events import FileSystemEventHandler
@@ -22,13 +24,21 @@ from ..db import (
     ArchiveFile,
     ArchiveFileCopy,
     ArchiveFileImportRequest,
+    database_proxy,
     utcnow,
 )
-from .scheduler import FairMultiFIFOQueue, Task
+from .metrics import Metric
+from .scheduler import PRIORITY_IMPORT, FairMultiFIFOQueue, Task
 from .update import UpdateableNode
 
 log = logging.getLogger(__name__)
 
+# How often (in files) scan() updates its progress metric
+_SCAN_METRIC_INTERVAL = 1000
+
+# The number of new files hashed per task during a batched import
+_HASH_BATCH_SIZE = 10
+
 
 def import_file(
     node: UpdateableNode,
@@ -36,6 +46,7 @@ def import_file(
     path: pathlib.PurePath,
     register: bool,
     req: ArchiveFileImportRequest | None,
+    is_file: bool = False,
 ) -> None:
     """Queue a task to import `path` into `node`.
 
@@ -56,6 +67,9 @@ def import_file(
         This will be None when the import request was triggered by the auto-import
         watchdog.  Otherwise, this is the import request which is being handled.
         If not None, req will be marked as complete if the import isn't skipped.
+    is_file : bool, optional
+        If True, `path` is already known to be a regular file (because it
+        was found by `node.io.file_walk`), so the import task won't check.
     """
 
     path = pathlib.PurePath(path)
@@ -97,8 +111,9 @@ def import_file(
         func=_import_file,
         queue=queue,
         key=node.io.fifo,
-        args=(node, path, register, req),
+        args=(node, path, register, req, is_file),
         name=f"Import {path} on {node.name}",
+        priority=PRIORITY_IMPORT,
         # If the job fails due to DB connection loss, and we don't have a request,
         # re-start the task because unlike tasks made in the main loop, we're
         # never going to revisit this.
@@ -106,12 +121,89 @@ def import_file(
     )
 
 
+def _detect_many(
+    node: UpdateableNode, paths: list[pathlib.PurePath]
+) -> list[tuple[str | None, Callable | None, str | None]]:
+    """Run import detection on `paths`.
+
+    Steps through the import detect extensions to find one that's willing
+    to handle each file, and then vets the acquisition name it returns.
+    Extensions providing `detect_many` are passed all the remaining
+    undetected files at once.
+
+    Parameters
+    ----------
+    node : UpdateableNode
+        The node we're importing onto
+    paths : list of pathlib.PurePath
+        The paths to detect, relative to `node.root`.
+
+    Returns
+    -------
+    results : list of tuples
+        One (acq_name, callback, result) tuple per path, in order.
+        `acq_name` is the name of the acquisition, or None if detection
+        failed; `callback` is the callback returned by the extension; and
+        `result` is None, or, if detection failed, the import request result
+        to report.
+    """
+    detected = [None] * len(paths)
+
+    # Indices of the paths not yet detected
+    remaining = list(range(len(paths)))
+
+    for extension in extload.import_detection():
+        if not remaining:
+            break
+
+        if extension.detect_many is not None:
+            results = list(extension.detect_many([paths[i] for i in remaining], node))
+            if len(results) != len(remaining):
+                log.error(
+                    f'Ignoring import detect extension "{extension.full_name}": '
+                    f"detect_many returned {len(results)} results for "
+                    f"{len(remaining)} paths."
+                )
+                continue
+        else:
+            results = [extension.detect(paths[i], node) for i in remaining]
+
+        undetected = []
+        for i, (acq_name, callback) in zip(remaining, results):
+            if acq_name is None:
+                undetected.append(i)
+            else:
+                log.debug(f'import detect succeeded using "{extension.full_name}"')
+                detected[i] = (acq_name, callback)
+        remaining = undetected
+
+    results = []
+    for path, item in zip(paths, detected):
+        if item is None:
+            # Detection failed, so we're done.
+            log.info(f"Not importing non-acquisition path: {path}")
+            results.append((None, None, "no detection"))
+            continue
+
+        # Vet acq_name from extension
+        acq_name, callback = item
+        rejection_reason = invalid_import_path(str(acq_name))
+        if rejection_reason:
+            log.warning(f'Rejecting invalid acq path "{acq_name}": {rejection_reason}')
+            results.append((None, None, "bad acq"))
+        else:
+            results.append((acq_name, callback, None))
+
+    return results
+
+
 def _import_file(
     task: Task,
     node: UpdateableNode,
     path: pathlib.PurePath,
     register: bool,
     req: ArchiveFileImportRequest | None,
+    is_file: bool = False,
 ) -> Generator[int]:
     """Import `path` on `node` into the DB.  This is run by a worker.
 
@@ -128,11 +220,13 @@ def _import_file(
         or False to only import already registered files.
     req : ArchiveFileImportRequest or None
         If not None, req will be marked as complete if the import isn't skipped.
+    is_file : bool, optional
+        If True, skip checking whether `path` is a regular file.
     """
 
     # Skip non-files
     fullpath = pathlib.Path(node.db.root).joinpath(path)
-    if fullpath.is_symlink() or not fullpath.is_file():
+    if not is_file and (fullpath.is_symlink() or not fullpath.is_file()):
         log.info(f'Not importing "{path}": not a file.')
         if req:
             req.complete("non-file")
@@ -160,26 +254,10 @@ def _import_file(
         # In this case we don't complete the import request.
         return
 
-    # Step through the detection extensions to find one that's willing
-    # to handle this file
-    for extension in extload.import_detection():
-        acq_name, callback = extension.detect(path, node)
-        if acq_name is not None:
-            log.debug(f'import detect succeeded using "{extension.full_name}"')
-            break
-    else:
-        # Detection failed, so we're done.
-        log.info(f"Not importing non-acquisition path: {path}")
+    acq_name, callback, result = _detect_many(node, [path])[0]
+    if acq_name is None:
         if req:
-            req.complete("no detection")
-        return
-
-    # Vet acq_name from extension
-    rejection_reason = invalid_import_path(str(acq_name))
-    if rejection_reason:
-        log.warning(f'Rejecting invalid acq path "{acq_name}": {rejection_reason}')
-        if req:
-            req.complete("bad acq")
+            req.complete(result)
         return
 
     file_name = path.relative_to(acq_name)
@@ -305,6 +383,389 @@ def _import_file(
         callback(copy, new_file, new_acq, node)
 
 
+def import_batch(
+    node: UpdateableNode,
+    queue: FairMultiFIFOQueue,
+    paths: list[pathlib.PurePath],
+    register: bool,
+) -> None:
+    """Queue a task to import several files into `node`.
+
+    The result is the same as calling `import_file` on each of the `paths`,
+    but the database records are looked up and created in bulk.  Used by
+    `scan`.  Unlike `import_file`, there's no import request to report to.
+
+    Parameters
+    ----------
+    node : UpdateableNode
+        The node we're importing onto
+    queue : FairMultiFIFOQueue
+        The tasks queue
+    paths : list of pathlib.PurePath
+        The regular files to import, relative to `node.root`.
+    register : bool
+        True if we should register new files (files without ArchiveFile records),
+        or False to only import already registered files.
+    """
+    Task(
+        func=_import_batch,
+        queue=queue,
+        key=node.io.fifo,
+        args=(node, queue, paths, register),
+        name=f"Import {len(paths)} files on {node.name}",
+        priority=PRIORITY_IMPORT,
+        # Like scan(), we're never going to revisit this, so re-start the
+        # task if it fails due to DB connection loss.
+        requeue=True,
+    )
+
+
+def _insert_new(model: type[pw.Model], rows: list[dict]) -> list[dict]:
+    """Insert `rows` into the table of `model`, skipping existing records.
+
+    Parameters
+    ----------
+    model : peewee.Model subclass
+        The table to insert into.
+    rows : list of dicts
+        The records to insert.
+
+    Returns
+    -------
+    inserted : list of dicts
+        The elements of `rows` which this call inserted.  Rows which
+        violated a uniqueness constraint (i.e. which someone else created
+        first) are omitted.
+    """
+    if not rows:
+        return []
+
+    # Try them all at once first
+    try:
+        with database_proxy.atomic():
+            model.insert_many(rows).execute()
+        return rows
+    except pw.IntegrityError:
+        pass
+
+    # Otherwise, insert them one at a time to find out which ones are ours
+    inserted = []
+    for row in rows:
+        try:
+            with database_proxy.atomic():
+                model.insert(row).execute()
+            inserted.append(row)
+        except pw.IntegrityError:
+            pass
+    return inserted
+
+
+def _import_batch(
+    task: Task,
+    node: UpdateableNode,
+    queue: FairMultiFIFOQueue,
+    paths: list[pathlib.PurePath],
+    register: bool,
+) -> None:
+    """Import `paths` on `node` into the DB.  This is run by a worker.
+
+    Files which need registering are hashed in further tasks, `_HASH_BATCH_SIZE`
+    files at a time, so that they can be hashed in parallel.
+
+    Parameters
+    ----------
+    task : task.Task
+        The task running this function
+    node : UpdateableNode
+        The node we are processing.
+    queue : FairMultiFIFOQueue
+        The tasks queue
+    paths : list of pathlib.PurePath
+        The paths to import, relative to `node.root`.  These must be
+        regular files.
+    register : bool
+        True if we should register new files (files without ArchiveFile records),
+        or False to only import already registered files.
+    """
+
+    # Vet the files
+    vetted = []
+    for path in paths:
+        log.debug(f'Considering "{path}" for import to node {node.name}.')
+
+        # Skip files with a leading dot
+        if path.name[0] == ".":
+            log.info(f'Not importing "{path}": filename starts with a dot.')
+            continue
+
+        # Files which aren't ready are handed off to a regular import task,
+        # which will wait for them.
+        if not node.io.ready_path(path):
+            log.info(f'Path "{path}" not ready for I/O during import.')
+            import_file(node, queue, path, register, None, is_file=True)
+            continue
+
+        # Skip the file if there is still a lock on it.
+        if node.io.locked(path):
+            log.info(f'Skipping "{path}": locked.')
+            continue
+
+        vetted.append(path)
+
+    # Detect the files.  This is a list of
+    # (path, acq_name, file_name, callback) tuples
+    detected = [
+        (path, str(acq_name), str(path.relative_to(acq_name)), callback)
+        for path, (acq_name, callback, _) in zip(vetted, _detect_many(node, vetted))
+        if acq_name is not None
+    ]
+
+    if not detected:
+        return
+
+    # Find the acquisitions
+    acq_names = {item[1] for item in detected}
+    acqs = {
+        acq.name: acq
+        for acq in ArchiveAcq.select().where(ArchiveAcq.name << list(acq_names))
+    }
+    for acq_name in acq_names:
+        if acq_name in acqs:
+            log.debug(f'Acquisition "{acq_name}" already in DB.')
+
+    # Add missing acqusitions, if necessary.  As in _import_file, any created
+    # by someone else in the meantime aren't reported as new.
+    new_acqs = {}
+    missing = acq_names - acqs.keys()
+    if missing and register:
+        created = {
+            row["name"]
+            for row in _insert_new(ArchiveAcq, [{"name": name} for name in missing])
+        }
+        for acq in ArchiveAcq.select().where(ArchiveAcq.name << list(missing)):
+            if acq.name in created:
+                log.info(f'Acquisition "{acq.name}" added to DB.')
+                new_acqs[acq.name] = acq
+            else:
+                log.debug(f'Acquisition "{acq.name}" already in DB.')
+            acqs[acq.name] = acq
+
+    # Find the files
+    files = {
+        (file_.acq_id, file_.name): file_
+        for file_ in ArchiveFile.select().where(
+            ArchiveFile.acq << [acq.id for acq in acqs.values()],
+            ArchiveFile.name << list({item[2] for item in detected}),
+        )
+    }
+
+    # Sort into files we can import now and files which need registering.
+    # As with _import_file, new_acq is only passed on with the first file
+    # in the new acquisition.
+    found = []
+    unregistered = []
+    for path, acq_name, file_name, callback in detected:
+        acq = acqs.get(acq_name)
+        if acq is None:
+            log.info(f'Not importing unregistered acquistion: "{acq_name}".')
+            continue
+        new_acq = new_acqs.pop(acq_name, None)
+
+        file_ = files.get((acq.id, file_name))
+        if file_ is not None:
+            log.debug(f'File "{path}" already in DB.')
+            file_.acq = acq
+            found.append((path, file_, None, new_acq, callback))
+        elif register:
+            unregistered.append((path, acq, file_name, new_acq, callback))
+        else:
+            log.info(f'Not importing unregistered file: "{path}".')
+
+    # Hash and register the new files in separate tasks
+    for start in range(0, len(unregistered), _HASH_BATCH_SIZE):
+        chunk = unregistered[start : start + _HASH_BATCH_SIZE]
+        Task(
+            func=_register_batch,
+            queue=queue,
+            key=node.io.fifo,
+            args=(node, chunk),
+            name=f"Register {len(chunk)} files on {node.name}",
+            priority=PRIORITY_IMPORT,
+            requeue=True,
+        )
+
+    _import_copies(node, found)
+
+
+def _register_batch(
+    task: Task,
+    node: UpdateableNode,
+    items: list[tuple],
+) -> None:
+    """Hash and register new files found by `_import_batch`.
+
+    This is run by a worker.
+
+    Parameters
+    ----------
+    task : task.Task
+        The task running this function
+    node : UpdateableNode
+        The node we are processing.
+    items : list of tuples
+        The files to register, as (path, acq, file_name, new_acq, callback)
+        tuples.
+    """
+
+    # Hash the files
+    rows = []
+    for path, acq, file_name, new_acq, callback in items:
+        log.debug(f'Computing md5sum of "{path}".')
+        rows.append(
+            {
+                "acq": acq,
+                "name": file_name,
+                "size_b": node.io.filesize(path),
+                "md5sum": node.io.md5(acq.name, file_name),
+            }
+        )
+
+    # Anything already present was created by someone else while we were
+    # hashing.  As in _import_file, we don't overwrite those, or report
+    # them as new.
+    created = {(row["acq"].id, row["name"]) for row in _insert_new(ArchiveFile, rows)}
+
+    files = {
+        (file_.acq_id, file_.name): file_
+        for file_ in ArchiveFile.select().where(
+            ArchiveFile.acq << list({item[1].id for item in items}),
+            ArchiveFile.name << [item[2] for item in items],
+        )
+    }
+
+    imports = []
+    for path, acq, file_name, new_acq, callback in items:
+        file_ = files.get((acq.id, file_name))
+        if file_ is None:
+            # Shouldn't happen, but just in case
+            log.warning(f'Failed to register "{path}".')
+            continue
+        file_.acq = acq
+        if (acq.id, file_name) in created:
+            log.info(f'File "{path}" added to DB.')
+            new_file = file_
+        else:
+            log.debug(f'File "{path}" already in DB.')
+            new_file = None
+        imports.append((path, file_, new_file, new_acq, callback))
+
+    _import_copies(node, imports)
+
+
+def _import_copies(node: UpdateableNode, items: list[tuple]) -> None:
+    """Create or update the file copies for a batched import.
+
+    Finishes off `_import_batch` and `_register_batch` by doing, for several
+    files at once, what the end of `_import_file` does.
+
+    Parameters
+    ----------
+    node : UpdateableNode
+        The node we are processing.
+    items : list of tuples
+        The files to import, as (path, file_, new_file, new_acq, callback)
+        tuples.
+    """
+    if not items:
+        return
+
+    file_ids = [item[1].id for item in items]
+    copies = {
+        copy.file_id: copy
+        for copy in ArchiveFileCopy.select().where(
+            ArchiveFileCopy.node == node.db, ArchiveFileCopy.file << file_ids
+        )
+    }
+
+    suspect = []
+    restored = []
+    new_copies = []
+    imported = []
+    for item in items:
+        path, file_ = item[:2]
+        copy = copies.get(file_.id)
+        if copy is None:
+            new_copies.append(
+                {
+                    "file": file_,
+                    "node": node.db,
+                    "has_file": "Y",
+                    "wants_file": "Y",
+                    "ready": True,
+                    "size_b": node.io.storage_used(path),
+                    "last_update": utcnow(),
+                }
+            )
+            log.info(f'Imported file copy "{path}" on node "{node.name}".')
+        elif copy.has_file != "N":
+            log.debug(f"Not importing {path}: already known")
+            continue
+        # If we're importing a file that's missing (has_file == N but
+        # wants_file == Y), set has_file='M' to trigger a integrity check.
+        # If it's recorded as having been properly removed, though, just
+        # set it to 'Y' and assume it's good now.
+        elif copy.wants_file == "Y":
+            log.warning(
+                f'Imported missing file "{path}" on node {node.name}.  Marking suspect.'
+            )
+            suspect.append(copy.id)
+        else:
+            restored.append(copy.id)
+            log.info(f'Imported file copy "{path}" on node "{node.name}".')
+        imported.append(item)
+
+    if suspect:
+        ArchiveFileCopy.update(has_file="M", ready=True, last_update=utcnow()).where(
+            ArchiveFileCopy.id << suspect
+        ).execute()
+    if restored:
+        ArchiveFileCopy.update(
+            has_file="Y", wants_file="Y", ready=True, last_update=utcnow()
+        ).where(ArchiveFileCopy.id << restored).execute()
+    if new_copies:
+        # Some of these copies may have been created by someone else since our
+        # initial select.  As in _import_file, we assume another worker is
+        # importing those, and leave the post-import stuff to it.
+        created = {row["file"].id for row in _insert_new(ArchiveFileCopy, new_copies)}
+        duplicates = {row["file"].id for row in new_copies} - created
+        if duplicates:
+            log.debug(
+                f"{len(duplicates)} ArchiveFileCopy records created by another worker!"
+            )
+            imported = [item for item in imported if item[1].id not in duplicates]
+
+    # Fetch the updated copies
+    copies = {
+        copy.file_id: copy
+        for copy in ArchiveFileCopy.select().where(
+            ArchiveFileCopy.node == node.db,
+            ArchiveFileCopy.file << [item[1].id for item in imported],
+        )
+    }
+
+    for path, file_, new_file, new_acq, callback in imported:
+        copy = copies[file_.id]
+        copy.file = file_
+        copy.node = node.db
+
+        # Run post-add actions, if any
+        copy.trigger_autoactions()
+
+        # Run the extension module's callback, if necessary
+        if callable(callback):
+            callback(copy, new_file, new_acq, node)
+
+
 # Watchdog stuff
 # ==============
 
@@ -314,6 +775,12 @@ class RegisterFile(FileSystemEventHandler):
     A watchdog.FileSystemEventHandler subclass handling watchdog
     events on a storage node.
 
+    Events are coalesced before anything is imported: paths are held
+    until no events have been received for them for a quiet period
+    (the config value "daemon.auto_import_quiet_period"), and then
+    imported in batches.  Paths which are locked, or which are no longer
+    regular files, when the quiet period ends are dropped.
+
     Parameters
     ----------
     node : UpdateableNode
@@ -336,29 +803,163 @@ class RegisterFile(FileSystemEventHandler):
         self.queue = queue
         super().__init__()
 
+        self._quiet_period = config.get_float(
+            "daemon.auto_import_quiet_period", default=2, min=0
+        )
+
+        # Pending paths.  Values are the time of the last event for the path.
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._timer = None
+        self._stopped = False
+
+        self._events_metric = Metric(
+            "auto_import_events",
+            "Count of auto-import filesystem events received",
+            counter=True,
+            unbound={"event"},
+            bound={"node": node.name},
+        )
+        self._dispatched_metric = Metric(
+            "auto_import_dispatched",
+            "Count of auto-imports dispatched after coalescing events",
+            counter=True,
+            bound={"node": node.name},
+        )
+
+    def _add(self, path: str | os.PathLike, refresh_only: bool = False) -> None:
+        """Add `path` to the pending paths, or refresh it if already pending.
+
+        If `refresh_only` is True, `path` is only refreshed; it isn't added
+        if not already pending.
+        """
+        path = pathlib.PurePath(path)
+        with self._lock:
+            if refresh_only and path not in self._pending:
+                return
+            self._pending[path] = time.monotonic()
+            self._schedule(self._quiet_period)
+
+        if not self._quiet_period:
+            self.flush()
+
+    def _drop(self, path: str | os.PathLike) -> None:
+        """Remove `path` from the pending paths, if present."""
+        with self._lock:
+            self._pending.pop(pathlib.PurePath(path), None)
+
+    def _schedule(self, delay: float) -> None:
+        """Schedule a flush in `delay` seconds, if none is scheduled.
+
+        Must be called with the lock held.
+        """
+        if self._timer is None and delay and not self._stopped:
+            self._timer = threading.Timer(delay, self._on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _on_timer(self) -> None:
+        """Timer callback."""
+        with self._lock:
+            self._timer = None
+        self.flush()
+
+    def flush(self, force: bool = False) -> None:
+        """Import pending paths whose quiet period has ended.
+
+        Parameters
+        ----------
+        force : bool, optional
+            If True, import all pending paths, quiet or not.
+        """
+        now = time.monotonic()
+        with self._lock:
+            ready = [
+                path
+                for path, last in self._pending.items()
+                if force or now - last >= self._quiet_period
+            ]
+            for path in ready:
+                del self._pending[path]
+
+            # Check back when the next pending path becomes quiet
+            if self._pending:
+                self._schedule(self._quiet_period - (now - min(self._pending.values())))
+
+        root = pathlib.PurePath(self.node.db.root)
+        paths = []
+        for path in ready:
+            try:
+                relpath = path.relative_to(root)
+            except ValueError:
+                continue
+
+            # Skip the node root and the node info file, as import_file does
+            if relpath == pathlib.PurePath(".") or relpath == pathlib.PurePath(
+                "ALPENHORN_NODE"
+            ):
+                continue
+
+            # Skip locked files: they'll be back when the lock is deleted
+            if self.node.io.locked(relpath):
+                log.debug(f'Deferring import of "{relpath}": locked.')
+                continue
+
+            # Skip things which aren't (or are no longer) regular files
+            fullpath = pathlib.Path(path)
+            if fullpath.is_symlink() or not fullpath.is_file():
+                continue
+
+            paths.append(relpath)
+
+        if paths:
+            self._dispatched_metric.add(len(paths))
+            batch_size = config.get_int("daemon.import_batch_size", default=100, min=1)
+            for start in range(0, len(paths), batch_size):
+                _import_found(
+                    self.node, self.queue, paths[start : start + batch_size], True
+                )
+
+    def stop(self) -> None:
+        """Cancel any pending imports."""
+        with self._lock:
+            self._stopped = True
+            self._pending = {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
     def on_created(self, event):
+        self._events_metric.inc(event="created")
         if not event.is_directory and not self._is_dotfile(event.src_path):
-            import_file(
-                self.node, self.queue, pathlib.PurePath(event.src_path), True, None
-            )
-        return
+            self._add(event.src_path)
+
+    def on_modified(self, event):
+        self._events_metric.inc(event="modified")
+        # Modifications only delay the import of files we already know about
+        if not event.is_directory:
+            self._add(event.src_path, refresh_only=True)
 
     def on_moved(self, event):
-        if not event.is_directory and not self._is_dotfile(event.dest_path):
-            import_file(
-                self.node, self.queue, pathlib.PurePath(event.dest_path), True, None
-            )
-        return
+        self._events_metric.inc(event="moved")
+        if not event.is_directory:
+            self._drop(event.src_path)
+            if not self._is_dotfile(event.dest_path):
+                self._add(event.dest_path)
 
     def on_deleted(self, event):
+        self._events_metric.inc(event="deleted")
+        if event.is_directory:
+            return
+
         # For lockfiles: ensure that the file that was locked is added: it is
         # possible that the watchdog notices that a file has been closed before the
         # lockfile is deleted.
-        if not event.is_directory and self._is_lock_file(event.src_path):
+        if self._is_lock_file(event.src_path):
             path = pathlib.Path(event.src_path)
-            import_file(
-                self.node, self.queue, path.with_name(path.name[1:-5]), True, None
-            )
+            self._add(path.with_name(path.name[1:-5]))
+        else:
+            self._drop(event.src_path)
 
 
 # Routines to control the filesystem watchdogs.
@@ -370,6 +971,9 @@ _observers = {}
 # Event watchers.  One per watched node.
 _watchers = {}
 
+# Event handlers.  One per watched node.
+_handlers = {}
+
 
 def update_observer(
     node: UpdateableNode, queue: FairMultiFIFOQueue, force_stop: bool = False
@@ -397,6 +1001,8 @@ def update_observer(
             except KeyError:
                 pass  # wasn't being watched
             del _watchers[node.name]
+        if node.name in _handlers:
+            _handlers.pop(node.name).stop()
     else:
         # If there's already a watcher for this node, do nothing
         if node.name in _watchers:
@@ -425,8 +1031,9 @@ def update_observer(
 
         # Schedule a new watcher for our observer
         log.info(f'Watching node "{node.name}" root "{node.db.root}" for auto import.')
+        _handlers[node.name] = RegisterFile(node, queue)
         _watchers[node.name] = _observers[node.io_class].schedule(
-            RegisterFile(node, queue), node.db.root, recursive=True
+            _handlers[node.name], node.db.root, recursive=True
         )
 
         # Now catch up with the existing files to see if there are any new ones
@@ -444,11 +1051,28 @@ def update_observer(
             key=node.io.fifo,
             args=(node, queue, ".", True, None),
             name=f"Catch-up on {node.name}",
+            priority=PRIORITY_IMPORT,
             # If the job fails due to DB connection loss, re-start it
             requeue=True,
         )
 
 
+def _import_found(
+    node: UpdateableNode,
+    queue: FairMultiFIFOQueue,
+    paths: list[pathlib.PurePath],
+    register: bool,
+) -> None:
+    """Import a batch of new regular files found on `node`.
+
+    Paths must be relative to `node.root`.
+    """
+    if len(paths) == 1:
+        import_file(node, queue, paths[0], register, None, is_file=True)
+    elif paths:
+        import_batch(node, queue, paths, register)
+
+
 def scan(
     task: Task,
     node: UpdateableNode,
@@ -485,13 +1109,25 @@ def scan(
 
     path = pathlib.PurePath(path)
 
-    # Get set of all files that are known on the node
-    already_imported_files = node.db.get_all_files(
-        present=True, corrupt=True, unknown=True
-    )
+    # Bring the inventory of files known on the node up-to-date
+    node.inventory.refresh()
 
     log.info(f'Scanning "{path}" on "{node.name}" for new files.')
 
+    # Progress of the scan.  Updated every _SCAN_METRIC_INTERVAL files
+    progress = Metric(
+        "scan_files",
+        "Count of files examined by node scans",
+        counter=True,
+        unbound={"result"},
+        bound={"node": node.name},
+    )
+    counts = {"known": 0, "new": 0}
+
+    # New files are imported in batches
+    batch_size = config.get_int("daemon.import_batch_size", default=100, min=1)
+    batch = []
+
     lastparent = None
     for file in node.io.file_walk(path):
         # Try to remove node root
@@ -507,10 +1143,25 @@ def scan(
             lastparent = parent
 
         # Skip files already imported
-        if file in already_imported_files:
+        if file in node.inventory:
             log.debug(f'Skipping already-registered file "{file}".')
+            counts["known"] += 1
         else:
-            import_file(node, queue, file, register, None)
+            batch.append(file)
+            counts["new"] += 1
+            if len(batch) >= batch_size:
+                _import_found(node, queue, batch, register)
+                batch = []
+
+        if counts["known"] + counts["new"] >= _SCAN_METRIC_INTERVAL:
+            for result in counts:
+                progress.add(counts[result], result=result)
+                counts[result] = 0
+
+    _import_found(node, queue, batch, register)
+
+    for result in counts:
+        progress.add(counts[result], result=result)
 
     # This is successful because we've successfully scanned the
     # tree, whether or not that resulted in any imports.
@@ -521,9 +1172,11 @@ def scan(
 def stop_observers() -> None:
     """Stop all auto_import watchdogs."""
 
-    global _observers, _watchers
+    global _handlers, _observers, _watchers
 
     # Stop
+    for handler in _handlers.values():
+        handler.stop()
     for obs in _observers.values():
         obs.stop()
 
@@ -532,5 +1185,6 @@ def stop_observers() -> None:
         obs.join()
 
     # Reset globals
+    _handlers = {}
     _observers = {}
     _watchers = {}
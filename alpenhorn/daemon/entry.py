@@ -97,7 +97,11 @@ def entry(ctx, conf, no_integrity, once, test_isolation):
         metrics.start_promclient()
 
     # Set up the task queue
-    queue = FairMultiFIFOQueue()
+    queue = FairMultiFIFOQueue(
+        starvation_time=config.get_float(
+            "daemon.queue_starvation_time", default=600, min=0
+        )
+    )
 
     # If we can be multithreaded, start the worker pool
     if db.threadsafe():
@@ -0,0 +1,219 @@
+"""The FileInventory class"""
+
+from __future__ import annotations
+
+import datetime
+import pathlib
+import sys
+import threading
+import time
+
+import peewee as pw
+from peewee import fn
+
+from ..db import ArchiveAcq, ArchiveFile, ArchiveFileCopy
+from .metrics import Metric
+
+# File copies in these states count as "tracked" on a node.
+_TRACKED = ["Y", "M", "X"]
+
+# Copies updated less than this long before the newest copy previously
+# seen are re-fetched on an incremental refresh, to allow for clock skew
+# between hosts writing to the database.
+_SLACK = datetime.timedelta(minutes=5)
+
+# The inventory is rebuilt from scratch at least this often (in seconds),
+# to catch updates which the incremental refresh can't detect.
+_REBUILD_INTERVAL = 3600
+
+
+class FileInventory:
+    """A cached inventory of the files tracked on a StorageNode.
+
+    A file is tracked on a node if it has an ArchiveFileCopy there with
+    `has_file` one of 'Y', 'M', or 'X'.  This is the set of files
+    `StorageNode.get_all_files(present=True, corrupt=True, unknown=True)`
+    returns, but stored as per-acquisition sets of interned file names,
+    which take much less memory than a set of paths.
+
+    The inventory is populated on the first `refresh`.  Subsequent calls
+    only fetch the file copies whose `last_update` has changed since the
+    previous refresh.  As a safeguard against updates which don't set
+    `last_update`, if the resulting number of tracked files in any
+    acquisition doesn't match the database, the inventory is rebuilt from
+    scratch.  Because that can't catch every such update (e.g. one file
+    going missing while another in the same acquisition is imported), the
+    inventory is also rebuilt every `_REBUILD_INTERVAL` seconds.
+
+    Instances are thread-safe.
+
+    Parameters
+    ----------
+    node_id : int
+        The id of the StorageNode to inventory.
+    name : str
+        The name of the StorageNode.  Used to label metrics.
+    """
+
+    __slots__ = [
+        "_acqs",
+        "_count",
+        "_lock",
+        "_metric",
+        "_node_id",
+        "_rebuilt",
+        "_refreshed",
+        "_watermark",
+    ]
+
+    def __init__(self, node_id: int, name: str) -> None:
+        self._node_id = node_id
+
+        # Maps acq names to sets of file names
+        self._acqs = {}
+        self._count = 0
+
+        # The latest last_update seen, or None if never populated
+        self._watermark = None
+
+        # time.monotonic() of the last refresh and rebuild
+        self._refreshed = None
+        self._rebuilt = None
+
+        self._lock = threading.Lock()
+
+        self._metric = Metric(
+            "file_inventory_refreshes",
+            "Count of node file inventory refreshes",
+            counter=True,
+            unbound={"kind"},
+            bound={"node": name},
+        )
+
+    @property
+    def node_id(self) -> int:
+        """The id of the inventoried StorageNode."""
+        return self._node_id
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, path: str | pathlib.PurePath) -> bool:
+        """Is `path` tracked on the node?
+
+        Parameters
+        ----------
+        path : path-like
+            The path to check, relative to the node root.
+        """
+        parts = pathlib.PurePath(path).parts
+
+        # Because both acq names and file names may contain directories,
+        # we have to try every split of the path.
+        for split in range(1, len(parts)):
+            names = self._acqs.get(str(pathlib.PurePath(*parts[:split])))
+            if names is not None and str(pathlib.PurePath(*parts[split:])) in names:
+                return True
+        return False
+
+    def _query(self, *where: pw.Expression) -> pw.Select:
+        """Select copies on the node, with their acq and file names."""
+        return (
+            ArchiveFileCopy.select(
+                ArchiveAcq.name,
+                ArchiveFile.name,
+                ArchiveFileCopy.has_file,
+                ArchiveFileCopy.last_update,
+            )
+            .join(ArchiveFile)
+            .join(ArchiveAcq)
+            .where(ArchiveFileCopy.node == self._node_id, *where)
+            .tuples()
+        )
+
+    def _apply(self, rows: pw.Select) -> None:
+        """Update the inventory from the rows of `self._query()`."""
+        acqs = self._acqs
+        for acq_name, file_name, has_file, last_update in rows.iterator():
+            if self._watermark is None or last_update > self._watermark:
+                self._watermark = last_update
+
+            if has_file in _TRACKED:
+                names = acqs.get(acq_name)
+                if names is None:
+                    names = acqs[sys.intern(acq_name)] = set()
+                if file_name not in names:
+                    names.add(sys.intern(file_name))
+                    self._count += 1
+            else:
+                names = acqs.get(acq_name)
+                if names is not None and file_name in names:
+                    names.discard(file_name)
+                    self._count -= 1
+                    if not names:
+                        del acqs[acq_name]
+
+    def _rebuild(self) -> None:
+        """Rebuild the inventory from scratch."""
+        self._acqs = {}
+        self._count = 0
+        self._watermark = None
+        self._apply(self._query(ArchiveFileCopy.has_file << _TRACKED))
+
+        # If there were no copies, set the watermark to something so we
+        # don't keep rebuilding.
+        if self._watermark is None:
+            self._watermark = datetime.datetime.min + _SLACK
+
+        self._rebuilt = time.monotonic()
+        self._metric.inc(kind="rebuild")
+
+    def _counts_match(self) -> bool:
+        """Do the per-acquisition file counts match the database?"""
+        counts = dict(
+            ArchiveFileCopy.select(ArchiveAcq.name, fn.COUNT(ArchiveFileCopy.id))
+            .join(ArchiveFile)
+            .join(ArchiveAcq)
+            .where(
+                ArchiveFileCopy.node == self._node_id,
+                ArchiveFileCopy.has_file << _TRACKED,
+            )
+            .group_by(ArchiveAcq.name)
+            .tuples()
+        )
+        return counts == {
+            acq_name: len(names) for acq_name, names in self._acqs.items()
+        }
+
+    def refresh(self, max_age: float | None = None) -> None:
+        """Bring the inventory up-to-date with the database.
+
+        Parameters
+        ----------
+        max_age : float, optional
+            If given, and the inventory was refreshed less than this many
+            seconds ago, do nothing.
+        """
+        with self._lock:
+            if (
+                max_age is not None
+                and self._refreshed is not None
+                and time.monotonic() - self._refreshed < max_age
+            ):
+                return
+
+            if (
+                self._watermark is None
+                or time.monotonic() - self._rebuilt >= _REBUILD_INTERVAL
+            ):
+                self._rebuild()
+            else:
+                self._apply(
+                    self._query(ArchiveFileCopy.last_update >= self._watermark - _SLACK)
+                )
+                self._metric.inc(kind="incremental")
+
+                if not self._counts_match():
+                    self._rebuild()
+
+            self._refreshed = time.monotonic()
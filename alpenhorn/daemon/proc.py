@@ -5,17 +5,26 @@ from __future__ import annotations
 import asyncio
 import hashlib
 import logging
+import multiprocessing
+import multiprocessing.connection
 import os
+import queue
 import subprocess
+import threading
 from collections.abc import Callable
-from typing import Any
+from typing import Any, BinaryIO
 
-from ..common import util
+from ..common import config, util
 from .metrics import Metric
 
 log = logging.getLogger(__name__)
 
 
+# Time (in seconds) given to a process to exit after being sent SIGTERM
+# by run_command, before it is killed.
+_TERMINATE_GRACE = 10
+
+
 def run_command(
     cmd: list[str], timeout: float | None = None, **kwargs
 ) -> tuple[int | None, str, str]:
@@ -26,8 +35,9 @@ def run_command(
     cmd : list of strings
         A command as a list of strings including all arguments.
     timeout : float or None
-        Number of seconds to wait before forceably killing the process,
-        or None to wait forever.
+        Number of seconds to wait before terminating the process,
+        or None to wait forever.  A process which doesn't exit within
+        `_TERMINATE_GRACE` seconds of being terminated is killed.
 
     Other keyword args are passed directly on to subprocess.Popen
 
@@ -53,7 +63,14 @@ def run_command(
         retval = proc.returncode
     except subprocess.TimeoutExpired:
         log.warning(f"Process overrun [timeout={timeout}]: " + " ".join(cmd))
-        proc.kill()
+        # Ask nicely first, to give the process a chance to clean up (e.g.
+        # to let rsync save a partial transfer), before killing it.
+        proc.terminate()
+        try:
+            proc.communicate(timeout=_TERMINATE_GRACE)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
         return (None, "", "")
 
     return (
@@ -108,46 +125,114 @@ def timeout_call(func: Callable, timeout: float, /, *args: Any, **kwargs: Any) -
     return asyncio.run(_async_wrapper(func, timeout, args, kwargs))
 
 
-async def _md5sum_file(filename: str | os.PathLike) -> str | None:
-    """asyncio implementation of md5sum_file().
+# The MD5 timeout: hashing will be abandoned if it takes longer than
+# _MD5_TIMEOUT seconds to hash _MD5_CHUNK bytes of a file
+_MD5_TIMEOUT = 600  # ten minutes
+_MD5_CHUNK = 32 * 1024 * 1024  # 32 MiB
 
-    Aborts and returns None if computation is too slow.
+# The worker pool used by the "process" hashing engine and its lock
+_hash_pool = None
+_hash_pool_lock = threading.Lock()
 
-    (Specifically: if it takes more than ten minutes to
-    read and compute the hash of 32MiB of the file.)
+
+def hash_block_size() -> int:
+    """Size of reads used when hashing, from the config."""
+    return config.get_bytes("daemon.hash_block_size", default="8M")
+
+
+def _fadvise(f: BinaryIO, offset: int, length: int, advice: int) -> None:
+    """Call posix_fadvise on `f`, if possible.
+
+    The advice is only a hint, so failure is ignored.
     """
+    try:
+        os.posix_fadvise(f.fileno(), offset, length, advice)
+    except (AttributeError, OSError):
+        # Platform doesn't support it or the file can't be advised
+        pass
 
-    block_size = 256 * 128  # 32,768 bytes
 
-    # This is here just to reduce the number of times
-    # we have to spin up the async.  Has not been tuned.
-    blocks_per_chunk = 1024  # ie. chunks are 32MiB
+def _md5_chunk(
+    f: BinaryIO, md5: Any, buf: bytearray, chunk_size: int, drop_cache: bool = False
+) -> bool:
+    """MD5 a "chunk" of a file.
 
-    md5 = hashlib.md5()
+    Reads up to `chunk_size` bytes from `f` into the reusable buffer `buf`,
+    one buffer-full at a time, and feeds them to `md5`.
+
+    Parameters
+    ----------
+    f : file
+        The file being hashed, opened in binary mode
+    md5 : hashlib.md5
+        The hash object to update
+    buf : bytearray
+        The read buffer
+    chunk_size : int
+        The maximum number of bytes to read
+    drop_cache : bool, optional
+        If True, advise the kernel that the data read won't be needed again,
+        so it can be dropped from the page cache.
 
-    def _md5_chunk(f, md5, block_size, blocks_per_chunk):
-        """MD5 a "chunk" of a file.
+    Returns
+    -------
+    bool
+        True if EOF was reached.
+    """
+    view = memoryview(buf)
+    start = f.tell()
+    remaining = chunk_size
+    eof = False
+    while remaining > 0:
+        size = f.readinto(view[:remaining] if remaining < len(buf) else view)
+        if not size:
+            eof = True
+            break
+        md5.update(view[:size])
+        remaining -= size
+
+    if drop_cache and chunk_size > remaining:
+        _fadvise(
+            f, start, chunk_size - remaining, getattr(os, "POSIX_FADV_DONTNEED", 0)
+        )
+
+    return eof
+
+
+def _md5_open(filename: str | os.PathLike) -> BinaryIO:
+    """Open `filename` for hashing.
+
+    Unbuffered, since we read into our own buffer, and advised for
+    sequential reading.
+    """
+    f = open(filename, "rb", buffering=0)
+    _fadvise(f, 0, 0, getattr(os, "POSIX_FADV_SEQUENTIAL", 0))
+    return f
 
-        This function is run in a asyncio thread."""
 
-        block_count = 0
-        for block in iter(lambda: f.read(block_size), b""):
-            md5.update(block)
-            block_count += 1
-            if block_count >= blocks_per_chunk:
-                return False
+async def _md5sum_file(
+    filename: str | os.PathLike, block_size: int, drop_cache: bool
+) -> str | None:
+    """asyncio implementation of the "thread" hashing engine.
 
-        return True
+    Aborts and returns None if computation is too slow.
+
+    (Specifically: if it takes more than ten minutes to
+    read and compute the hash of 32MiB of the file.)
+    """
+
+    buf = bytearray(block_size)
+    md5 = hashlib.md5()
 
-    with open(filename, "rb") as f:
+    with _md5_open(filename) as f:
         eof = False
         while not eof:
             try:
                 # Here we're going to timeout if it takes more than 10 minutes to
                 # MD5 a "chunk" (i.e. 32 MiB), which should be extremely conservative
-                async with asyncio.timeout(600):
+                async with asyncio.timeout(_MD5_TIMEOUT):
                     eof = await asyncio.to_thread(
-                        _md5_chunk, f, md5, block_size, blocks_per_chunk
+                        _md5_chunk, f, md5, buf, _MD5_CHUNK, drop_cache
                     )
             except TimeoutError:
                 log.warning(f"Timeout trying to MD5 {filename}.")
@@ -156,31 +241,239 @@ async def _md5sum_file(filename: str | os.PathLike) -> str | None:
     return md5.hexdigest()
 
 
-def md5sum_file(filename: str | os.PathLike) -> str | None:
+def _hash_worker(conn: multiprocessing.connection.Connection) -> None:
+    """Main loop of a "process" hashing engine worker.
+
+    Requests are received over `conn` as (filename, block_size, drop_cache,
+    chunk_size) tuples.  A ("progress", None) message is sent after each
+    chunk of the file is hashed, and then either ("done", md5) or
+    ("error", exception).  The worker exits when `conn` is closed.
+    """
+    while True:
+        try:
+            filename, block_size, drop_cache, chunk_size = conn.recv()
+        except EOFError:
+            return
+
+        try:
+            buf = bytearray(block_size)
+            md5 = hashlib.md5()
+            with _md5_open(filename) as f:
+                while not _md5_chunk(f, md5, buf, chunk_size, drop_cache):
+                    conn.send(("progress", None))
+            conn.send(("done", md5.hexdigest()))
+        except Exception as e:
+            conn.send(("error", e))
+
+
+class _HashWorker:
+    """A dedicated worker process of the "process" hashing engine."""
+
+    __slots__ = ["_conn", "_process"]
+
+    def __init__(self) -> None:
+        # Spawn, rather than fork, since the daemon is multithreaded
+        context = multiprocessing.get_context("spawn")
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(
+            target=_hash_worker, args=(child_conn,), daemon=True
+        )
+        self._process.start()
+        child_conn.close()
+
+    @property
+    def alive(self) -> bool:
+        """Is the worker process running?"""
+        return self._process.is_alive()
+
+    def close(self) -> None:
+        """Stop the worker process."""
+        self._conn.close()
+        self._process.join(timeout=10)
+        if self._process.is_alive():
+            self.kill()
+
+    def kill(self) -> None:
+        """Kill the worker process."""
+        self._conn.close()
+        self._process.kill()
+        self._process.join()
+
+    def md5sum(
+        self, filename: str | os.PathLike, block_size: int, drop_cache: bool
+    ) -> str:
+        """Hash `filename` in the worker.
+
+        Raises
+        ------
+        TimeoutError
+            The worker took longer than `_MD5_TIMEOUT` seconds to hash
+            `_MD5_CHUNK` bytes of the file.
+        EOFError
+            The worker died.
+
+        Errors hashing the file are re-raised as-is.
+        """
+        try:
+            self._conn.send((os.fspath(filename), block_size, drop_cache, _MD5_CHUNK))
+            while ready := self._conn.poll(_MD5_TIMEOUT):
+                kind, value = self._conn.recv()
+                if kind != "progress":
+                    break
+        except OSError as e:
+            raise EOFError(e) from e
+
+        if not ready:
+            raise TimeoutError
+        if kind == "error":
+            raise value
+        return value
+
+
+class _HashPool:
+    """The worker processes of the "process" hashing engine.
+
+    Workers are started on first use.  Each one hashes one file at a time,
+    so up to `size` files can be hashed at once.  A worker which stops
+    making progress is killed and, later, replaced.  Other workers are
+    unaffected.
+
+    Instances are thread-safe.
+
+    Parameters
+    ----------
+    size : int
+        The maximum number of worker processes.
+    """
+
+    __slots__ = ["_free"]
+
+    def __init__(self, size: int) -> None:
+        # Idle workers, or None for workers not yet (re-)started.  LIFO, so
+        # that under light load the same worker is re-used.
+        self._free = queue.LifoQueue()
+        for _ in range(size):
+            self._free.put(None)
+
+    def close(self) -> None:
+        """Stop the idle workers."""
+        while True:
+            try:
+                worker = self._free.get_nowait()
+            except queue.Empty:
+                return
+            if worker is not None:
+                worker.close()
+
+    def md5sum(
+        self, filename: str | os.PathLike, block_size: int, drop_cache: bool
+    ) -> str | None:
+        """Hash `filename` in a worker.
+
+        Waits for a worker to become free, if they're all busy.  Returns
+        None on timeout.
+        """
+        worker = self._free.get()
+        try:
+            # If the worker dies unexpectedly, try once more in a new one
+            for attempt in range(2):
+                if worker is None or not worker.alive:
+                    worker = _HashWorker()
+                try:
+                    return worker.md5sum(filename, block_size, drop_cache)
+                except TimeoutError:
+                    log.warning(f"Timeout trying to MD5 {filename}.")
+                    worker.kill()
+                    worker = None
+                    return None
+                except EOFError as e:
+                    log.info(f"Hash worker died while trying to MD5 {filename}: {e}")
+                    worker.kill()
+                    worker = None
+
+            log.warning(f"Unable to MD5 {filename}: hash worker died.")
+            return None
+        finally:
+            self._free.put(worker)
+
+
+def _get_hash_pool() -> _HashPool:
+    """Return the hashing process pool, creating it if necessary."""
+    global _hash_pool
+
+    with _hash_pool_lock:
+        if _hash_pool is None:
+            _hash_pool = _HashPool(
+                config.get_int(
+                    "daemon.hash_processes", default=os.cpu_count() or 1, min=1
+                )
+            )
+        return _hash_pool
+
+
+def md5sum_file(
+    filename: str | os.PathLike,
+    block_size: int | None = None,
+    drop_cache: bool = False,
+) -> str | None:
     """Find the md5sum of a given file.
 
-    This implementation runs in an asyncio wrapper and will time out
-    if a 32MiB portion of the file can't be processed in less than ten
-    minutes.
+    The file is read sequentially into a reused buffer of `block_size` bytes,
+    using the hashing engine selected by "daemon.hash_engine":
+
+    * "thread" (the default) hashes the file in the calling process, using
+      an asyncio wrapper which will time out if a 32MiB portion of the file
+      can't be processed in less than ten minutes.
+    * "process" hashes the file in a pool of "daemon.hash_processes" worker
+      processes (default: one per CPU), so that many files can be hashed at
+      once without contending for the GIL.  As with the "thread" engine,
+      the hash will time out if a 32MiB portion of the file can't be
+      processed in less than ten minutes.  The stuck worker is then killed.
 
     Parameters
     ----------
     filename: string
         Name of file to checksum.
+    block_size: int, optional
+        The read size, in bytes.  If not given, "daemon.hash_block_size"
+        is used (default: 8 MiB).
+    drop_cache: bool, optional
+        If True, the file's data is dropped from the page cache after being
+        read, to avoid evicting more useful data when hashing cold files.
 
     Returns
     -------
     md5hash: str
         The hexadecimal MD5 hash of the file, or None if the operation timed out.
 
+    Raises
+    ------
+    ValueError
+        "daemon.hash_engine" was not valid.
+
     See Also
     --------
     http://stackoverflow.com/questions/1131220/get-md5-hash-of-big-files-in-python
     """
-    metric = Metric("hash_running_count", "Count of in-progress MD5 hashing")
+    engine = config.get("daemon.hash_engine", default="thread", as_type=str)
+    if block_size is None:
+        block_size = hash_block_size()
+    if engine not in ("thread", "process"):
+        raise ValueError(f"Unknown hash engine: {engine}")
+
+    metric = Metric(
+        "hash_running_count",
+        "Count of in-progress MD5 hashing",
+        bound={"engine": engine},
+    )
 
     metric.inc()
-    result = asyncio.run(_md5sum_file(filename))
-    metric.dec()
+    try:
+        if engine == "process":
+            result = _get_hash_pool().md5sum(filename, block_size, drop_cache)
+        else:
+            result = asyncio.run(_md5sum_file(filename, block_size, drop_cache))
+    finally:
+        metric.dec()
 
     return result
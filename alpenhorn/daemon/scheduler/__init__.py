@@ -1,5 +1,11 @@
 """Alpenhorn task scheduler."""
 
 from .pool import EmptyPool, WorkerPool, global_abort, threadlocal
-from .queue import FairMultiFIFOQueue
+from .queue import (
+    PRIORITY_IDLE,
+    PRIORITY_IMPORT,
+    PRIORITY_NORMAL,
+    PRIORITY_PULL,
+    FairMultiFIFOQueue,
+)
 from .task import Task
@@ -10,6 +10,22 @@ The Fair Multi-FIFO Queue may have many such FIFOs, and it will try to ensure
 that tasks are removed from the queue in a fair manner which tries to keep
 the same number of tasks from each FIFO in progress at all times.
 
+Every task also has a priority class (one of the `PRIORITY_...` constants
+defined here; lower values are higher priority).  Within a FIFO, tasks
+of a higher priority class are removed before tasks of a lower priority class,
+and, when choosing between FIFOs, a FIFO offering a higher priority task is
+preferred over one which has fewer tasks in progress.  Fairness is only
+used to decide between FIFOs offering tasks of the same priority.
+
+To prevent starvation, a task which has been waiting in the queue longer than
+the queue's `starvation_time` is treated as if it were of the highest priority
+class.
+
+Individual FIFOs may also be limited (see `set_fifo_limits()`), either in the
+number of tasks from the FIFO which may be in progress at once, or in the rate
+at which tasks can be removed from the FIFO, based on the number of bytes of
+I/O each task reports it will perform when it is put into the queue.
+
 The queue is unbounded.
 """
 
@@ -17,39 +33,171 @@ import heapq
 import threading
 from collections import deque
 from collections.abc import Hashable
-from time import monotonic, sleep
+from time import monotonic
 from typing import Any
 
 from ..metrics import Metric
 
+# Task priority classes.  Lower values are higher priority.
+PRIORITY_PULL = 0  # Pulls requested by users
+PRIORITY_IMPORT = 1  # File imports
+PRIORITY_NORMAL = 2  # Checks, deletions, and most everything else (the default)
+PRIORITY_IDLE = 3  # Idle-time maintenance
+
+# Names of the priority classes, used to label metrics.  Indexed by class.
+PRIORITY_NAMES = ("pull", "import", "normal", "idle")
+
+
+class _PriorityFIFO:
+    """A single FIFO of the FairMultiFIFOQueue.
+
+    Internally, this is a deque for each priority class.  Elements of the deques
+    are 4-tuples: (put_time, item, exclusive, io_bytes).
+
+    Parameters
+    ----------
+    starvation_time : float
+        Items which have been in the FIFO for longer than this many seconds
+        are considered to have the highest priority.
+    """
+
+    __slots__ = ["_deques", "_len", "_starvation_time"]
+
+    def __init__(self, starvation_time: float) -> None:
+        self._deques = [deque() for _ in PRIORITY_NAMES]
+        self._len = 0
+        self._starvation_time = starvation_time
+
+    def __len__(self) -> int:
+        return self._len
+
+    def append(self, item: Any, exclusive: bool, priority: int, io_bytes: int) -> None:
+        """Add `item` to the FIFO for class `priority`."""
+        self._deques[priority].append((monotonic(), item, exclusive, io_bytes))
+        self._len += 1
+
+    def head(self) -> tuple[int, int, bool] | None:
+        """Find the next item to pop.
+
+        Returns
+        -------
+        None, if the FIFO is empty, or else a 3-tuple:
+
+        priority : int
+            The priority class of the next item.
+        effective_priority : int
+            The priority the next item should be treated as having.  This is
+            PRIORITY_PULL for items which have been starving.
+        exclusive : bool
+            Whether the next item is exclusive.
+        """
+        if not self._len:
+            return None
+
+        # Find the best class with anything in it
+        best = None
+        starved_before = monotonic() - self._starvation_time
+        for priority, fifo in enumerate(self._deques):
+            if not fifo:
+                continue
+
+            # A starving item wins immediately.
+            if priority and fifo[0][0] < starved_before:
+                return priority, PRIORITY_PULL, fifo[0][2]
+
+            if best is None:
+                best = priority, priority, fifo[0][2]
+
+        return best
+
+    def starves_at(self) -> float | None:
+        """When will the next item start starving?
+
+        Returns
+        -------
+        float or None
+            The monotonic time after which the oldest non-PULL item at the
+            head of one of the priority classes is considered to be starving,
+            or None, if there are no such items.
+        """
+        times = [fifo[0][0] for fifo in self._deques[PRIORITY_PULL + 1 :] if fifo]
+        if not times:
+            return None
+        return min(times) + self._starvation_time
+
+    def popleft(self, priority: int) -> tuple[Any, bool, int]:
+        """Pop the first item of class `priority`.
+
+        Returns
+        -------
+        item : Any
+            The item
+        exclusive : bool
+            Whether the item was exclusive
+        io_bytes : int
+            The I/O size of the item
+        """
+        _, item, exclusive, io_bytes = self._deques[priority].popleft()
+        self._len -= 1
+        return item, exclusive, io_bytes
+
+    def clear(self) -> list[int]:
+        """Remove everything.
+
+        Returns
+        -------
+        list of int
+            The number of items removed from each priority class.
+        """
+        counts = [len(fifo) for fifo in self._deques]
+        for fifo in self._deques:
+            fifo.clear()
+        self._len = 0
+        return counts
+
 
 class FairMultiFIFOQueue:
-    """Create a new Fair Multi-FIFO Queue"""
+    """Create a new Fair Multi-FIFO Queue
+
+    Parameters
+    ----------
+    starvation_time : float, optional
+        Queued tasks waiting longer than this many seconds are treated as
+        having the highest priority.
+    """
 
     __slots__ = [
         "_all_tasks_done",
         "_cleared_fifos",
         "_deferrals",
         "_dlock",
+        "_fifo_budgets",
         "_fifo_labels",
+        "_fifo_limits",
         "_fifo_locks",
         "_fifos",
+        "_head_class",
+        "_heads",
         "_inprogress_counts",
         "_joining",
-        "_keys_by_inprogress",
         "_lock",
         "_not_empty",
         "_qlock",
         "_qsize",
         "_qsize_all",
         "_qsize_any",
+        "_qsize_priority",
+        "_starvation_time",
+        "_starvations",
+        "_starve_at",
         "_total_inprogress",
         "_total_queued",
     ]
 
-    def __init__(self) -> None:
-        # The FIFO dict
+    def __init__(self, starvation_time: float = 600) -> None:
+        # The FIFO dict.  Values are _PriorityFIFOs
         self._fifos = {}
+        self._starvation_time = starvation_time
 
         # Total number of queued tasks
         self._total_queued = 0
@@ -57,18 +205,32 @@ class FairMultiFIFOQueue:
         self._total_inprogress = 0
         # Counts of in-progress tasks by FIFO
         self._inprogress_counts = {}
-        # A list of deques of FIFO keys, indexed by number of in-progress tasks.
-        # FIFO keys are added to the end (right-side) of the deques, but searching
+        # The head index.  For each priority class, a list of deques of the
+        # keys of the non-empty FIFOs whose next item is of that (effective)
+        # priority class, indexed by number of in-progress tasks.  FIFO keys
+        # are added to the end (right-side) of the deques, but searching
         # happens from the left, meaning FIFOs which have been accessed least
-        # recently are prioritised.
-        #
-        # We initialise element 0 to an empty deque to simplify creating new
-        # FIFOs, which will always get added to that FIFO.
-        self._keys_by_inprogress = [deque()]
+        # recently are prioritised.  Empty FIFOs aren't in the index at all.
+        self._heads = [[deque()] for _ in PRIORITY_NAMES]
+        # The priority class each FIFO is filed under in _heads, or None
+        # if the FIFO is empty
+        self._head_class = {}
+        # When FIFOs will next have a starving item.  This is a heapq of
+        # (time, key) pairs.  Entries may be stale: _starve_at holds the
+        # current time for each FIFO.
+        self._starvations = []
+        self._starve_at = {}
         # The set of locked FIFOs
         self._fifo_locks = set()
         # The set of retired FIFOs
         self._cleared_fifos = set()
+        # In-progress limits, by FIFO
+        self._fifo_limits = {}
+        # Byte-rate budgets, by FIFO.  Values are 3-element lists:
+        #  0: rate (bytes per second)
+        #  1: available budget (bytes).  May be negative.
+        #  2: time of last budget update
+        self._fifo_budgets = {}
 
         # The thread lock (mutex) and the conditionals (see queue.py for
         # details, which this implementation broadly follows)
@@ -101,6 +263,13 @@ class FairMultiFIFOQueue:
         # Marignalised over fifo
         self._qsize_all = self._qsize.bind(fifo="_ALL")
 
+        # Queued tasks by priority class
+        self._qsize_priority = Metric(
+            "queue_priority_size",
+            "Number of queued tasks by priority class",
+            unbound=["priority"],
+        )
+
         # Track locked fifos
         self._qlock = Metric(
             "queue_locked", "The queue fifo is locked", unbound=["fifo"]
@@ -166,6 +335,67 @@ class FairMultiFIFOQueue:
         """
         self._fifo_labels[key] = label
 
+    # HEAD INDEX
+    # ==========
+
+    def _file(self, key: Hashable) -> None:
+        """Re-file FIFO `key` in the head index.
+
+        Must be called, with the lock held, whenever the head of the FIFO
+        may have changed.  If the FIFO's effective priority class hasn't
+        changed, its place in the index is kept.
+        """
+        fifo = self._fifos[key]
+        count = self._inprogress_counts[key]
+        old = self._head_class[key]
+        head = fifo.head()
+        new = None if head is None else head[1]
+
+        if new != old:
+            if old is not None:
+                self._heads[old][count].remove(key)
+            if new is not None:
+                by_count = self._heads[new]
+                while len(by_count) <= count:
+                    by_count.append(deque())
+                by_count[count].append(key)
+            self._head_class[key] = new
+
+        # Note when this FIFO will need re-filing due to starvation
+        starves_at = None if new in (None, PRIORITY_PULL) else fifo.starves_at()
+        if starves_at is None:
+            self._starve_at.pop(key, None)
+        elif self._starve_at.get(key) != starves_at:
+            self._starve_at[key] = starves_at
+            heapq.heappush(self._starvations, (starves_at, key))
+
+    def _file_starving(self, now: float) -> None:
+        """Re-file FIFOs whose head items have started starving.
+
+        Must be called with the lock held.
+        """
+        while self._starvations and self._starvations[0][0] < now:
+            starves_at, key = heapq.heappop(self._starvations)
+            if self._starve_at.get(key) == starves_at:
+                del self._starve_at[key]
+                self._file(key)
+
+    def _move(self, key: Hashable, old_count: int, new_count: int) -> None:
+        """Move FIFO `key` in the head index after its in-progress count changed.
+
+        Must be called with the lock held.
+        """
+        priority = self._head_class[key]
+        if priority is None:
+            return
+
+        by_count = self._heads[priority]
+        by_count[old_count].remove(key)
+        if len(by_count) == new_count:
+            by_count.append(deque([key]))
+        else:
+            by_count[new_count].append(key)
+
     # QUEUE MAINTENANCE
     # =================
 
@@ -191,6 +421,88 @@ class FairMultiFIFOQueue:
         # Clear the metric.  This clears the marginalised versions, too
         self._qsize.clear()
 
+    def set_fifo_limits(
+        self,
+        key: Hashable,
+        max_inprogress: int | None = None,
+        max_rate: float | None = None,
+    ) -> None:
+        """Set resource limits for a FIFO.
+
+        Limits replace any previously set for the FIFO.  Limits are only
+        applied when choosing the next item in `get()`: changing them doesn't
+        affect items already in progress.
+
+        Parameters
+        ----------
+        key : hashable
+            The name of the FIFO to limit.  It need not exist yet.
+        max_inprogress : int, optional
+            If not None, the maximum number of items from the FIFO which may
+            be in progress at once.
+        max_rate : float, optional
+            If not None, the maximum rate, in bytes per second, at which items
+            are removed from the FIFO, based on the `io_bytes` of each item.
+            Up to one second's worth of unused budget may accumulate while the
+            FIFO is idle.  An item larger than that is still allowed out of
+            the FIFO when the budget is full, but the FIFO will then be held
+            until the resulting deficit has been paid back.
+
+        Raises
+        ------
+        ValueError:
+            `max_inprogress` or `max_rate` was not positive.
+        """
+        if max_inprogress is not None and max_inprogress < 1:
+            raise ValueError(f"max_inprogress non-positive (={max_inprogress})")
+        if max_rate is not None and max_rate <= 0:
+            raise ValueError(f"max_rate non-positive (={max_rate})")
+
+        with self._lock:
+            if max_inprogress is None:
+                self._fifo_limits.pop(key, None)
+            else:
+                self._fifo_limits[key] = max_inprogress
+
+            if max_rate is None:
+                self._fifo_budgets.pop(key, None)
+            else:
+                self._fifo_budgets[key] = [max_rate, max_rate, monotonic()]
+
+            # Limits may have been relaxed
+            self._not_empty.notify_all()
+
+    def _budget_wait(self, key: Hashable, now: float) -> float:
+        """Refill the byte-rate budget of FIFO `key`.
+
+        Must be called with the lock held.
+
+        Parameters
+        ----------
+        key : hashable
+            The FIFO to check.
+        now : float
+            The current monotonic time.
+
+        Returns
+        -------
+        float
+            The number of seconds until the FIFO is out of deficit.  Zero if
+            the FIFO has budget available (or has no budget).
+        """
+        budget = self._fifo_budgets.get(key)
+        if budget is None:
+            return 0
+
+        rate, available, last = budget
+        available = min(rate, available + rate * (now - last))
+        budget[1] = available
+        budget[2] = now
+
+        if available >= 0:
+            return 0
+        return -available / rate
+
     def clear_fifo(self, key: Hashable, keep_clear: bool = False) -> tuple[int, int]:
         """Remove all items from a fifo.
 
@@ -230,11 +542,13 @@ class FairMultiFIFOQueue:
                 # Pop out of old heapq and add to new if not being removed
                 item = heapq.heappop(self._deferrals)
 
-                # Here item is a 4-tuple:
+                # Here item is a 6-tuple:
                 #  0: deferral time
                 #  1: item to put
                 #  2: FIFO key
                 #  3: exclusive flag
+                #  4: priority class
+                #  5: I/O size
                 if item[2] == key:
                     deferred_removed += 1
                 else:
@@ -246,16 +560,27 @@ class FairMultiFIFOQueue:
         with self._not_empty:
             # Is there anything to clear?
             try:
-                pending_removed = len(self._fifos[key])
+                # Empty the FIFO.  We keep the FIFO, even if we're going to keep
+                # it clear from now on because we need to still track
+                # in-progress items
+                counts = self._fifos[key].clear()
+                self._file(key)
+                pending_removed = sum(counts)
                 self._total_queued -= pending_removed
-
-                # Reset the FIFO to an empty deque().  We do this even if we're
-                # going to keep the FIFO clear from now on because we need to
-                # still track in-progress items
-                self._fifos[key] = deque()
+                for priority, count in enumerate(counts):
+                    if count:
+                        self._qsize_priority.add(
+                            -count, priority=PRIORITY_NAMES[priority]
+                        )
             except KeyError:
                 pass  # FIFO doesn't exist, so nothing to remove
 
+            # Nothing will ever be removed from a FIFO kept clear, so its
+            # limits are no longer needed
+            if keep_clear:
+                self._fifo_limits.pop(key, None)
+                self._fifo_budgets.pop(key, None)
+
         # If the queue is now empty, notify
         with self._all_tasks_done:
             if self._total_queued == 0 and self._total_inprogress == 0:
@@ -318,7 +643,9 @@ class FairMultiFIFOQueue:
     # QUEUE PRODUCERS
     # ===============
 
-    def _put(self, item: Any, key: Hashable, exclusive: bool) -> None:
+    def _put(
+        self, item: Any, key: Hashable, exclusive: bool, priority: int, io_bytes: int
+    ) -> None:
         """Put `item` into the FIFO named `key` without locking.
 
         Never call this function directly; use put() instead.
@@ -333,24 +660,36 @@ class FairMultiFIFOQueue:
             The name of the FIFO to which `item` is added
         exclusive : bool
             True if `item` is exclusive
+        priority : int
+            The priority class of `item`
+        io_bytes : int
+            The I/O size of `item`
         """
         # Create the FIFO, if necessary
         if key not in self._fifos:
-            fifo = deque()
+            fifo = _PriorityFIFO(self._starvation_time)
             self._fifos[key] = fifo
             self._inprogress_counts[key] = 0
-            self._keys_by_inprogress[0].append(key)
+            self._head_class[key] = None
         else:
             fifo = self._fifos[key]
 
         # push the task onto the FIFO (right-most end)
-        fifo.append((item, exclusive))
+        fifo.append(item, exclusive, priority, io_bytes)
         self._total_queued += 1
+        self._file(key)
 
         self._inc_metrics(fifo=key, status="queued")
+        self._qsize_priority.inc(priority=PRIORITY_NAMES[priority])
 
     def put(
-        self, item: Any, key: Hashable, exclusive: bool = False, wait: float = 0
+        self,
+        item: Any,
+        key: Hashable,
+        exclusive: bool = False,
+        wait: float = 0,
+        priority: int = PRIORITY_NORMAL,
+        io_bytes: int = 0,
     ) -> bool:
         """Push `item` onto the FIFO named `key`.
 
@@ -375,6 +714,9 @@ class FairMultiFIFOQueue:
 
         If the FIFO named `key` doesn't exist, it is created.
 
+        Items are returned by `get` in order of `priority` and then in the
+        order they were put into the FIFO.
+
         Parameters
         ----------
         item : anything
@@ -386,6 +728,12 @@ class FairMultiFIFOQueue:
         wait : float, optional
             The amount of time (in seconds) to wait before adding `item`
             to the queue.
+        priority : int, optional
+            The priority class of `item`.  One of the `PRIORITY_...`
+            constants.  The default is PRIORITY_NORMAL.
+        io_bytes : int, optional
+            The number of bytes of I/O `item` is expected to perform.  Used
+            to enforce the FIFO's byte-rate budget, if it has one.
 
         Returns
         -------
@@ -398,8 +746,13 @@ class FairMultiFIFOQueue:
         KeyError:
             The FIFO named `key` is not accempting items because the queue
             has been asked to keep it clear (see `clear_fifo()`).
+        ValueError:
+            `priority` was not a valid priority class.
         """
 
+        if priority not in range(len(PRIORITY_NAMES)):
+            raise ValueError(f"invalid priority: {priority}")
+
         # Check if the fifo is being kept clear
         if key in self._cleared_fifos:
             raise KeyError("FIFO not accepting items")
@@ -412,13 +765,14 @@ class FairMultiFIFOQueue:
                     return False
 
                 heapq.heappush(
-                    self._deferrals, (monotonic() + wait, item, key, exclusive)
+                    self._deferrals,
+                    (monotonic() + wait, item, key, exclusive, priority, io_bytes),
                 )
                 self._inc_metrics(fifo=key, status="deferred")
         else:
             # Immediate put
             with self._not_empty:
-                self._put(item, key, exclusive)
+                self._put(item, key, exclusive, priority, io_bytes)
                 self._not_empty.notify()  # wakes up a single waiting thread
 
         return True
@@ -455,9 +809,6 @@ class FairMultiFIFOQueue:
             if count <= 0:
                 raise ValueError(f"no unfinished tasks for FIFO {key}")
 
-            # Remove the FIFO from the ordered list
-            self._keys_by_inprogress[count].remove(key)
-
             # Unlock this FIFO if it was locked.  If the caller has been working on
             # an exclusive item from the FIFO, then this call must be completing it,
             # because there can't be anything else in-progress from this FIFO.  So,
@@ -471,20 +822,11 @@ class FairMultiFIFOQueue:
             self._total_inprogress -= 1
             self._dec_metrics(fifo=key, status="in-progress")
 
-            # Put the fifo back in the ordered list.
-            #
-            # XXX Could just delete a FIFO which is now empty here.
-            #
-            # In general, there's no reason to expect an empty FIFO to be reused,
-            # by the caller, and numerous empty FIFOs will slow down get() over time,
-            # so triming could decreate get() execution time.
-            #
-            # However, in our particular case (alpenhornd), the maximum number
-            # of FIFOs is total number of nodes ever active on this host, which is
-            # generally small and static enough not to have to worry about it.
-            self._keys_by_inprogress[count].append(key)
+            # Move the fifo in the head index.  Empty FIFOs aren't in the
+            # index, so they don't slow down get().
+            self._move(key, count + 1, count)
 
-            # XXX Could trim _keys_by_inprogress here.
+            # XXX Could trim the lists in _heads here.
             #
             # In general, it's potentially useful: it's possible for a bunch
             # of unnecessary empty sets to accumulate at the tail of this list,
@@ -496,6 +838,11 @@ class FairMultiFIFOQueue:
             # that have ever existed at one time, so it's probably not worth the
             # trouble.
 
+            # If there are queued tasks, wake up a getter: this FIFO may have
+            # been blocked by its limits or an exclusive item.
+            if self._total_queued:
+                self._not_empty.notify()
+
             # Notify waiters when there are no pending tasks
             if self._total_queued == 0 and self._total_inprogress == 0:
                 self._all_tasks_done.notify_all()  # wakes up all waiting threads
@@ -523,7 +870,8 @@ class FairMultiFIFOQueue:
             The name of the FIFO from which `item` was popped
         """
         # Set to true later if we had to skip something due to an
-        # exclusive flag because its queue wasn't empty
+        # exclusive flag because its queue wasn't empty, or because
+        # of a FIFO limit
         skipped_exclusive = False
 
         timeout_at = monotonic() + t
@@ -546,9 +894,11 @@ class FairMultiFIFOQueue:
             # the smallest element
             while len(self._deferrals) > 0 and self._deferrals[0][0] <= monotonic():
                 # heappop removes and returns self._deferrals[0]
-                _, item, key, exclusive = heapq.heappop(self._deferrals)
+                _, item, key, exclusive, priority, io_bytes = heapq.heappop(
+                    self._deferrals
+                )
                 self._dec_metrics(fifo=key, status="deferred")
-                self._put(item, key, exclusive)
+                self._put(item, key, exclusive, priority, io_bytes)
 
         # If the queue is still empty, time out
         if self._total_queued < 1:
@@ -556,43 +906,54 @@ class FairMultiFIFOQueue:
 
         # Otherwise, get the next item from the queue:
 
-        # Choose a FIFO by walking _keys_by_inprogress: find the lowest
-        # non-empty deque that has a non-empty FIFO in it.
-        key = None
-        for count, key_set in enumerate(self._keys_by_inprogress):
-            # If the key_set is empty, try the next one
-            if not key_set:
-                continue
-
-            # Look for a non-empty FIFO in this set
-            for candidate in key_set:
-                # If the candidate FIFO is locked, skip it
-                if candidate in self._fifo_locks:
-                    skipped_exclusive = True
-                    continue
-
-                # If there's nothing in the FIFO, skip it
-                if not self._fifos[candidate]:
-                    continue
-
-                # If the first item in the FIFO is exclusive
-                # but there's currently in-progress items, skip it
-                #
-                # Items in the queue are 2-tuples, the second element
-                # of which is the exclusive flag, so fifo[0][1] is the
-                # exclusive flag for the first (left-most) item in the
-                # fifo deque.
-                if count and self._fifos[candidate][0][1]:
-                    skipped_exclusive = True
-                    continue
-
-                # Otherwise, this candidate looks good
-                key = candidate
-                # remove the key from the set
-                key_set.remove(key)
-                break
+        # First bring the head index up-to-date with starving items
+        now = monotonic()
+        self._file_starving(now)
 
-            # If we found a non-empty FIFO, we're done
+        # Choose a FIFO by walking the head index: find the FIFO offering
+        # the highest priority item.  Between FIFOs offering items of the
+        # same priority, choose the one in the lowest non-empty deque (i.e.
+        # the one with the fewest in-progress items).  Only FIFOs blocked by
+        # an exclusive item or their limits are skipped over, so we don't
+        # need to look at every FIFO.
+        key = None
+        for by_count in self._heads:
+            for count, key_set in enumerate(by_count):
+                for candidate in key_set:
+                    # If the candidate FIFO is locked, skip it
+                    if candidate in self._fifo_locks:
+                        skipped_exclusive = True
+                        continue
+
+                    head = self._fifos[candidate].head()
+
+                    # If the next item in the FIFO is exclusive
+                    # but there's currently in-progress items, skip it
+                    if count and head[2]:
+                        skipped_exclusive = True
+                        continue
+
+                    # If the FIFO is at its in-progress limit, skip it
+                    if count >= self._fifo_limits.get(candidate, count + 1):
+                        skipped_exclusive = True
+                        continue
+
+                    # If the FIFO is over its byte-rate budget, skip it, but
+                    # wake up in time to try again when the budget is restored
+                    budget_wait = self._budget_wait(candidate, now)
+                    if budget_wait:
+                        skipped_exclusive = True
+                        timeout_at = min(timeout_at, now + budget_wait)
+                        continue
+
+                    # Otherwise, this candidate is the best available
+                    key = candidate
+                    key_count = count
+                    best = head
+                    break
+
+                if key is not None:
+                    break
             if key is not None:
                 break
 
@@ -600,37 +961,39 @@ class FairMultiFIFOQueue:
         if key is None:
             if skipped_exclusive:
                 # Don't busy-wait if we ended up with nothing
-                # because everything was exclusion-blocked
+                # because everything was exclusion- or limit-blocked.
+                # We'll be notified by task_done() when something finishes.
                 wait = timeout_at - monotonic()
                 if wait > 0:
-                    sleep(wait)
+                    self._not_empty.wait(wait)
             return None
 
-        fifo = self._fifos[key]
-
-        # Pop the first (left-most) item from this FIFO
-        item, exclusive = fifo.popleft()
+        # Pop the next item from this FIFO
+        priority = best[0]
+        item, exclusive, io_bytes = self._fifos[key].popleft(priority)
         self._total_queued -= 1
         self._total_inprogress += 1
 
         # Update metrics
         self._inc_metrics(fifo=key, status="in-progress")
         self._dec_metrics(fifo=key, status="queued")
+        self._qsize_priority.dec(priority=PRIORITY_NAMES[priority])
+
+        # Charge the FIFO's budget
+        if key in self._fifo_budgets:
+            self._fifo_budgets[key][1] -= io_bytes
 
         # Lock this FIFO, if item is exclusive
         if exclusive:
             self._fifo_locks.add(key)
             self._qlock.set(1, fifo=key)
 
-        # Increment the in-progress count and file the key in the right
-        # place in _keys_by_inprogress
-        count = self._inprogress_counts[key] + 1
+        # Increment the in-progress count and re-file the key in the right
+        # place in the head index
+        count = key_count + 1
         self._inprogress_counts[key] = count
-        # Extend _keys_by_inprogress if necessary
-        if len(self._keys_by_inprogress) == count:
-            self._keys_by_inprogress.append(deque([key]))
-        else:
-            self._keys_by_inprogress[count].append(key)
+        self._move(key, key_count, count)
+        self._file(key)
 
         return (item, key)
 
@@ -7,7 +7,7 @@ from inspect import isgenerator
 
 import peewee as pw
 
-from .queue import FairMultiFIFOQueue
+from .queue import PRIORITY_NORMAL, FairMultiFIFOQueue
 
 log = logging.getLogger(__name__)
 
@@ -58,6 +58,13 @@ class Task:
             ``False`` for main update loop tasks
     name : str, optional
             the name of the task.  Used in log messages
+    priority : int, optional
+            the priority class of the task.  One of the `PRIORITY_...`
+            constants from the `queue` module.  PRIORITY_NORMAL by
+            default.
+    io_bytes : int, optional
+            the approximate number of bytes of I/O the task will perform.
+            Used by the queue to enforce per-FIFO byte-rate budgets.
     args : list or tuple, optional
             additional positional arguments passed to `func`
     kwargs : dict, optional
@@ -70,9 +77,11 @@ class Task:
         "_exclusive",
         "_func",
         "_generator",
+        "_io_bytes",
         "_key",
         "_kwargs",
         "_name",
+        "_priority",
         "_queue",
         "_requeue",
     ]
@@ -87,12 +96,16 @@ class Task:
         name: str = "Task",
         args: tuple | list = (),
         kwargs: dict = {},
+        priority: int = PRIORITY_NORMAL,
+        io_bytes: int = 0,
     ) -> None:
         self._func = func
         self._args = args
         self._exclusive = exclusive
+        self._io_bytes = io_bytes
         self._kwargs = kwargs
         self._name = name
+        self._priority = priority
         self._queue = queue
         self._key = key
         self._cleanup = deque()
@@ -103,7 +116,7 @@ class Task:
 
         # Enqueue ourself
         try:
-            queue.put(self, key, exclusive)
+            queue.put(self, key, exclusive, priority=priority, io_bytes=io_bytes)
         except KeyError:
             # Key no longer accepted
             log.info(f"Ignoring task {self._name}: FIFO closed")
@@ -139,13 +152,15 @@ class Task:
             # yielding no value results in immediate re-queueing
             if result is None:
                 result = 0
-            # Requeue ourself so we can iterate another time.
+            # Requeue ourself so we can iterate another time.  Our I/O was
+            # already accounted for the first time we were removed from
+            # the queue, so don't charge for it again.
             log.debug(
                 f"Requeueing yielded task {self._name} in FIFO {self._key} "
                 f"with delay {result} seconds"
             )
             try:
-                self._queue.put(self, self._key, wait=result)
+                self._queue.put(self, self._key, wait=result, priority=self._priority)
             except KeyError:
                 # Key no longer accepted
                 log.info(f"Ignoring task {self._name}: FIFO closed")
@@ -219,6 +234,8 @@ class Task:
                 name=self._name,
                 args=self._args,
                 kwargs=self._kwargs,
+                priority=self._priority,
+                io_bytes=self._io_bytes,
             )
 
     def on_cleanup(
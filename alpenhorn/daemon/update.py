@@ -6,13 +6,16 @@ import json
 import logging
 import pathlib
 import socket
+import threading
 import time
 
 import click
 import peewee as pw
 
-from ..common import config, util
+from ..common import config, util, wakeup
 from ..db import (
+    ArchiveAcq,
+    ArchiveFile,
     ArchiveFileCopy,
     ArchiveFileCopyRequest,
     ArchiveFileImportRequest,
@@ -21,9 +24,17 @@ from ..db import (
     StorageNode,
     utcnow,
 )
+from .inventory import FileInventory
 from .metrics import Metric
 from .querywalker import QueryWalker
-from .scheduler import EmptyPool, FairMultiFIFOQueue, Task, WorkerPool, global_abort
+from .scheduler import (
+    PRIORITY_IMPORT,
+    EmptyPool,
+    FairMultiFIFOQueue,
+    Task,
+    WorkerPool,
+    global_abort,
+)
 
 log = logging.getLogger(__name__)
 
@@ -251,6 +262,60 @@ class RemoteNode(updateable_base):
         self._fifo = None
 
 
+# The daemon-wide registry of RemoteNode instances, keyed by StorageNode id.
+_remote_nodes = {}
+_remote_nodes_lock = threading.Lock()
+
+
+def remote_node(node: StorageNode) -> RemoteNode:
+    """Return a RemoteNode for `node`.
+
+    RemoteNode instances are cached: if a RemoteNode was previously created
+    for a StorageNode with the same id, `io_class` and `io_config`, that
+    instance is updated to refer to `node` and returned.  Otherwise a new
+    RemoteNode is created (and cached).
+
+    Parameters
+    ----------
+    node : StorageNode
+        The source node
+
+    Returns
+    -------
+    RemoteNode
+        The remote node for `node`.
+    """
+    lookups = Metric(
+        "remote_node_lookups",
+        "Count of RemoteNode registry look-ups",
+        counter=True,
+        unbound={"result"},
+    )
+
+    with _remote_nodes_lock:
+        remote = _remote_nodes.get(node.id)
+        if remote is not None and not remote._check_io_reinit(node):
+            lookups.inc(result="hit")
+            remote.db = node
+            remote.io.node = node
+            return remote
+
+        lookups.inc(result="miss")
+        remote = RemoteNode(node)
+        _remote_nodes[node.id] = remote
+        return remote
+
+
+def prune_remote_nodes() -> None:
+    """Evict RemoteNodes for StorageNodes which no longer exist."""
+
+    existing = {row[0] for row in StorageNode.select(StorageNode.id).tuples()}
+    with _remote_nodes_lock:
+        for node_id in list(_remote_nodes):
+            if node_id not in existing:
+                del _remote_nodes[node_id]
+
+
 class UpdateableNode(updateable_base):
     """Updateable storage node
 
@@ -282,6 +347,7 @@ class UpdateableNode(updateable_base):
 
         # Set in reinit()
         self.db = None
+        self.inventory = None
         self.reinit(node)
 
         # These two are for the multiple daemon detection
@@ -309,7 +375,8 @@ class UpdateableNode(updateable_base):
     def stop(self) -> None:
         """Stop updating.
 
-        Stops auto-import, if running, and clears all pending tasks.
+        Stops auto-import, if running, clears all pending tasks, and then
+        calls the I/O instance's `stop` hook.
         """
         from . import auto_import
 
@@ -317,6 +384,9 @@ class UpdateableNode(updateable_base):
             auto_import.update_observer(self, self._queue, force_stop=True)
         super().stop()
 
+        if getattr(self, "io", None) is not None:
+            self.io.stop()
+
     def reinit(self, node: StorageNode) -> bool:
         """Re-initialise the instance with a new database object.
 
@@ -335,6 +405,10 @@ class UpdateableNode(updateable_base):
         # Most of the work is done in the base class reinit()
         did_reinit = super().reinit(node)
 
+        # The file inventory is kept unless the node record itself has changed
+        if self.inventory is None or self.inventory.node_id != node.id:
+            self.inventory = FileInventory(node.id, node.name)
+
         if did_reinit:
             # QueryWalker for auto-verifcation, if enabled
             self._av_walker = None
@@ -524,6 +598,41 @@ class UpdateableNode(updateable_base):
             if self.db.auto_verify > 0:
                 self.run_auto_verify()
 
+    def update_check(self) -> None:
+        """Dispatch integrity checks for suspect file copies on this node.
+
+        Suspect copies are those with has_file == 'M'.  At most
+        `daemon.max_checks_per_update` copies are dispatched per update loop;
+        any remaining copies will be picked up in subsequent updates.
+        """
+
+        # Fetch the copies, with their file and acq, in one go.
+        copies = list(
+            ArchiveFileCopy.select(ArchiveFileCopy, ArchiveFile, ArchiveAcq)
+            .join(ArchiveFile)
+            .join(ArchiveAcq)
+            .where(
+                ArchiveFileCopy.node == self.db,
+                ArchiveFileCopy.has_file == "M",
+                ArchiveFileCopy.wants_file != "N",
+            )
+            .order_by(ArchiveFileCopy.id)
+            .limit(config.get_int("daemon.max_checks_per_update", default=1000, min=1))
+        )
+
+        if not copies:
+            return
+
+        for copy in copies:
+            log.info(
+                f'Checking copy "{copy.file.acq.name}/{copy.file.name}" '
+                f"on node {self.name}."
+            )
+
+        # Dispatch integrity checks to I/O layer
+        self._io_happened = True
+        self.io.check_many(copies)
+
     def update_delete(self) -> None:
         """Process this node for files to delete."""
 
@@ -548,34 +657,16 @@ class UpdateableNode(updateable_base):
         # Search db for candidates on this node to delete.  The `dfclause` means
         # this query will only return wants_file == 'M' file copies when there's a
         # chance we'll delete them.
+        #
+        # Because we pass `avail_needed` to the planner, it will only yield files
+        # marked for discretionary cleaning (wants_file == 'M') while we still
+        # need to get back over min_avail_gb.  Because avail_needed decreases as
+        # we add files to the file deletion list, we'll never try to delete
+        # more of these than the amount of space we need to clear up.
         del_copies = []
-        for copy in (
-            ArchiveFileCopy.select()
-            .where(
-                dfclause,
-                ArchiveFileCopy.node == self.db,
-                ArchiveFileCopy.has_file != "N",
-            )
-            .order_by(ArchiveFileCopy.id)
+        for copy, avail_needed in self.db.plan_deletions(
+            dfclause, ArchiveFileCopy.has_file != "N", avail_needed=avail_needed
         ):
-            # Check the database to see if this file can be deleted
-            #
-            # The value of "discretionary" here means we'll only delete files
-            # marked for discretionary cleaning (wants_file == 'M') when we need
-            # to get back over min_avail_gb.  Because avail_needed decreases as
-            # we add files to the file deletion list, we'll never try to delete
-            # more of these than the amount of space we need to clear up.
-            if not copy.check_delete(discretionary=(avail_needed > 0)):
-                continue
-
-            # If we are trying to get back above min_avail_gb, keep a running total
-            # of how much more deletion is needed.
-            if avail_needed > 0:
-                if copy.size_b:
-                    avail_needed -= copy.size_b
-                elif copy.file.size_b:
-                    avail_needed -= copy.file.size_b
-
             # Group a bunch of these together to reduce the number of I/O Tasks
             # created.  TODO: figure out if this actually helps
             if len(del_copies) >= 10:
@@ -648,6 +739,7 @@ class UpdateableNode(updateable_base):
                     key=self.io.fifo,
                     args=(self, self._queue, path, req.register, req),
                     name=f'Scan "{path}" on {self.name}',
+                    priority=PRIORITY_IMPORT,
                 )
             else:
                 # Check that the import path is valid
@@ -697,19 +789,7 @@ class UpdateableNode(updateable_base):
             ).inc()
 
             # Check the integrity of any questionable files (has_file=M)
-            for copy in ArchiveFileCopy.select().where(
-                ArchiveFileCopy.node == self.db,
-                ArchiveFileCopy.has_file == "M",
-                ArchiveFileCopy.wants_file != "N",
-            ):
-                log.info(
-                    f'Checking copy "{copy.file.acq.name}/{copy.file.name}" '
-                    f"on node {self.name}."
-                )
-
-                # Dispatch integrity check to I/O layer
-                self._io_happened = True
-                self.io.check(copy)
+            self.update_check()
 
             # Delete any unwanted files to cleanup space
             self.update_delete()
@@ -718,7 +798,7 @@ class UpdateableNode(updateable_base):
             self.update_import()
 
             # Prepare files for pulls out from this node
-            remote = RemoteNode(self.db)
+            remote = remote_node(self.db)
             for req in ArchiveFileCopyRequest.select().where(
                 ArchiveFileCopyRequest.completed == 0,
                 ArchiveFileCopyRequest.cancelled == 0,
@@ -855,32 +935,150 @@ class UpdateableGroup(updateable_base):
 
         return True
 
-    def update_pull(self, req: ArchiveFileCopyRequest) -> None:
-        """Process pull request `req`.
+    def check_pulls(self) -> list[ArchiveFileCopyRequest]:
+        """Vet the pending pull requests into this group.
 
-        Parameters
-        ----------
-        req : ArchiveFileCopyRequest
-            The pull request to process.
+        This makes the same decisions as `ArchiveFileCopyRequest.check` does,
+        plus the non-local pull check, for all pending requests at once, using
+        a handful of queries rather than several per request.  Requests may
+        be cancelled or skipped as a result.
+
+        Only the first pending request for any given file is considered, so
+        we don't end up with overlapping pulls (which would try to write to
+        the same file).
+
+        Returns
+        -------
+        list of ArchiveFileCopyRequest
+            The requests which should be dispatched to the Group I/O layer,
+            in order.
         """
-        # Run early checks on the request
-        if not req.check():
-            return
+        pending = (
+            ArchiveFileCopyRequest.completed == 0,
+            ArchiveFileCopyRequest.cancelled == 0,
+            ArchiveFileCopyRequest.group_to == self.db,
+        )
 
-        # If this is a non-local pull, check that the remote source node
-        # support remote access.  This is not done in `req.check` because
-        # req.check doesn't know about RemoteNode.
-        if not req.node_from.local:
-            remote = RemoteNode(req.node_from)
-            if not remote.io.remote_pull_ok(host()):
-                req.cancel("non-local")
-                return
+        # The first pending request for each file, with the file, acq
+        # and source node.
+        reqs = {}
+        for req in (
+            ArchiveFileCopyRequest.select(
+                ArchiveFileCopyRequest, ArchiveFile, ArchiveAcq, StorageNode
+            )
+            .join(ArchiveFile)
+            .join(ArchiveAcq)
+            .switch(ArchiveFileCopyRequest)
+            .join(StorageNode, on=ArchiveFileCopyRequest.node_from)
+            .where(*pending)
+            .order_by(ArchiveFileCopyRequest.id)
+        ):
+            if req.file_id not in reqs:
+                req.group_to = self.db
+                reqs[req.file_id] = req
 
-        # Early checks passed: dispatch this request to the Group I/O layer
-        if self.io.do_pull_search:
-            self.io.pull_search(req)
-        else:
-            self.io.pull(req, did_search=False)
+        if not reqs:
+            return []
+
+        # Subqueries of requested files and their sources
+        files = ArchiveFileCopyRequest.select(ArchiveFileCopyRequest.file).where(
+            *pending
+        )
+        sources = ArchiveFileCopyRequest.select(ArchiveFileCopyRequest.node_from).where(
+            *pending
+        )
+
+        # The state of each requested file in this group.  As with
+        # StorageGroup.state_on_node, "Y" beats "M" beats "X" beats "N".
+        rank = {"N": 0, "X": 1, "M": 2, "Y": 3}
+        dest_state = {}
+        for file_id, has_file in (
+            ArchiveFileCopy.select(ArchiveFileCopy.file, ArchiveFileCopy.has_file)
+            .join(StorageNode)
+            .where(StorageNode.group == self.db, ArchiveFileCopy.file << files)
+            .tuples()
+        ):
+            if rank[has_file] > rank[dest_state.get(file_id, "N")]:
+                dest_state[file_id] = has_file
+
+        # The state of each requested file on the source nodes
+        src_state = {
+            (file_id, node_id): has_file
+            for file_id, node_id, has_file in ArchiveFileCopy.select(
+                ArchiveFileCopy.file, ArchiveFileCopy.node, ArchiveFileCopy.has_file
+            )
+            .where(ArchiveFileCopy.file << files, ArchiveFileCopy.node << sources)
+            .tuples()
+        }
+
+        # Requests which pass the DB checks, by source node
+        by_source = {}
+        for req in reqs.values():
+            # What's the current situation on the destination?
+            copy_state = dest_state.get(req.file_id, "N")
+            if copy_state == "Y":
+                # We mark the AFCR cancelled rather than complete becase
+                # _this_ AFCR clearly hasn't been responsible for creating
+                # the file copy.
+                req.cancel("duplicate")
+                continue
+            if copy_state == "M":
+                log.warning(
+                    f"Skipping pull request for {req.file.path}: "
+                    f"existing copy in group {self.name} needs check."
+                )
+                continue
+
+            # Skip request unless the source node is active
+            if not req.node_from.active:
+                log.warning(
+                    f"Skipping request for {req.file.path}:"
+                    f" source node {req.node_from.name} is not active."
+                )
+                continue
+
+            # If the source file doesn't exist, cancel the request.  If the
+            # source is suspect, skip the request.
+            state = src_state.get((req.file_id, req.node_from_id), "N")
+            if state == "N" or state == "X":
+                req.cancel("missing")
+                continue
+            if state == "M":
+                log.info(
+                    f"Skipping request for {req.file.path}:"
+                    f" source needs check on node {req.node_from.name}."
+                )
+                continue
+
+            by_source.setdefault(req.node_from_id, []).append(req)
+
+        # Now check readiness, one source node at a time.
+        passed = set()
+        for source_reqs in by_source.values():
+            node_from = source_reqs[0].node_from
+            remote = remote_node(node_from)
+
+            # If the source file is not ready, skip the request.
+            ready = remote.io.pull_ready_many([req.file for req in source_reqs])
+            for req in source_reqs:
+                if req.file not in ready:
+                    log.debug(
+                        f"Skipping request for {req.file.path}:"
+                        f" not ready on node {node_from.name}."
+                    )
+            source_reqs = [req for req in source_reqs if req.file in ready]
+
+            # If this is a non-local pull, check that the remote source node
+            # support remote access.
+            if source_reqs and not node_from.local:
+                if not remote.io.remote_pull_ok(host()):
+                    for req in source_reqs:
+                        req.cancel("non-local")
+                    continue
+
+            passed.update(req.id for req in source_reqs)
+
+        return [req for req in reqs.values() if req.id in passed]
 
     def update(self) -> None:
         """Perform I/O updates on the group"""
@@ -905,19 +1103,13 @@ class UpdateableGroup(updateable_base):
                 bound={"name": self.name},
             ).inc()
 
-            # Remember ArchiveFiles that we're pulling, so we don't end up with
-            # overlapping pulls (which would try to write to the same file).
-            seen_files = set()
-
-            # Process pulls into this group
-            for req in ArchiveFileCopyRequest.select().where(
-                ArchiveFileCopyRequest.completed == 0,
-                ArchiveFileCopyRequest.cancelled == 0,
-                ArchiveFileCopyRequest.group_to == self.db,
-            ):
-                if req.file not in seen_files:
-                    seen_files.add(req.file)
-                    self.update_pull(req)
+            # Process pulls into this group: dispatch requests which pass
+            # the early checks to the Group I/O layer
+            for req in self.check_pulls():
+                if self.io.do_pull_search:
+                    self.io.pull_search(req)
+                else:
+                    self.io.pull(req, did_search=False)
 
             # Check for idleness at the end
             self._do_idle_updates = self.idle
@@ -958,6 +1150,18 @@ def host() -> StorageHost | None:
     return _host
 
 
+def _hostname() -> str:
+    """Return the name of the daemon host.
+
+    If there is a ``daemon.host`` specified in the config, that is used.
+    otherwise the local hostname up to the first '.' is used.
+    """
+    hostname = config.get("daemon.host", default=None, as_type=str)
+    if hostname is None:
+        hostname = socket.gethostname().split(".")[0]
+    return hostname
+
+
 def _set_host() -> None:
     """Set the daemon host.
 
@@ -971,9 +1175,7 @@ def _set_host() -> None:
     """
     global _host
 
-    hostname = config.get("daemon.host", default=None, as_type=str)
-    if hostname is None:
-        hostname = socket.gethostname().split(".")[0]
+    hostname = _hostname()
 
     # Try to find a StorageHost with this name
     try:
@@ -984,6 +1186,74 @@ def _set_host() -> None:
     return _host
 
 
+# StorageNode fields which alpenhornd updates itself every update loop, and
+# which are, therefore, ignored when deciding whether storage has changed.
+_VOLATILE_FIELDS = {"avail_gb", "avail_gb_last_checked"}
+
+
+def _refresh_storage() -> tuple[StorageHost, dict[str, StorageNode], tuple]:
+    """Fetch the active nodes on the daemon host.
+
+    The nodes are fetched along with their groups and the host itself in a
+    single query.  Also sets the daemon host (see `host()`).
+
+    Returns
+    -------
+    host : StorageHost
+        The daemon host.
+    nodes : dict
+        The active StorageNodes on the host, keyed by name.
+    token : tuple
+        A change token for the fetched records.  If two calls return the
+        same token, nothing relevant has changed in the database between them.
+
+    Raises
+    ------
+    click.ClickException
+        No StorageHost record was found for the daemon host.
+    """
+    global _host
+
+    nodes = {
+        node.name: node
+        for node in (
+            StorageNode.select(StorageNode, StorageGroup, StorageHost)
+            .join(StorageGroup)
+            .switch(StorageNode)
+            .join(StorageHost)
+            .where(
+                StorageHost.name == _hostname(),
+                StorageNode.active == True,  # noqa: E712
+            )
+            .order_by(StorageNode.id)
+        )
+    }
+
+    if nodes:
+        _host = next(iter(nodes.values())).host
+    else:
+        # Without any nodes, we need to look up the host separately (to
+        # check that it exists).
+        _set_host()
+
+    token = (
+        tuple(_host.__data__.items()),
+        *(
+            (
+                tuple(
+                    item
+                    for item in node.__data__.items()
+                    if item[0] not in _VOLATILE_FIELDS
+                ),
+                tuple(node.group.__data__.items()),
+            )
+            for node in nodes.values()
+        ),
+    )
+
+    return _host, nodes, token
+
+
 def update_loop(
     queue: FairMultiFIFOQueue, pool: WorkerPool | EmptyPool, once: bool
 ) -> int:
@@ -1026,6 +1296,24 @@ def update_loop(
     nodes = {}
     groups = {}
 
+    # The change token from _refresh_storage()
+    storage_token = None
+
+    # Listen for wake-ups, if requested
+    listener = None
+    path = wakeup.socket_path()
+    if path and not once:
+        try:
+            listener = wakeup.WakeupListener(path)
+            log.info(f"Listening for wake-ups on {path}.")
+        except OSError as e:
+            log.warning(f"Unable to create wake-up socket {path}: {e}")
+
+    refresh_metric = Metric(
+        "storage_refresh_seconds",
+        description="Time spent refreshing storage records in the main loop",
+        counter=False,
+    )
     loop_time_metric = Metric(
         "main_loop_time_seconds", description="Main loop execution time", counter=False
     )
@@ -1051,26 +1339,22 @@ def update_loop(
     while not global_abort.is_set():
         loop_start = time.time()
 
-        # Find the StorageHost record for this host.  We do this once
-        # per update loop.  Raises ClickException if no host is found.
-        host = _set_host()
+        # Nodes are re-queried every loop iteration so we can detect changes
+        # in available storage media.  Their groups and the StorageHost record
+        # for this host come along in the same query.  Raises ClickException if
+        # no host is found.
+        refresh_start = time.monotonic()
+        host, new_nodes, token = _refresh_storage()
 
-        # Nodes are re-queried every loop iteration so we can
-        # detect changes in available storage media
-        try:
-            new_nodes = {
-                node.name: node
-                for node in (
-                    StorageNode.select()
-                    .where(
-                        StorageNode.host == host,
-                        StorageNode.active == True,  # noqa: E712
-                    )
-                    .execute()
-                )
-            }
-        except pw.DoesNotExist:
-            new_nodes = {}
+        # If nothing has changed since the last loop, there's no need to
+        # re-initialise the existing nodes.
+        storage_changed = token != storage_token
+        storage_token = token
+
+        # Forget about any source nodes which have been deleted
+        prune_remote_nodes()
+
+        refresh_metric.set(time.monotonic() - refresh_start)
 
         if len(new_nodes) == 0:
             log.warning(f"No active nodes on host ({host.name})!")
@@ -1093,10 +1377,11 @@ def update_loop(
         # Update the list of nodes:
         for name in new_nodes:
             if name in nodes:
-                # Update the existing UpdateableNode.
+                # Update the existing UpdateableNode, if necessary.
                 # This may result in the I/O instance for the
                 # node being re-instantiated.
-                nodes[name].reinit(new_nodes[name])
+                if storage_changed:
+                    nodes[name].reinit(new_nodes[name])
             else:
                 # No existing node: create a new one.
                 log.info(f'Node "{name}" now available.')
@@ -1226,16 +1511,66 @@ def update_loop(
                 )
         else:
             # Not in EAU mode.  Avoid looping too fast.
-            remaining = update_interval - loop_time
-            if remaining > 0:
-                # Stops waiting if a global abort is triggered
-                global_abort.wait(remaining)
+            _wait_for_next_loop(listener, loop_time, update_interval)
+
+    if listener:
+        listener.close()
 
     # Warn on abnormal exit
     log.warning("Exiting due to global abort")
     return 1
 
 
+def _wait_for_next_loop(
+    listener: wakeup.WakeupListener | None, loop_time: float, update_interval: float
+) -> None:
+    """Wait for the start of the next update loop.
+
+    Waits until `update_interval` seconds have elapsed since the start of the
+    last update loop.  If `listener` is not None, the wait ends early when
+    the wake-up socket is poked, but no earlier than `daemon.min_update_interval`
+    seconds after the start of the last update loop.  The wait always ends
+    when a global abort is triggered.
+
+    Parameters
+    ----------
+    listener : WakeupListener or None
+        The wake-up socket listener, if any.
+    loop_time : float
+        Time, in seconds, spent in the last update loop.
+    update_interval : float
+        The update interval, in seconds.
+    """
+    remaining = update_interval - loop_time
+    if remaining <= 0:
+        return
+
+    if listener is None:
+        # Stops waiting if a global abort is triggered
+        global_abort.wait(remaining)
+        return
+
+    # Time, on the monotonic clock, when the last update loop started
+    loop_start = time.monotonic() - loop_time
+    end_time = loop_start + update_interval
+    while not global_abort.is_set():
+        remaining = end_time - time.monotonic()
+        if remaining <= 0:
+            return
+
+        # Wait in short slices, so we notice a global abort
+        if listener.wait(min(remaining, 1)):
+            log.info("Received wake-up.")
+            # Enforce the minimum spacing between update loops
+            min_interval = config.get_float(
+                "daemon.min_update_interval", default=1, min=0
+            )
+            delay = min(end_time, loop_start + min_interval) - time.monotonic()
+            if delay > 0:
+                global_abort.wait(delay)
+            return
+
+
 def serial_io(queue: FairMultiFIFOQueue) -> None:
     """Execute I/O tasks from the queue
 
@@ -334,7 +334,7 @@ class ArchiveFileCopyRequest(base_model):
             True if processing the request should continue.  False if
             the request has been cancelled, or should be skipped.
         """
-        from ..daemon import RemoteNode
+        from ..daemon import remote_node
 
         # What's the current situation on the destination?
         copy_state = self.group_to.state_on_node(self.file)[0]
@@ -388,7 +388,7 @@ class ArchiveFileCopyRequest(base_model):
             return False
 
         # If the source file is not ready, skip the request.
-        remote_note = RemoteNode(self.node_from)
+        remote_note = remote_node(self.node_from)
         if not remote_note.io.pull_ready(self.file):
             log.debug(
                 f"Skipping request for {self.file.acq.name}/{self.file.name}:"
@@ -7,13 +7,20 @@ import datetime
 import logging
 import pathlib
 import random
+from collections.abc import Iterator
+from typing import TYPE_CHECKING
 
 import peewee as pw
 from peewee import fn
 
+from ..common import config
 from ._base import base_model
 from .acquisition import ArchiveFile
 
+if TYPE_CHECKING:
+    from .archive import ArchiveFileCopy
+del TYPE_CHECKING
+
 log = logging.getLogger(__name__)
 
 
@@ -371,6 +378,136 @@ class StorageNode(base_model):
             )
         }
 
+    def plan_deletions(
+        self, *where: pw.Expression, avail_needed: int | None = None
+    ) -> Iterator[tuple[ArchiveFileCopy, int | None]]:
+        """Determine which file copies on this node can be deleted.
+
+        This applies the same rules as `ArchiveFileCopy.check_delete` to
+        all candidate file copies at once.  The archive counts and pending
+        copy requests needed to decide are found with a few aggregate queries,
+        rather than two queries per file copy.
+
+        Parameters
+        ----------
+        *where : peewee.Expression
+            Clauses restricting the candidate ArchiveFileCopy rows, in addition
+            to the implicit restriction to this node.
+        avail_needed : int or None, optional
+            If None, file copies marked for discretionary cleaning
+            (``wants_file=='M'``) may always be deleted, as with
+            ``check_delete(discretionary=True)``.  Otherwise, this is the
+            number of bytes which need to be freed on this node: while it is
+            positive, discretionary copies may be deleted, and it is reduced
+            by the size of each deletable copy yielded.
+
+        Yields
+        ------
+        copy : ArchiveFileCopy
+            A deletable file copy, in order of increasing id.  The `file`,
+            `file.acq` and `node` of the copy are already populated.
+        avail_needed : int or None
+            The number of bytes still needing to be freed after `copy`
+            is deleted, or None, if `avail_needed` was None.
+        """
+        from .acquisition import ArchiveAcq, ArchiveFile
+        from .archive import ArchiveFileCopy, ArchiveFileCopyRequest
+
+        # The file ids of the candidates, as a subquery
+        candidates = (
+            ArchiveFileCopy.select(ArchiveFileCopy.file)
+            .where(ArchiveFileCopy.node == self, *where)
+            .order_by()
+        )
+
+        # Number of archived copies of each candidate file
+        archive_counts = dict(
+            ArchiveFileCopy.select(ArchiveFileCopy.file, fn.COUNT(ArchiveFileCopy.id))
+            .join(StorageNode)
+            .where(
+                StorageNode.archive == 1,
+                ArchiveFileCopy.has_file == "Y",
+                ArchiveFileCopy.file << candidates,
+            )
+            .group_by(ArchiveFileCopy.file)
+            .tuples()
+        )
+
+        # Candidate files which are the source of pending copy requests
+        pending = {
+            row[0]
+            for row in ArchiveFileCopyRequest.select(ArchiveFileCopyRequest.file)
+            .where(
+                ArchiveFileCopyRequest.node_from == self,
+                ArchiveFileCopyRequest.completed == 0,
+                ArchiveFileCopyRequest.cancelled == 0,
+                ArchiveFileCopyRequest.file << candidates,
+            )
+            .distinct()
+            .tuples()
+        }
+
+        # How many archive copies do we need before we're allowed to delete
+        # a file copy?
+        archive_copies_needed = config.get_int(
+            "daemon.archive_copy_count", default=2, min=0
+        )
+
+        for copy in (
+            ArchiveFileCopy.select(ArchiveFileCopy, ArchiveFile, ArchiveAcq)
+            .join(ArchiveFile)
+            .join(ArchiveAcq)
+            .where(ArchiveFileCopy.node == self, *where)
+            .order_by(ArchiveFileCopy.id)
+        ):
+            # Avoid re-fetching the node for every copy
+            copy.node = self
+
+            # Has deletion been requested?
+            if copy.wants_file == "Y" or (
+                copy.wants_file == "M"
+                and avail_needed is not None
+                and avail_needed <= 0
+            ):
+                continue
+
+            # Can't delete files that aren't present
+            if copy.has_file == "N":
+                continue
+
+            archive_count = archive_counts.get(copy.file_id, 0)
+            # If this copy is on an archive node itself, it does't count
+            # towards the archive count
+            if self.archive and copy.has_file == "Y":
+                archive_count -= 1
+
+            # Don't delete files which aren't fully archived
+            if archive_count < archive_copies_needed:
+                log.info(
+                    "Too few archive copies "
+                    f"({archive_count} < {archive_copies_needed}) to delete "
+                    f"{copy.file.path} on node {self.name}"
+                )
+                continue
+
+            # Don't delete file copies which are the source for pending
+            # copy requests
+            if copy.file_id in pending:
+                log.info(
+                    f"Skipping delete of {copy.file.path} on node {self.name}: "
+                    "transfer pending"
+                )
+                continue
+
+            # Keep a running total of how much more deletion is needed.
+            if avail_needed is not None and avail_needed > 0:
+                if copy.size_b:
+                    avail_needed -= copy.size_b
+                elif copy.file.size_b:
+                    avail_needed -= copy.file.size_b
+
+            yield copy, avail_needed
+
     def check_pull_dest(
         self, message: str | None = None, log_level: int = logging.INFO
     ) -> bool:
@@ -18,6 +18,12 @@ ImportDetect = Callable[
     tuple[pathlib.Path | str | None, ImportCallback | None],
 ]
 
+# This is the type alias for the batched detect routine
+ImportDetectMany = Callable[
+    [list[pathlib.Path], UpdateableNode],
+    list[tuple[pathlib.Path | str | None, ImportCallback | None]],
+]
+
 
 class ImportDetectExtension(Extension):
     """An Import Detect Extension.
@@ -63,6 +69,16 @@ class ImportDetectExtension(Extension):
     If multiple `import-detect` extensions are provided, they will be called in the
     order given in the config file until one of them indicates a successful match.
 
+    An extension may also provide a `detect_many` function, which alpenhorn
+    will use instead of `detect` when it has several files to consider at
+    once (e.g. when scanning a node).  It is passed a list of paths, instead
+    of a single path, and the node, and must return a list of two-tuples, one
+    per path, in the same order, each of which is what `detect` would have
+    returned for that path.  Providing `detect_many` is optional, but allows
+    an extension to amortise its per-call costs, like database queries,
+    over many files.  The `DetectCache` class in `alpenhorn.common.extload`
+    may be helpful in implementing either function.
+
     Attributes
     ----------
     name : str
@@ -74,6 +90,8 @@ class ImportDetectExtension(Extension):
         `packaging.version`.
     detect : Callable
         The detection routine.  See above.
+    detect_many : Callable, optional
+        The batched detection routine.  See above.
     min_version : str, optional
         If given, the minimum Alpenhorn version supported by
         this Extension.  Note: it may make more sense for an extension
@@ -101,6 +119,7 @@ class ImportDetectExtension(Extension):
         min_version: str | None = None,
         max_version: str | None = None,
         require_schema: dict[str, int | str] | None = None,
+        detect_many: ImportDetectMany | None = None,
     ) -> None:
         super().__init__(
             name,
@@ -112,3 +131,6 @@ class ImportDetectExtension(Extension):
         if not callable(detect):
             raise ValueError("detect must be callable.")
         self.detect = detect
+        if detect_many is not None and not callable(detect_many):
+            raise ValueError("detect_many must be callable.")
+        self.detect_many = detect_many
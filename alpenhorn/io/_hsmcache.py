@@ -0,0 +1,272 @@
+"""HSM state cache.
+
+This module provides the `HSMStateCache` class, which remembers which file
+copies on a LustreHSM node are restored, as determined by lfs(1), so that
+files to release can be found without having to query the state of every
+file on the node.
+"""
+
+from __future__ import annotations
+
+import heapq
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+
+from ._lfs import HSMState
+
+log = logging.getLogger(__name__)
+
+
+class HSMStateCache:
+    """A cache of the restored file copies on a node.
+
+    States are recorded by calling `update` whenever alpenhorn learns the
+    state of a file copy (during idle state checks, restores, and releases).
+    Only restored copies are kept: recording any other state forgets the
+    copy.  Recorded states older than `max_age` seconds are considered stale
+    and are ignored.  Call `expire` periodically to discard them.
+
+    Restored file copies are kept in a min-heap ordered by last access
+    (typically the `last_update` of the copy record), so `plan` can pick
+    the least-recently-used restored files to release without running
+    lfs(1) at all.
+
+    If `path` is given, the cache is loaded from that file, if it exists,
+    when created, and can be written back to it by calling `save`.
+
+    Instances are thread-safe.
+
+    Parameters
+    ----------
+    max_age : float
+        The time, in seconds, after which a recorded state becomes stale.
+    path : path-like, optional
+        The file used to persist the cache between runs.
+    """
+
+    __slots__ = [
+        "_entries",
+        "_expired",
+        "_heap",
+        "_lock",
+        "_saved",
+        "max_age",
+        "path",
+    ]
+
+    def __init__(self, max_age: float, path: os.PathLike | str | None = None) -> None:
+        if max_age <= 0:
+            raise ValueError(f"max_age non-positive (={max_age})")
+        self.max_age = max_age
+        self.path = None if path is None else pathlib.Path(path)
+
+        # Keys are ArchiveFileCopy ids.  Values are tuples:
+        #   (state, time checked, last access, size in bytes, path)
+        self._entries = {}
+
+        # Restored copies as (last access, copy id) tuples.  Entries for
+        # copies which are no longer restored are discarded lazily.
+        self._heap = []
+
+        self._lock = threading.Lock()
+
+        # time.monotonic() of the last save and expiry
+        self._saved = None
+        self._expired = None
+
+        if self.path is not None:
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _fresh(self, entry: tuple, now: float) -> bool:
+        """Is `entry` not stale?"""
+        return now - entry[1] < self.max_age
+
+    def update(
+        self,
+        copy_id: int,
+        state: HSMState | None,
+        last_access: float = 0,
+        size: int = 0,
+        path: os.PathLike | str = "",
+    ) -> None:
+        """Record the HSM state of a file copy.
+
+        Parameters
+        ----------
+        copy_id : int
+            The id of the ArchiveFileCopy.
+        state : HSMState or None
+            The current HSM state of the copy.  If this is anything other
+            than `HSMState.RESTORED` (including None, meaning the state
+            couldn't be determined), the copy is forgotten.
+        last_access : float, optional
+            The time (as a POSIX timestamp) the copy was last accessed.  Used
+            to order restored copies in `plan`.
+        size : int, optional
+            The size of the copy in bytes.
+        path : path-like, optional
+            The absolute path to the copy.
+        """
+        with self._lock:
+            if state != HSMState.RESTORED:
+                self._entries.pop(copy_id, None)
+                return
+
+            old = self._entries.get(copy_id)
+            self._entries[copy_id] = (state, time.time(), last_access, size, str(path))
+
+            # Don't push a duplicate heap entry if nothing's changed
+            if old is None or old[2] != last_access:
+                heapq.heappush(self._heap, (last_access, copy_id))
+
+    def get(self, copy_id: int) -> HSMState | None:
+        """Returns the recorded state of a file copy.
+
+        Returns None if there's no fresh state recorded for the copy.
+        """
+        entry = self._entries.get(copy_id)
+        if entry is None or not self._fresh(entry, time.time()):
+            return None
+        return entry[0]
+
+    def plan(self, size: int) -> list[tuple[int, str, int]]:
+        """Plan the release of `size` bytes.
+
+        Picks the least-recently-accessed restored file copies until their
+        total size reaches `size`, or the known restored copies run out.
+        The chosen copies are forgotten: the caller should call `update` on
+        each of them after trying to release it.
+
+        Parameters
+        ----------
+        size : int
+            The number of bytes to release.
+
+        Returns
+        -------
+        plan : list of tuples
+            The copies to release as (copy id, path, size) tuples, in order.
+        """
+        plan = []
+        total = 0
+        now = time.time()
+        with self._lock:
+            while self._heap and total < size:
+                last_access, copy_id = heapq.heappop(self._heap)
+                entry = self._entries.get(copy_id)
+
+                # Skip heap entries which no longer reflect the recorded state
+                if entry is None or entry[2] != last_access:
+                    continue
+
+                # Drop stale entries entirely
+                if not self._fresh(entry, now):
+                    del self._entries[copy_id]
+                    continue
+
+                del self._entries[copy_id]
+                plan.append((copy_id, entry[4], entry[3]))
+                total += entry[3]
+
+        return plan
+
+    def expire(self, interval: float | None = None) -> None:
+        """Forget all stale states.
+
+        Parameters
+        ----------
+        interval : float, optional
+            If given, and stale states were expired less than this many
+            seconds ago, do nothing.
+        """
+        if (
+            interval is not None
+            and self._expired is not None
+            and time.monotonic() - self._expired < interval
+        ):
+            return
+        self._expired = time.monotonic()
+
+        now = time.time()
+        with self._lock:
+            self._entries = {
+                copy_id: entry
+                for copy_id, entry in self._entries.items()
+                if self._fresh(entry, now)
+            }
+            self._heap = [
+                (entry[2], copy_id) for copy_id, entry in self._entries.items()
+            ]
+            heapq.heapify(self._heap)
+
+    def load(self) -> None:
+        """Load the cache from `self.path`.
+
+        Does nothing if the file doesn't exist.  If the file can't be read,
+        a warning is logged and the cache is left empty.
+        """
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            entries = {
+                int(copy_id): (HSMState[state], checked, last_access, size, path)
+                for copy_id, (state, checked, last_access, size, path) in data.items()
+                if state == HSMState.RESTORED.name
+            }
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            log.warning(f"Unable to load HSM state cache from {self.path}: {e}")
+            return
+
+        with self._lock:
+            self._entries = entries
+        self.expire()
+        log.debug(f"Loaded {len(self)} HSM states from {self.path}")
+
+    def save(self, max_age: float | None = None) -> None:
+        """Write the cache to `self.path`.
+
+        Does nothing if `self.path` is None.  If the file can't be written,
+        a warning is logged.
+
+        Parameters
+        ----------
+        max_age : float, optional
+            If given, and the cache was saved less than this many seconds
+            ago, do nothing.
+        """
+        if self.path is None:
+            return
+
+        if (
+            max_age is not None
+            and self._saved is not None
+            and time.monotonic() - self._saved < max_age
+        ):
+            return
+        self._saved = time.monotonic()
+
+        self.expire()
+        with self._lock:
+            data = {
+                copy_id: (entry[0].name, *entry[1:])
+                for copy_id, entry in self._entries.items()
+            }
+
+        # Write to a temporary file first, so an interrupted write doesn't
+        # clobber the existing cache.
+        tmp_path = self.path.with_name("." + self.path.name + ".tmp")
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.warning(f"Unable to save HSM state cache to {self.path}: {e}")
@@ -12,7 +12,8 @@ run these commands:
     fixed max quota, for cases where "lfs quota" doesn't correctly
     report the max.
 * `lfs hsm_state`
-    to retrieve the HSM state for a file.  The state itself is
+    to retrieve the HSM state for a file, or for many files at once.
+    The state itself is
     represented with the `HSMState` enum and is one of:
         * `MISSING`:    file is not present on disk or external storage
         * `UNARCHIVED`: file exists on disk, but not on external storage
@@ -24,9 +25,11 @@ run these commands:
         * `RESTORING`:  file exists in external storage only, but HSM
                         is in the process of restoring it
 * `lfs hsm_restore`
-    requests the state change `RELEASED -> RESTORED`
+    requests the state change `RELEASED -> RESTORED`, for one file
+    or for many files at once
 * `lfs hsm_release`
-    requests the state change `RESTORED -> RELEASED`
+    requests the state change `RESTORED -> RELEASED`, for one file
+    or for many files at once
 """
 
 from __future__ import annotations
@@ -37,9 +40,15 @@ import shutil
 from enum import Enum
 
 from ..daemon import proc
+from ._lfshelper import LFSHelper
 
 log = logging.getLogger(__name__)
 
+# Limits on the command line used when running lfs(1) on many paths
+# at once.  These are well below the limits imposed by the kernel.
+_MANY_MAX_PATHS = 1000
+_MANY_MAX_BYTES = 64 * 2**10
+
 
 class HSMState(Enum):
     """HSM States.
@@ -103,6 +112,10 @@ class LFS:
     timeout : int, optional
         Timeout, in seconds, before abandonning a lfs(1) invocation.
         Defaults to 60 seconds if not given.
+    helper : bool, optional
+        If True, run lfs(1) via long-lived helper processes (see
+        `alpenhorn.io._lfshelper`), rather than forking the daemon for
+        each invocation.  Defaults to False.
     """
 
     # Conveniences for callers
@@ -120,6 +133,7 @@ class LFS:
         lfs: str = "lfs",
         path: str | None = None,
         timeout: int | None = None,
+        helper: bool = False,
     ) -> None:
         self._quota_id = quota_id
         self._fixed_quota = fixed_quota
@@ -145,6 +159,25 @@ class LFS:
         if self._lfs is None:
             raise RuntimeError("lfs command not found.")
 
+        self._helper = LFSHelper() if helper else None
+
+    def close(self) -> None:
+        """Stop the helper co-processes, if any.
+
+        The helper is restarted if this instance is used again.
+        """
+        if self._helper is not None:
+            self._helper.close()
+
+    def _run_command(self, args: list[str]) -> tuple[int | None, str, str]:
+        """Run lfs with `args`, via the helper process, if we have one.
+
+        Returns the result of `proc.run_command`."""
+        cmd = [self._lfs, *args]
+        if self._helper is not None:
+            return self._helper.run_command(cmd, timeout=self._timeout)
+        return proc.run_command(cmd, timeout=self._timeout)
+
     def run_lfs(self, *args: str) -> dict:
         """Run the lfs command with the `args` provided.
 
@@ -175,9 +208,7 @@ class LFS:
         # Stringify args
         args = [str(arg) for arg in args]
 
-        ret, stdout, stderr = proc.run_command(
-            [self._lfs, *args], timeout=self._timeout
-        )
+        ret, stdout, stderr = self._run_command(args)
 
         # Timeout
         if ret is None:
@@ -205,6 +236,121 @@ class LFS:
             log.debug(f"LFS stdout: {stdout}")
         return result
 
+    def _run_lfs_many(
+        self, command: str, paths: list[str], output: bool = True
+    ) -> dict[str, str | bool | None]:
+        """Run "lfs `command`" on many `paths`.
+
+        The paths are split into chunks small enough to fit on a command
+        line, and `command` is run once per chunk.
+
+        Parameters
+        ----------
+        command : str
+            The lfs command to run.
+        paths : list of str
+            The paths to run `command` on.
+        output : bool, optional
+            If True, the command must output one line per path starting with
+            the path followed by a colon.  If False, the command must not
+            produce output on success, and a path only succeeds (with empty
+            output) if the command succeeds.
+
+        Returns
+        -------
+        result : dict
+            Keys are the elements of `paths`.  Values are one of:
+            * the output line for the path, with the leading path and
+              colon removed, if the command succeeded for the path
+            * False, if the path was missing
+            * None, if the command failed for the path
+        """
+        result = {}
+
+        chunks = []
+        chunk = []
+        nbytes = 0
+        for path in paths:
+            if chunk and (
+                len(chunk) >= _MANY_MAX_PATHS or nbytes + len(path) > _MANY_MAX_BYTES
+            ):
+                chunks.append(chunk)
+                chunk = []
+                nbytes = 0
+            chunk.append(path)
+            nbytes += len(path) + 1
+        if chunk:
+            chunks.append(chunk)
+
+        for chunk in chunks:
+            self._run_lfs_chunk(command, chunk, output, result)
+
+        return result
+
+    def _run_lfs_chunk(
+        self, command: str, chunk: list[str], output: bool, result: dict
+    ) -> None:
+        """Run "lfs `command`" on the paths in `chunk`.
+
+        A helper for `_run_lfs_many`, which see.  Results are added to
+        `result`.
+
+        lfs(1) may give up on the remaining paths after the first one which
+        fails, or, for some commands, not act on any of them.  So, when the
+        command fails, only paths which produced output, or were named in an
+        error message, have a known result.  The command is then re-run on the
+        rest, until every path has been accounted for.
+        """
+        pending = chunk
+        while pending:
+            ret, stdout, stderr = self._run_command([command, *pending])
+
+            # Timeout
+            if ret is None:
+                log.warning(f"LFS command timed out: {command} [{len(pending)} paths]")
+                result.update(dict.fromkeys(pending))
+                return
+
+            if ret != 0 and stderr:
+                log.debug(f"LFS stderr: {stderr}")
+
+            # Output lines are in the same order as the paths
+            lines = stdout.splitlines() if stdout else []
+            errors = stderr.splitlines() if stderr else []
+            rest = []
+            for path in pending:
+                if output and lines and lines[0].startswith(path + ":"):
+                    result[path] = lines.pop(0)[len(path) + 1 :]
+                elif not output and ret == 0:
+                    result[path] = ""
+                elif any(
+                    path in line and "No such file or directory" in line
+                    for line in errors
+                ) or (
+                    len(pending) == 1
+                    and stderr
+                    and "No such file or directory" in stderr
+                ):
+                    log.debug(f"LFS missing file: {command} {path}")
+                    result[path] = False
+                elif (
+                    ret == 0
+                    or len(pending) == 1
+                    or any(path in line for line in errors)
+                ):
+                    log.warning(f"LFS command failed: {command} {path}")
+                    result[path] = None
+                else:
+                    # Unknown: lfs may not have got to this one
+                    rest.append(path)
+
+            if len(rest) == len(pending):
+                # No progress at all: run the paths one at a time
+                for path in rest:
+                    self._run_lfs_chunk(command, [path], output, result)
+                return
+            pending = rest
+
     def quota_remaining(self, path: str | os.PathLike) -> int | None:
         """Retrieve the remaining quota for `path`.
 
@@ -354,6 +500,89 @@ class LFS:
 
         stdout = result["output"]
 
+        # Strip path from the output to handle the corner case where, say,
+        # "archived" is part of the filename.
+        if stdout.startswith(path + ":"):
+            stdout = stdout[len(path) :]
+        else:
+            log.warning(f"Error parsing hsm_state output: {stdout}")
+            return None  # Parsing failed
+
+        state = self._parse_hsm_state(stdout)
+
+        # If the file is released, run `hsm_action` to see if a restore is in
+        # progress
+        if state == HSMState.RELEASED and self.hsm_restoring(path):
+            return HSMState.RESTORING
+
+        return state
+
+    def hsm_state_many(
+        self, paths: list[os.PathLike | str], restoring: bool = True
+    ) -> dict[str, HSMState | None]:
+        """Returns the HSM state of many paths.
+
+        This is equivalent to calling `hsm_state` on each of `paths`, but
+        runs "lfs hsm_state" (and "lfs hsm_action", if needed) once per
+        chunk of paths, rather than once per path.
+
+        Parameters
+        ----------
+        paths : list of path-like
+            The paths to determine the state for.
+        restoring : bool, optional
+            If False, don't check whether released files are being restored:
+            `HSMState.RESTORING` will never be returned; those files will be
+            reported as `HSMState.RELEASED` instead.  This saves running
+            "lfs hsm_action" when the distinction doesn't matter.
+
+        Returns
+        -------
+        states : dict
+            Keys are the elements of `paths`, stringified.  Values are the
+            state of the path, as would be returned by `hsm_state`.
+        """
+        # Stringify paths
+        paths = [str(path) for path in paths]
+
+        states = {}
+        for path, output in self._run_lfs_many("hsm_state", paths).items():
+            if output is False:
+                states[path] = HSMState.MISSING
+            elif output is None:
+                states[path] = None
+            else:
+                states[path] = self._parse_hsm_state(output)
+
+        # Find released files that are being restored
+        if restoring:
+            released = [
+                path for path, state in states.items() if state == HSMState.RELEASED
+            ]
+            if released:
+                for path, output in self._run_lfs_many("hsm_action", released).items():
+                    if output and "RESTORE" in output:
+                        states[path] = HSMState.RESTORING
+
+        return states
+
+    @staticmethod
+    def _parse_hsm_state(output: str) -> HSMState:
+        """Parse the output of "lfs hsm_state" for a single file.
+
+        Released files are always reported as `HSMState.RELEASED`: the
+        output of "lfs hsm_state" can't distinguish files being restored.
+
+        Parameters
+        ----------
+        output : str
+            The output of "lfs hsm_state" with the leading path removed.
+
+        Returns
+        -------
+        state : HSMState
+            The parsed state.
+        """
         # The output of hsm_state looks like this:
         #
         # <path>: (<hus-states-bits>) [hus-states-words][, archive_id:<archive-id>]
@@ -368,29 +597,18 @@ class LFS:
         #  - "archive-id" is the archive ID (i.e. HSM backend index) for this
         #                      file.  If the file is unarchived, this whole
         #                      part, starting with the comma, is omitted.
-
-        # Strip path from the output to handle the corner case where, say,
-        # "archived" is part of the filename.
-        if stdout.startswith(path + ":"):
-            stdout = stdout[len(path) :]
-        else:
-            log.warning(f"Error parsing hsm_state output: {stdout}")
-            return None  # Parsing failed
+        #
+        # The path has already been removed, to handle the corner case
+        # where, say, "archived" is part of the filename.
 
         # Check some hus-states-words to figure out the state.  There are more
         # bits providing information, but I don't know if we care about them.
         #
         # See llapi_hsm_state_get(3) for full details about these.
-        if "archived" not in stdout:
+        if "archived" not in output:
             return HSMState.UNARCHIVED
-        if "released" not in stdout:
+        if "released" not in output:
             return HSMState.RESTORED
-
-        # File is released, so now run `hsm_action` to see if a restore is in
-        # progress
-        if self.hsm_restoring(path):
-            return HSMState.RESTORING
-
         return HSMState.RELEASED
 
     def hsm_archived(self, path: os.PathLike) -> bool:
@@ -443,6 +661,40 @@ class LFS:
             return None
         return True
 
+    def hsm_restore_many(
+        self, paths: list[os.PathLike | str]
+    ) -> dict[str, bool | None]:
+        """Trigger restore of many paths from external storage.
+
+        Unlike `hsm_restore`, this doesn't check the state of the paths
+        first: the caller should only pass paths known to be released.
+        "lfs hsm_restore" is run once per chunk of paths, letting HSM
+        schedule the restores together.
+
+        Parameters
+        ----------
+        paths : list of path-like
+            The paths to restore.
+
+        Returns
+        -------
+        restored : dict
+            Keys are the elements of `paths`, stringified.  Values are, as
+            for `hsm_restore`:
+            * True if a successful restore request was made for the path
+            * False if the request failed because the path was missing
+            * None if the request failed or timed out
+        """
+        # Stringify paths
+        paths = [str(path) for path in paths]
+
+        return {
+            path: result if result is None else result == ""
+            for path, result in self._run_lfs_many(
+                "hsm_restore", paths, output=False
+            ).items()
+        }
+
     def hsm_release(self, path: os.PathLike) -> bool:
         """Trigger release of `path` from disk.
 
@@ -474,3 +726,32 @@ class LFS:
 
         # Otherwise send the request
         return self.run_lfs("hsm_release", path) is not False
+
+    def hsm_release_many(self, paths: list[os.PathLike | str]) -> dict[str, bool]:
+        """Trigger release of many paths from disk.
+
+        Unlike `hsm_release`, this doesn't check the state of the paths
+        first: the caller should only pass paths known to be restored.
+        "lfs hsm_release" is run once per chunk of paths.
+
+        Parameters
+        ----------
+        paths : list of path-like
+            The paths to release.
+
+        Returns
+        -------
+        released : dict
+            Keys are the elements of `paths`, stringified.  Values are True
+            if a successful release request was made for the path, and False
+            otherwise.
+        """
+        # Stringify paths
+        paths = [str(path) for path in paths]
+
+        return {
+            path: result == ""
+            for path, result in self._run_lfs_many(
+                "hsm_release", paths, output=False
+            ).items()
+        }
@@ -0,0 +1,182 @@
+"""Long-lived lfs(1) helper process.
+
+Running lfs(1) via `proc.run_command` means forking the daemon for every
+call.  The daemon is large, and on a busy HSM node, especially under memory
+pressure, the forks themselves become expensive.  This module provides the
+`LFSHelper` class, which instead starts a few small co-processes, once, and
+asks them to run commands on the daemon's behalf over pipes.  Forking those
+processes is cheap.
+
+The co-process is this file run as a script.  It only uses the standard
+library, so it doesn't import alpenhorn, or any of alpenhorn's dependencies.
+
+The protocol is one JSON object per line in each direction.  Requests are
+objects with keys "cmd" (the command as a list of strings) and "timeout"
+(in seconds, or null).  Replies are objects with keys "ret" (the return
+code, or null on timeout), "stdout", and "stderr".  The co-process exits
+when its standard input is closed.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import queue
+import select
+import subprocess
+import sys
+
+log = logging.getLogger(__name__)
+
+# Extra time, in seconds, to wait for a reply from the helper beyond the
+# timeout of the command itself
+_REPLY_GRACE = 10
+
+
+class LFSHelper:
+    """A client for a small pool of lfs(1) helper co-processes.
+
+    Each co-process runs one command at a time, so up to `size` commands
+    can run concurrently.  Co-processes are started on first use, and
+    restarted if they die or stop responding.  Call `close` to stop them.
+
+    Instances are thread-safe.
+
+    Parameters
+    ----------
+    size : int, optional
+        The maximum number of co-processes to run.
+    """
+
+    __slots__ = ["_free", "_procs"]
+
+    def __init__(self, size: int = 4) -> None:
+        self._procs = [None] * size
+
+        # Indices of the idle slots in self._procs.  LIFO, so that under light
+        # load the same co-process is re-used, and the rest are never started.
+        self._free = queue.LifoQueue()
+        for index in reversed(range(size)):
+            self._free.put(index)
+
+    def _start(self, index: int) -> subprocess.Popen:
+        """Start the co-process in slot `index`."""
+        proc = subprocess.Popen(
+            [sys.executable, __file__],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+        self._procs[index] = proc
+        log.debug(f"Started lfs helper #{index} [pid={proc.pid}]")
+        return proc
+
+    def _stop(self, index: int) -> None:
+        """Stop the co-process in slot `index`, if running."""
+        proc = self._procs[index]
+        self._procs[index] = None
+        if proc is None:
+            return
+
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            proc.wait(timeout=_REPLY_GRACE)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+    def close(self) -> None:
+        """Stop all the co-processes."""
+        for index in range(len(self._procs)):
+            self._stop(index)
+
+    def run_command(
+        self, cmd: list[str], timeout: float | None = None
+    ) -> tuple[int | None, str, str]:
+        """Run a command via a co-process.
+
+        Waits for a co-process to become free, if they're all busy.
+
+        Parameters
+        ----------
+        cmd : list of strings
+            A command as a list of strings including all arguments.
+        timeout : float or None
+            Number of seconds to wait before killing the command, or None
+            to wait forever.
+
+        Returns
+        -------
+        retval : int or None
+            Return code, or None if the command timed out or the helper
+            failed.  Integer zero indicates success.
+        stdout : string
+            Value of stdout.
+        stderr : string
+            Value of stderr.
+        """
+        log.debug(f"Running command via helper [timeout={timeout}]: " + " ".join(cmd))
+
+        index = self._free.get()
+        try:
+            proc = self._procs[index]
+            if proc is None or proc.poll() is not None:
+                proc = self._start(index)
+
+            proc.stdin.write(json.dumps({"cmd": cmd, "timeout": timeout}) + "\n")
+            proc.stdin.flush()
+
+            ready, _, _ = select.select(
+                [proc.stdout],
+                [],
+                [],
+                None if timeout is None else timeout + _REPLY_GRACE,
+            )
+            if not ready:
+                raise TimeoutError("no reply")
+
+            line = proc.stdout.readline()
+            if not line:
+                raise EOFError("helper exited")
+
+            reply = json.loads(line)
+            return reply["ret"], reply["stdout"], reply["stderr"]
+        except (OSError, ValueError, KeyError, TimeoutError, EOFError) as e:
+            # Start afresh next time
+            log.warning(f"lfs helper #{index} failed: {e}")
+            self._stop(index)
+            return (None, "", "")
+        finally:
+            self._free.put(index)
+
+
+def _serve() -> None:
+    """Helper co-process main loop."""
+    for line in sys.stdin:
+        request = json.loads(line)
+        try:
+            result = subprocess.run(
+                request["cmd"],
+                capture_output=True,
+                timeout=request["timeout"],
+            )
+            reply = {
+                "ret": result.returncode,
+                "stdout": result.stdout.decode(errors="replace"),
+                "stderr": result.stderr.decode(errors="replace"),
+            }
+        except subprocess.TimeoutExpired:
+            reply = {"ret": None, "stdout": "", "stderr": ""}
+        except OSError as e:
+            reply = {"ret": 127, "stdout": "", "stderr": str(e)}
+
+        sys.stdout.write(json.dumps(reply) + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    _serve()
@@ -121,6 +121,25 @@ class BaseNodeRemote:
         """
         raise NotImplementedError("method must be re-implemented in subclass.")
 
+    def pull_ready_many(self, files: list[ArchiveFile]) -> set[ArchiveFile]:
+        """Which of `files` are ready for pulling from this remote node?
+
+        The default implementation calls `pull_ready` on each file.  Remote
+        I/O classes which can determine readiness of many files more
+        efficiently should re-implement this.
+
+        Parameters
+        ----------
+        files : list of ArchiveFile
+            the files being checked
+
+        Returns
+        -------
+        ready : set of ArchiveFile
+            The elements of `files` which are ready on the node.
+        """
+        return {file for file in files if self.pull_ready(file)}
+
     def remote_pull_ok(self, host: str) -> bool:
         """Check if a remote pull to `host` is possible.
 
@@ -253,8 +272,38 @@ class BaseNodeIO:
         # Do nothing
         pass
 
+    def stop(self) -> None:
+        """Stop hook.
+
+        Called when alpenhorn stops using this I/O instance, either
+        because the node is being removed from the update loop, or
+        because the I/O instance is being re-created.  Tasks already
+        queued for the node have been discarded.
+
+        Use this to release any resources held for work which will now
+        never happen.
+        """
+        # Do nothing
+        pass
+
     # I/O METHODS
 
+    def adjust_bytes_avail(self, size: int) -> None:
+        """Note a change of `size` bytes in the free space on the node.
+
+        Called after alpenhorn has added (negative `size`) or removed
+        (positive `size`) data on the node, so I/O classes which cache the
+        result of `bytes_avail` can keep it current between slow calls.
+
+        The default implementation does nothing.
+
+        Parameters
+        ----------
+        size : int
+            The change, in bytes, in free space.
+        """
+        pass
+
     def bytes_avail(self, fast: bool = False) -> int | None:
         """bytes_avail: Return amount of free space (in bytes) of the node, or
         None if that cannot be determined.
@@ -287,6 +336,25 @@ class BaseNodeIO:
         """
         raise NotImplementedError("method must be re-implemented in subclass.")
 
+    def check_many(self, copies: list[ArchiveFileCopy]) -> None:
+        """Check whether the ArchiveFileCopy list `copies` are corrupt.
+
+        This is called by the update loop with all the suspect file copies
+        found on the node.  The `file` and `file.acq` of each copy have
+        already been fetched from the database.
+
+        The default implementation simply calls `check` on each copy in turn.
+        I/O classes which can check many files more efficiently than one at a
+        time should re-implement this method.
+
+        Parameters
+        ----------
+        copies : list of ArchiveFileCopy
+            the file copies to check.  May be empty.
+        """
+        for copy in copies:
+            self.check(copy)
+
     def check_init(self) -> bool:
         """Check that this node is initialised.
 
@@ -364,13 +432,26 @@ class BaseNodeIO:
         """
         raise NotImplementedError("method must be re-implemented in subclass.")
 
-    def file_walk(self, path: pathlib.Path) -> Iterable[pathlib.PurePath]:
+    def file_walk(
+        self,
+        path: pathlib.Path,
+        max_depth: int | None = None,
+        prefix: str | None = None,
+    ) -> Iterable[pathlib.PurePath]:
         """Iterate through directory `path`.
 
         Should successively yield a pathlib.PurePath for each file under `path`,
         which is relative to the node `root.  The returned path may either be
         absolute (i.e have node.root pre-pended) or else be relative to
         node.root.  The former is preferred.
+
+        If `max_depth` is not None, only files at most that many levels of
+        subdirectories below `path` should be yielded.  If `prefix` is not
+        None, only files whose path relative to node.root starts with the
+        string `prefix` should be yielded.
+
+        Everything yielded should be a regular file: callers may skip
+        checking this.
         """
         raise NotImplementedError("method must be re-implemented in subclass.")
 
@@ -420,7 +501,9 @@ class BaseNodeIO:
         """
         raise NotImplementedError("method must be re-implemented in subclass.")
 
-    def md5(self, path: str | pathlib.Path, *segments) -> str | None:
+    def md5(
+        self, path: str | pathlib.Path, *segments, drop_cache: bool = False
+    ) -> str | None:
         """Compute the MD5 hash of the file at the specified path.
 
         Parameters
@@ -430,6 +513,13 @@ class BaseNodeIO:
             the file to hash.  Relative to `node.root`.
         *segments : iterable, optional
             other path segments path-concatenated and appended to `path`.
+        drop_cache : bool, optional
+            If True, the file isn't expected to be read again soon, so
+            implementations may avoid keeping it in cache.
+
+            This keyword was added after `md5` was first defined.
+            Implementations should accept it, but `check_async` still
+            supports ones which don't, by not passing it.
 
         Returns
         -------
@@ -17,10 +17,10 @@ from ..base import InternalIO
 
 # The rest of these import simplify other I/O classes re-using
 # Default I/O methods
-from .check import check_async
+from .check import check_async, check_many_async
 from .delete import delete_async, remove_filedir
-from .pull import pull_async
-from .updownlock import UpDownLock
+from .pull import pull_async, pull_batch_async
+from .updownlock import TreeLock, UpDownLock
 
 # This is the set-up for the internal Default I/O module
 DefaultIO = InternalIO(__name__, DefaultNodeIO, DefaultGroupIO)
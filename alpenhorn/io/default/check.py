@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+import inspect
 import logging
 import pathlib
 
@@ -14,6 +15,21 @@ from ..base import BaseNodeIO
 log = logging.getLogger(__name__)
 
 
+def _md5_cold(io: BaseNodeIO, path: pathlib.Path) -> str | None:
+    """Hash the cold file at `path` using `io.md5`.
+
+    Asks `io.md5` to drop the file from the page cache, unless the I/O class
+    overrides `md5` with an implementation which predates the `drop_cache`
+    keyword.
+    """
+    parameters = inspect.signature(io.md5).parameters
+    if "drop_cache" in parameters or any(
+        param.kind == param.VAR_KEYWORD for param in parameters.values()
+    ):
+        return io.md5(path, drop_cache=True)
+    return io.md5(path)
+
+
 def check_async(
     task: Task, io: BaseNodeIO, copy: ArchiveFileCopy, path: pathlib.Path | None = None
 ) -> None:
@@ -69,7 +85,9 @@ def check_async(
             copy.has_file = "X"
         else:
             # If size is okay, check MD5 sum
-            md5sum = io.md5(fullpath)
+            # Checked files are typically cold, so don't let them pollute
+            # the page cache
+            md5sum = _md5_cold(io, fullpath)
             if md5sum == copy.file.md5sum:
                 log.info(f"File {copyname} on node {io.node.name} is A-OK!")
                 copy.has_file = "Y"
@@ -90,3 +108,21 @@ def check_async(
     )
     copy.last_update = utcnow()
     copy.save()
+
+
+def check_many_async(task: Task, io: BaseNodeIO, copies: list[ArchiveFileCopy]) -> None:
+    """Check a batch of file copies.  This is asynchronous.
+
+    Runs `check_async` on each copy in `copies`, in order.
+
+    Parameters
+    ----------
+    task : Task
+        The task instance containing this async.
+    io : Node I/O instance
+        The I/O instance on which the file copies live
+    copies : list of ArchiveFileCopy
+        The copies to check.  Never empty.
+    """
+    for copy in copies:
+        check_async(task, io, copy)
@@ -13,13 +13,14 @@ from ...db import (
     StorageNode,
     utcnow,
 )
-from .updownlock import UpDownLock
+from ..base import BaseNodeIO
+from .updownlock import TreeLock, UpDownLock
 
 log = logging.getLogger(__name__)
 
 
 def remove_filedir(
-    node: StorageNode, dirname: pathlib.Path, tree_lock: UpDownLock
+    node: StorageNode, dirname: pathlib.Path, tree_lock: TreeLock | UpDownLock
 ) -> None:
     """Try to delete a file's parent directory(s) from a node
 
@@ -43,9 +44,10 @@ def remove_filedir(
         The node to delete the acq directory from.
     dirname: pathlib.Path
         The path to delete.  Must be absolute and rooted at `node.root`.
-    tree_lock: UpDownLock
-        This function will block until it can acquire the down lock and
-        all I/O will happen while holding the lock down.
+    tree_lock: TreeLock or UpDownLock
+        This function will block until it can acquire the down lock
+        on the stripe containing `dirname` and all I/O will happen while
+        holding the lock down.
 
     Raises
     ------
@@ -57,7 +59,7 @@ def remove_filedir(
         raise ValueError(f"dirname {dirname} not rooted under {node.root}")
 
     # try to delete the directories.  This must be done while locking down the tree lock
-    with tree_lock.down:
+    with tree_lock.stripe(dirname).down:
         while str(dirname) != node.root:
             try:
                 dirname.rmdir()
@@ -79,7 +81,10 @@ def remove_filedir(
 
 
 def delete_async(
-    task: Task, tree_lock: UpDownLock, copies: list[ArchiveFileCopy]
+    task: Task,
+    tree_lock: TreeLock | UpDownLock,
+    copies: list[ArchiveFileCopy],
+    io: BaseNodeIO | None = None,
 ) -> None:
     """Delete some file copies, if possible.
 
@@ -92,20 +97,25 @@ def delete_async(
     ----------
     task : Task
         The task instance containing this async.
-    tree_lock : UpDownLock
+    tree_lock : TreeLock or UpDownLock
         The directory tree modificiation lock.
     copies : list of ArchiveFileCopy
         The list of copies to delete.  Never empty.
+    io : Node I/O instance, optional
+        If given, the I/O instance of the node, which is notified of the
+        space freed by deleting the copies.
     """
 
     # Node name
-    name = copies[0].node.name
+    node = copies[0].node
+    name = node.name
 
-    # Process candidates for deletion
-    for copy in copies:
-        # Re-run database checks
-        if not copy.check_delete():
-            continue  # Skip this one
+    # Process candidates for deletion, re-running the database checks, since
+    # things may have changed since the deletion was planned.  Only the copies
+    # which are still deletable are yielded.
+    for copy, _ in list(
+        node.plan_deletions(ArchiveFileCopy.id << [copy.id for copy in copies])
+    ):
 
         shortname = copy.file.path
         fullpath = copy.path
@@ -124,6 +134,8 @@ def delete_async(
                     counter=True,
                     bound={"node": name},
                 ).add(copy.file.size_b)
+                if io is not None:
+                    io.adjust_bytes_avail(copy.file.size_b)
             log.info(f"Removed file copy {shortname} on {name}")
         except OSError as e:
             if e.errno == errno.ENOENT:
@@ -135,7 +147,7 @@ def delete_async(
 
         # Check if any containing directory is now empty
         # and remove if they are.
-        remove_filedir(copy.node, fullpath.parent, tree_lock)
+        remove_filedir(node, fullpath.parent, tree_lock)
 
         # Update the DB
         ArchiveFileCopy.update(
@@ -15,7 +15,7 @@ import pathlib
 from collections.abc import Hashable
 
 from ...daemon import UpdateableNode
-from ...daemon.scheduler import FairMultiFIFOQueue, Task
+from ...daemon.scheduler import PRIORITY_PULL, FairMultiFIFOQueue, Task
 from ...db import (
     ArchiveFileCopyRequest,
     StorageNode,
@@ -24,6 +24,10 @@ from ..base import BaseGroupIO
 
 log = logging.getLogger(__name__)
 
+# Node file inventories less than this many seconds old are used as-is
+# during a group search
+_INVENTORY_MAX_AGE = 60
+
 
 def group_search_async(
     task: Task,
@@ -65,6 +69,11 @@ def group_search_async(
     # Check whether an actual file exists on the target
     found_missing = False
     for node in groupio.nodes:
+        # No need to look for files the node already knows about
+        node.inventory.refresh(max_age=_INVENTORY_MAX_AGE)
+        if req.file.path in node.inventory:
+            continue
+
         if node.io.exists(req.file.path):
             # Request check if not already known to alpenhorn
             found_missing = node.db.check_unregistered(
@@ -211,4 +220,5 @@ class DefaultGroupIO(BaseGroupIO):
             key=self.fifo,
             args=(self, req),
             name=f"Pre-pull search for {req.file.path} in {self.group.name}",
+            priority=PRIORITY_PULL,
         )
@@ -10,13 +10,19 @@ import logging
 import os
 import pathlib
 import threading
-from collections.abc import Hashable, Iterable
+from collections.abc import Hashable, Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from typing import IO
 
 from watchdog.observers import Observer
 
 from ...daemon.proc import md5sum_file
-from ...daemon.scheduler import FairMultiFIFOQueue, Task
+from ...daemon.scheduler import (
+    PRIORITY_IDLE,
+    PRIORITY_PULL,
+    FairMultiFIFOQueue,
+    Task,
+)
 from ...db import (
     ArchiveAcq,
     ArchiveFile,
@@ -25,14 +31,98 @@ from ...db import (
     StorageNode,
 )
 from ..base import BaseNodeIO
-from .check import check_async
+from .check import check_async, check_many_async
 from .delete import delete_async, remove_filedir
-from .pull import pull_async
+from .pull import (
+    clean_partials,
+    engine_names,
+    find_partials,
+    pull_async,
+    pull_batch_async,
+)
 from .remote import DefaultNodeRemote
-from .updownlock import UpDownLock
+from .updownlock import TreeLock
 
 log = logging.getLogger(__name__)
 
+
+def _scandir(
+    path: str, root: str, depth: int, max_depth: int | None, prefix: str | None
+) -> tuple[list[pathlib.PurePath], list[tuple[str, int]]]:
+    """List one directory for `_walk`.
+
+    Returns
+    -------
+    files : list of pathlib.PurePath
+        The regular files in the directory which match `prefix`.
+    subdirs : list of tuple
+        The subdirectories to descend into, with their depth.
+    """
+    files = []
+    subdirs = []
+
+    # We use os.scandir instead of os.walk because it gives
+    # us DirEntry objects which have useful metadata in them
+    for entry in os.scandir(path):
+        if prefix is not None:
+            rel = os.path.relpath(entry.path, root)
+        if entry.is_dir():
+            if max_depth is not None and depth >= max_depth:
+                continue
+            if prefix is not None and not (
+                prefix.startswith(rel + "/") or (rel + "/").startswith(prefix)
+            ):
+                continue
+            subdirs.append((entry.path, depth + 1))
+        # is_file() on a symlink to a file returns true, so we need both
+        elif entry.is_file() and not entry.is_symlink():
+            if prefix is None or rel.startswith(prefix):
+                files.append(pathlib.PurePath(entry.path))
+
+    return files, subdirs
+
+
+def _walk(
+    path: pathlib.Path,
+    root: str,
+    threads: int,
+    max_depth: int | None,
+    prefix: str | None,
+) -> Iterator[pathlib.PurePath]:
+    """Walk the directory tree under `path`, yielding files.
+
+    See `DefaultNodeIO.file_walk`.
+    """
+    if threads == 1:
+        pending = [(str(path), 0)]
+        while pending:
+            dirpath, depth = pending.pop()
+            files, subdirs = _scandir(dirpath, root, depth, max_depth, prefix)
+            pending.extend(subdirs)
+            yield from files
+        return
+
+    executor = ThreadPoolExecutor(
+        max_workers=threads, thread_name_prefix="alpenhorn-walk"
+    )
+    try:
+        pending = {executor.submit(_scandir, str(path), root, 0, max_depth, prefix)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                for dirpath, depth in subdirs:
+                    pending.add(
+                        executor.submit(
+                            _scandir, dirpath, root, depth, max_depth, prefix
+                        )
+                    )
+                yield from files
+    finally:
+        # If the caller stopped early, don't bother listing the rest
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
 # Reserved byte counts are stored here, indexed by node name and protected
 # by the mutex
 _mutex = threading.Lock()
@@ -44,7 +134,66 @@ _IDLE_CLEANUP_PERIOD = 400  # (i.e. once every 400 opportunities)
 
 
 class DefaultNodeIO(BaseNodeIO):
-    """A simple StorageNode backed by a regular POSIX filesystem."""
+    """A simple StorageNode backed by a regular POSIX filesystem.
+
+    Optional io_config keys:
+        * check_batch_size : integer
+            The maximum number of file copies to verify in a single task
+            when checking suspect files (see check_many()).  Default is 10.
+        * max_concurrent_io : integer
+            The maximum number of I/O tasks for this node which may run
+            at the same time.  Default is no limit (other than the number
+            of worker threads).
+        * max_read_mbps : float
+            The approximate maximum rate, in megabytes (10^6 bytes) per
+            second, at which file copy and verification tasks for this
+            node are started, based on the size of the files they read.
+            Default is no limit.
+        * read_block_size : integer
+            The size, in bytes, of reads made when hashing files on this
+            node.  Default is the value of "daemon.hash_block_size" in the
+            config (8 MiB if not set).
+        * pull_engines : list of strings
+            The names of the transfer engines to try, in order, when pulling
+            files onto this node.  Engines which can't handle a particular
+            transfer (e.g. local-only engines for remote transfers) are
+            skipped.  See `alpenhorn.io.default.pull` for the list of
+            engines.  The default is ["link", "rsync", "internal"] for
+            local transfers and ["bbcp", "rsync"] for remote ones.
+        * pull_engines_from : dict
+            Overrides "pull_engines" for particular source nodes.  Keys are
+            source node names; values are lists of engine names.
+        * pull_streams : integer
+            The number of concurrent streams used by the "parallel"
+            transfer engine.  Default is 4.
+        * pull_chunk_size : integer
+            The size, in bytes, of the chunks copied by each stream of the
+            "parallel" transfer engine.  Default is 64 MiB.
+        * partial_max_days : float
+            Partial transfers left behind by failed pulls onto this node
+            are kept so that a later attempt can resume them.  Partial
+            transfers older than this many days are removed during idle
+            clean-up.  Default is 7.
+        * partial_max_bytes : integer
+            If given, the maximum total size, in bytes, of partial transfers
+            kept on the node.  If exceeded, the oldest partials are removed
+            during idle clean-up.  Default is no limit.
+        * pull_batch_size : integer
+            The maximum number of small files pulled from the same source
+            node in a single transfer.  Pull requests for small files are
+            collected during an update and dispatched together at the end
+            of it.  The default, 1, disables batching.
+        * pull_batch_bytes : integer
+            The maximum total size, in bytes, of the files pulled in a
+            single batched transfer.  Default is 1 GiB.
+        * pull_batch_file_size : integer
+            Only files no larger than this size, in bytes, are pulled in
+            batches.  Default is 16 MiB.
+        * walk_threads : integer
+            The number of threads used to list directories concurrently
+            when walking the node's directory tree (see file_walk()).
+            Default is 4.  Set to 1 to walk the tree serially.
+    """
 
     # SETUP
 
@@ -60,7 +209,7 @@ class DefaultNodeIO(BaseNodeIO):
         super().__init__(node, config, queue, fifo)
 
         # The directory tree modification lock
-        self.tree_lock = UpDownLock()
+        self.tree_lock = TreeLock(node.root, node=node.name)
 
         # When <= 1, the idle clean-up is allowed to run; we initialise
         # to zero to run it as soon as possible after start-up
@@ -70,6 +219,107 @@ class DefaultNodeIO(BaseNodeIO):
         with _mutex:
             _reserved_bytes.setdefault(node.name, 0)
 
+        # Number of copies checked per task by check_many()
+        self._check_batch_size = int(config.get("check_batch_size", 10))
+        if self._check_batch_size < 1:
+            raise ValueError(
+                "io_config key 'check_batch_size' non-positive "
+                f"(={self._check_batch_size})"
+            )
+
+        # Read size for hashing.  None means use the daemon default
+        self.read_block_size = config.get("read_block_size")
+        if self.read_block_size is not None:
+            self.read_block_size = int(self.read_block_size)
+            if self.read_block_size < 1:
+                raise ValueError(
+                    "io_config key 'read_block_size' non-positive "
+                    f"(={self.read_block_size})"
+                )
+
+        # Transfer engines
+        self.pull_engines = config.get("pull_engines")
+        self.pull_engines_from = config.get("pull_engines_from", {})
+        for engines in [self.pull_engines or [], *self.pull_engines_from.values()]:
+            for name in engines:
+                if name not in engine_names():
+                    raise ValueError(f"Unknown transfer engine in io_config: {name}")
+
+        self.pull_streams = int(config.get("pull_streams", 4))
+        if self.pull_streams < 1:
+            raise ValueError(
+                f"io_config key 'pull_streams' non-positive (={self.pull_streams})"
+            )
+        self.pull_chunk_size = int(config.get("pull_chunk_size", 64 * 1024 * 1024))
+        if self.pull_chunk_size < 1:
+            raise ValueError(
+                "io_config key 'pull_chunk_size' non-positive "
+                f"(={self.pull_chunk_size})"
+            )
+
+        # Batched pulls
+        self.pull_batch_size = int(config.get("pull_batch_size", 1))
+        self.pull_batch_bytes = int(config.get("pull_batch_bytes", 2**30))
+        self.pull_batch_file_size = int(config.get("pull_batch_file_size", 2**24))
+        for key in ["pull_batch_size", "pull_batch_bytes", "pull_batch_file_size"]:
+            if getattr(self, key) < 1:
+                raise ValueError(
+                    f"io_config key '{key}' non-positive (={getattr(self, key)})"
+                )
+
+        # Pending batched pulls, keyed by source node name
+        self._pull_batches = {}
+
+        # Directory walking
+        self.walk_threads = int(config.get("walk_threads", 4))
+        if self.walk_threads < 1:
+            raise ValueError(
+                f"io_config key 'walk_threads' non-positive (={self.walk_threads})"
+            )
+
+        # Partial transfer clean-up
+        self._partial_max_age = float(config.get("partial_max_days", 7)) * 86400
+        if self._partial_max_age <= 0:
+            raise ValueError(
+                "io_config key 'partial_max_days' non-positive "
+                f"(={config['partial_max_days']})"
+            )
+        self._partial_max_bytes = config.get("partial_max_bytes")
+        if self._partial_max_bytes is not None:
+            self._partial_max_bytes = int(self._partial_max_bytes)
+            if self._partial_max_bytes < 0:
+                raise ValueError(
+                    "io_config key 'partial_max_bytes' negative "
+                    f"(={self._partial_max_bytes})"
+                )
+
+        # The ids of copy requests which may have partial transfers on the
+        # node.  Added to by the parallel transfer engine.  Requests from
+        # before the daemon started are found by the first tidy-up.
+        self.partials = set()
+        self._partials_found = False
+
+        # Limits on the I/O we can do at once
+        max_concurrent_io = config.get("max_concurrent_io")
+        if max_concurrent_io is not None:
+            max_concurrent_io = int(max_concurrent_io)
+            if max_concurrent_io < 1:
+                raise ValueError(
+                    "io_config key 'max_concurrent_io' non-positive "
+                    f"(={max_concurrent_io})"
+                )
+        max_read_mbps = config.get("max_read_mbps")
+        if max_read_mbps is not None:
+            max_read_mbps = float(max_read_mbps)
+            if max_read_mbps <= 0:
+                raise ValueError(
+                    f"io_config key 'max_read_mbps' non-positive (={max_read_mbps})"
+                )
+            max_read_mbps *= 1e6  # to bytes per second
+        queue.set_fifo_limits(
+            fifo, max_inprogress=max_concurrent_io, max_rate=max_read_mbps
+        )
+
     # HOOKS
 
     def idle_update(self, newly_idle: bool) -> None:
@@ -80,7 +330,8 @@ class DefaultNodeIO(BaseNodeIO):
         progress for this node (i.e. `self.idle` is True).
 
         This will try to do some tidying-up: look for stale placeholders,
-        and attempt to delete empty acqdirs, whenever newly_idle is True.
+        remove stale partial transfers, and attempt to delete empty acqdirs,
+        whenever newly_idle is True.
 
         Parameters
         ----------
@@ -90,7 +341,13 @@ class DefaultNodeIO(BaseNodeIO):
         """
 
         # Task to do some cleanup
-        def _async(task, node, tree_lock):
+        def _async(task, node_io, node, tree_lock, max_age, max_bytes):
+            # Remove partial transfers which won't be resumed
+            if not node_io._partials_found:
+                node_io.partials |= find_partials(node, max_age)
+                node_io._partials_found = True
+            clean_partials(node, node_io.partials, max_age, max_bytes)
+
             # Loop over all acqs
             for acq in ArchiveAcq.select():
                 # Only continue if the directory for this acquisition exists
@@ -123,12 +380,38 @@ class DefaultNodeIO(BaseNodeIO):
                     queue=self._queue,
                     exclusive=True,
                     key=self.fifo,
-                    args=(self.node, self.tree_lock),
+                    args=(
+                        self,
+                        self.node,
+                        self.tree_lock,
+                        self._partial_max_age,
+                        self._partial_max_bytes,
+                    ),
                     name=f"Tidy up {self.node.name}",
+                    priority=PRIORITY_IDLE,
                 )
             else:
                 self._skip_idle_cleanup = self._skip_idle_cleanup - 1
 
+    def after_update(self) -> None:
+        """Post-update hook.
+
+        Dispatches any pending batched pulls.
+        """
+        for name in list(self._pull_batches):
+            self._flush_pull_batch(name)
+
+    def stop(self) -> None:
+        """Stop hook.
+
+        Drops any pending batched pulls, releasing the space reserved
+        for them.
+        """
+        for reqs in self._pull_batches.values():
+            for req in reqs:
+                self.release_bytes(req.file.size_b)
+        self._pull_batches = {}
+
     # I/O METHODS
 
     def bytes_avail(self, fast: bool = False) -> int | None:
@@ -169,8 +452,37 @@ class DefaultNodeIO(BaseNodeIO):
             key=self.fifo,
             args=(self, copy),
             name=f"Check file {copy.file.path} on {self.node.name}",
+            io_bytes=copy.file.size_b or 0,
         )
 
+    def check_many(self, copies: list[ArchiveFileCopy]) -> None:
+        """Check whether the ArchiveFileCopy list `copies` are corrupt.
+
+        Copies are grouped into batches of at most `check_batch_size`
+        copies, and a single `check_many_async` task is queued per batch.
+
+        Parameters
+        ----------
+        copies : list of ArchiveFileCopy
+            the file copies to check.  May be empty.
+        """
+        for start in range(0, len(copies), self._check_batch_size):
+            batch = copies[start : start + self._check_batch_size]
+
+            # A batch of one is just a regular check
+            if len(batch) == 1:
+                self.check(batch[0])
+                continue
+
+            Task(
+                func=check_many_async,
+                queue=self._queue,
+                key=self.fifo,
+                args=(self, batch),
+                name=f"Check {len(batch)} files on {self.node.name}",
+                io_bytes=sum(copy.file.size_b or 0 for copy in batch),
+            )
+
     def check_init(self) -> bool:
         """Check that this node is initialised.
 
@@ -213,7 +525,7 @@ class DefaultNodeIO(BaseNodeIO):
             func=delete_async,
             queue=self._queue,
             key=self.fifo,
-            args=(self.tree_lock, copies),
+            args=(self.tree_lock, copies, self),
             name="Delete copies "
             + str([copy.id for copy in copies])
             + f" from {self.node.name}",
@@ -272,30 +584,41 @@ class DefaultNodeIO(BaseNodeIO):
         # Per POSIX, blocksize for st_blocks is always 512 bytes
         return path.stat().st_blocks * 512
 
-    def file_walk(self, path) -> Iterable[pathlib.PurePath]:
+    def file_walk(
+        self,
+        path: pathlib.PurePath,
+        max_depth: int | None = None,
+        prefix: str | None = None,
+    ) -> Iterable[pathlib.PurePath]:
         """An iterator over all regular files under `node.root/path`
 
-        pathlib.PurePaths returned by the iterator are absolute
+        pathlib.PurePaths returned by the iterator are absolute.
+
+        Directories are listed by up to `walk_threads` threads at once.
+        Files are returned in no particular order.  The type information
+        from the directory listing is used to pick out the regular files,
+        so no files are stat'd during the walk.
+
+        Parameters
+        ----------
+        path : pathlib.PurePath
+            The path to walk, relative to `node.root`.
+        max_depth : int, optional
+            If given, the number of levels of subdirectories of `path` to
+            descend into.  If zero, only files directly in `path` are
+            returned.
+        prefix : str, optional
+            If given, only files whose path relative to `node.root` starts
+            with this string are returned.  Directories which can't contain
+            such files aren't listed.
         """
 
         # path must not be absolute
         if path.is_absolute():
             raise ValueError("path may not be absolute")
 
-        def _walk(path):
-            """Recurse through directory path, yielding files"""
-
-            # We use os.scandir instead of os.walk because it gives
-            # us DirEntry objects which have useful metadata in them
-            for entry in os.scandir(path):
-                if entry.is_dir():
-                    # Recurse
-                    yield from _walk(entry)
-                # is_file() on a symlink to a file returns true, so we need both
-                elif entry.is_file() and not entry.is_symlink():
-                    yield pathlib.PurePath(entry)
-
-        fullpath = pathlib.Path(self.node.root).joinpath(path)
+        root = self.node.root
+        fullpath = pathlib.Path(root).joinpath(path)
 
         if not fullpath.exists():
             # If path doesn't exist, just return an empty tuple
@@ -303,11 +626,13 @@ class DefaultNodeIO(BaseNodeIO):
 
         if fullpath.is_file() and not fullpath.is_symlink():
             # If path is just a file, just return that
+            if prefix is not None and not str(path).startswith(prefix):
+                return ()
             return (fullpath,)
 
         # Return an iterator over the directory contents if a directory
         if fullpath.is_dir():
-            return _walk(fullpath)
+            return _walk(fullpath, root, self.walk_threads, max_depth, prefix)
 
         # Return nothing, if something weird
         return ()
@@ -376,7 +701,9 @@ class DefaultNodeIO(BaseNodeIO):
 
         return path.with_name("." + path.name + ".lock").exists()
 
-    def md5(self, path: str | pathlib.Path, *segments) -> str | None:
+    def md5(
+        self, path: str | pathlib.Path, *segments, drop_cache: bool = False
+    ) -> str | None:
         """Compute the MD5 hash of the file at the specified path.
 
         This can take a long time: call it from an async.
@@ -388,6 +715,8 @@ class DefaultNodeIO(BaseNodeIO):
             the file to hash.  Relative to `node.root`.
         *segments : iterable, optional
             other path segments path-concatenated and appended to `path`.
+        drop_cache : bool, optional
+            If True, drop the file from the page cache after reading it.
 
         Returns
         -------
@@ -396,7 +725,9 @@ class DefaultNodeIO(BaseNodeIO):
         """
         path = pathlib.Path(self.node.root, path, *segments)
         try:
-            return md5sum_file(path)
+            return md5sum_file(
+                path, block_size=self.read_block_size, drop_cache=drop_cache
+            )
         except FileNotFoundError:
             log.warning(f"MD5 sum check for {path} failed: file not found.")
         except PermissionError:
@@ -456,12 +787,77 @@ class DefaultNodeIO(BaseNodeIO):
             )
             return
 
+        # Small files may be batched together.  Requests for which a search
+        # has been done are never batched: these are pulled from worker
+        # threads (see group_search_async).
+        if (
+            not did_search
+            and self.pull_batch_size > 1
+            and (req.file.size_b or 0) <= self.pull_batch_file_size
+        ):
+            self._batch_pull(req)
+            return
+
         Task(
             func=pull_async,
             queue=self._queue,
             key=self.fifo,
             args=(self, self.tree_lock, req, did_search),
             name=f"AFCR#{req.id}: {req.node_from.name} -> {self.node.name}",
+            priority=PRIORITY_PULL,
+            io_bytes=req.file.size_b or 0,
+        )
+
+    def _batch_pull(self, req: ArchiveFileCopyRequest) -> None:
+        """Add `req` to the pending batch for its source node.
+
+        The batch is dispatched if it's full.  Otherwise, it will be
+        dispatched by `after_update`.
+        """
+        name = req.node_from.name
+        batch = self._pull_batches.setdefault(name, [])
+
+        # If this file would take the batch over the byte limit, dispatch the
+        # batch first.
+        size = req.file.size_b or 0
+        if batch and sum(r.file.size_b or 0 for r in batch) + size > (
+            self.pull_batch_bytes
+        ):
+            self._flush_pull_batch(name)
+            batch = self._pull_batches.setdefault(name, [])
+
+        batch.append(req)
+        if len(batch) >= self.pull_batch_size:
+            self._flush_pull_batch(name)
+
+    def _flush_pull_batch(self, name: str) -> None:
+        """Dispatch the pending batch of pulls from node `name`."""
+        reqs = self._pull_batches.pop(name, [])
+        if not reqs:
+            return
+
+        # No point batching a single request
+        if len(reqs) == 1:
+            req = reqs[0]
+            Task(
+                func=pull_async,
+                queue=self._queue,
+                key=self.fifo,
+                args=(self, self.tree_lock, req, False),
+                name=f"AFCR#{req.id}: {req.node_from.name} -> {self.node.name}",
+                priority=PRIORITY_PULL,
+                io_bytes=req.file.size_b or 0,
+            )
+            return
+
+        Task(
+            func=pull_batch_async,
+            queue=self._queue,
+            key=self.fifo,
+            args=(self, self.tree_lock, reqs),
+            name=(f"AFCR#{reqs[0].id}+{len(reqs) - 1}: {name} -> {self.node.name}"),
+            priority=PRIORITY_PULL,
+            io_bytes=sum(req.file.size_b or 0 for req in reqs),
         )
 
     # This is the reservation fudge factor.  XXX Is it correct?
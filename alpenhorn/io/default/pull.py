@@ -2,27 +2,92 @@
 
 These are the low-level functions used by Default I/O
 to copy files around.
+
+Transfer engines
+----------------
+`pull_async` performs the actual transfer using one of a number of
+transfer engines registered here via `register_engine()`.  A transfer
+engine is a callable with the signature
+
+    engine(req, io, from_path, to_path) -> dict | None
+
+where `req` is the ArchiveFileCopyRequest being handled, `io` is the
+destination node's I/O instance, `from_path` is the source (a path, for
+local transfers, or a remote address otherwise), and `to_path` is the
+destination path.  The engine should return an "ioresult" dict (see
+`pull_async`), or None if it declined to handle the transfer, in which
+case the next engine is tried.
+
+The engines tried, and the order in which they're tried, can be set
+in the destination node's io_config (see DefaultNodeIO).  The built-in
+engines are:
+
+* "link": hardlink the file (local transfers only)
+* "bbcp": copy with bbcp (remote transfers only)
+* "rsync": copy with rsync
+* "internal": copy with `local_copy` (local transfers only)
+* "parallel": copy with `parallel_copy` (local transfers only)
+
+Batch transfers
+---------------
+Small files may be pulled several at a time by `pull_batch_async`.  An
+engine may also provide a batch transfer engine, with the signature
+
+    batch_engine(reqs, io, from_paths, to_paths) -> list[dict] | None
+
+which transfers all the requests in the list `reqs` at once, returning a
+list with an ioresult dict for each of them (or None, if it declined to
+handle the batch).  Engines without a batch engine are called once per
+request.  Of the built-in engines, only "rsync" has a batch engine, which
+uses `rsync_many`.
 """
 
 from __future__ import annotations
 
+import datetime
+import json
 import logging
 import os
 import pathlib
 import re
 import shutil
+import threading
 import time
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import md5
 from tempfile import TemporaryDirectory
 
+import peewee as pw
+
 from ...common import config
-from ...daemon import RemoteNode, proc
+from ...daemon import proc, remote_node
 from ...daemon.metrics import Metric
 from ...daemon.scheduler import Task, threadlocal
-from ...db import ArchiveFileCopyRequest
+from ...db import (
+    ArchiveAcq,
+    ArchiveFile,
+    ArchiveFileCopyRequest,
+    StorageNode,
+    utcnow,
+)
 from ..base import BaseNodeIO
-from .updownlock import UpDownLock
-
-__all__ = ["bbcp", "hardlink", "local_copy", "rsync"]
+from .updownlock import TreeLock
+
+__all__ = [
+    "bbcp",
+    "clean_partials",
+    "engine_names",
+    "find_partials",
+    "hardlink",
+    "local_copy",
+    "parallel_copy",
+    "partial_dir",
+    "register_engine",
+    "rsync",
+    "rsync_many",
+]
 
 log = logging.getLogger(__name__)
 
@@ -198,7 +263,12 @@ def bbcp(source: str | os.PathLike, target: str | os.PathLike, size_b: int) -> d
 
 
 def rsync(
-    source: str | os.PathLike, target: str | os.PathLike, size_b: int, local: bool
+    source: str | os.PathLike,
+    target: str | os.PathLike,
+    size_b: int,
+    local: bool,
+    partial: pathlib.Path | None = None,
+    files_from: pathlib.Path | None = None,
 ) -> dict:
     """Rsync a file (either local or remote).
 
@@ -216,6 +286,13 @@ def rsync(
     local : bool
         False if this is a network transfer.  In that
         case, compression is turned on in rsync.
+    partial : pathlib.Path, optional
+        If given, rsync keeps partially transferred files in this
+        directory when interrupted, and resumes from them when
+        re-run with the same `partial`.
+    files_from : pathlib.Path, optional
+        If given, a file listing paths relative to `source` to transfer
+        to the same paths relative to `target`.  See `rsync_many`.
 
     Returns
     -------
@@ -253,6 +330,8 @@ def rsync(
             "--owner",
             "--copy-links",
             "--sparse",
+            *([] if partial is None else [f"--partial-dir={partial}"]),
+            *([] if files_from is None else [f"--files-from={files_from}"]),
             str(source),
             str(target),
         ],
@@ -284,6 +363,56 @@ def rsync(
     return ioresult
 
 
+def rsync_many(
+    source_root: str,
+    target_root: str | os.PathLike,
+    paths: list[str],
+    size_b: int,
+    local: bool,
+) -> dict:
+    """Rsync several files in one invocation.
+
+    The files are transferred using rsync's --files-from option.
+
+    Command times out after `_pull_timeout(size_b)` seconds have elapsed.
+
+    Parameters
+    ----------
+    source_root : str
+        Source directory (or remote address of a directory).  The
+        files to transfer are relative to this.
+    target_root : path-like
+        Target directory.  The files are copied into this directory
+        at the same relative paths.
+    paths : list of str
+        The relative paths of the files to transfer.
+    size_b : int
+        Total size of the files to transfer.  Only used to
+        set the timeout.
+    local : bool
+        False if this is a network transfer.  In that
+        case, compression is turned on in rsync.
+
+    Returns
+    -------
+    ioresult : dict
+        Result of the transfer, as returned by `rsync`.  Note: a
+        failure may only affect some of the files.
+    """
+
+    with TemporaryDirectory(prefix="alpenhorn-rsync") as tmpdir:
+        files_from = pathlib.Path(tmpdir, "files")
+        files_from.write_text("".join(f"{path}\n" for path in paths))
+
+        return rsync(
+            source_root.rstrip("/") + "/",
+            str(target_root).rstrip("/") + "/",
+            size_b,
+            local,
+            files_from=files_from,
+        )
+
+
 def hardlink(from_path: str | os.PathLike, to_path: str | os.PathLike) -> dict | None:
     """Hard link `from_path` as `to_path`.
 
@@ -335,14 +464,82 @@ def hardlink(from_path: str | os.PathLike, to_path: str | os.PathLike) -> dict |
     return {"ret": 0, "md5sum": True}
 
 
+def _copy_md5(from_path: pathlib.Path, to_path: pathlib.Path, block_size: int) -> str:
+    """Copy `from_path` to `to_path`, computing the MD5 hash while copying.
+
+    The file is read once, in blocks of `block_size` bytes, alternately into
+    one of two buffers: while one buffer is being written to `to_path`, the
+    MD5 of the same buffer is computed in a helper thread (hashlib releases
+    the GIL while hashing), and the next block is read into the other
+    buffer.  File metadata is copied as per `shutil.copy2`.
+
+    Parameters
+    ----------
+    from_path : pathlib.Path
+        Source file
+    to_path : pathlib.Path
+        Destination file.  Overwritten if it exists.
+    block_size : int
+        Read size, in bytes
+
+    Returns
+    -------
+    str
+        The MD5 hash of the data copied.
+
+    Raises
+    ------
+    OSError
+        The copy failed.
+    """
+    hash_ = md5()
+    buffers = [memoryview(bytearray(block_size)), memoryview(bytearray(block_size))]
+
+    with (
+        open(from_path, "rb", buffering=0) as fsrc,
+        open(to_path, "wb", buffering=0) as fdst,
+        ThreadPoolExecutor(max_workers=1) as hasher,
+    ):
+        hashing = None
+        index = 0
+        while True:
+            view = buffers[index]
+            size = fsrc.readinto(view)
+
+            # Wait for the hash of the previous block before hashing this
+            # one: hashes must be computed in order.
+            if hashing is not None:
+                hashing.result()
+                hashing = None
+
+            if not size:
+                break
+
+            hashing = hasher.submit(hash_.update, view[:size])
+
+            # Handle short writes
+            written = 0
+            while written < size:
+                written += fdst.write(view[written:size])
+
+            index = 1 - index
+
+    shutil.copystat(from_path, to_path)
+
+    return hash_.hexdigest()
+
+
 def local_copy(
-    from_path: str | os.PathLike, to_path: str | os.PathLike, size_b: int
+    from_path: str | os.PathLike,
+    to_path: str | os.PathLike,
+    size_b: int,
+    block_size: int | None = None,
 ) -> dict:
     """Copy `from_path` to `to_path` using `shutil`
 
     Atomically overwrites an existing `to_path`.  Copy attempt times out after
-    `_pull_timeout(size_b)` seconds have elapsed.  After a successful copy,
-    `proc.md5sum_file` will be called to verify the transfer was successful.
+    `_pull_timeout(size_b)` seconds have elapsed.  The MD5 hash of the file
+    is computed while it is copied, so the source is only read once.
 
     Parameters
     ----------
@@ -352,6 +549,9 @@ def local_copy(
         Destination location
     size_b : int
         Size in bytes of file
+    block_size : int, optional
+        Read size used when copying.  If not given, "daemon.hash_block_size"
+        is used.
 
     Returns
     -------
@@ -360,8 +560,7 @@ def local_copy(
         "ret": int
             0 if copy succeeded; 1 if it failed
         "md5sum": str
-            Only present if ret == 0: md5sum of the file computed via
-            `proc.md5sum_file`
+            Only present if ret == 0: md5sum of the data copied
         "stderr": str
             Only present if ret == 1: a message indicating what went wrong.
         "check_src": bool
@@ -372,28 +571,32 @@ def local_copy(
     from_path = pathlib.Path(from_path)
     to_path = pathlib.Path(to_path)
 
+    if block_size is None:
+        block_size = proc.hash_block_size()
+
     # We create the copy in a temporary place so that the destination filename
     # never points to a partially transferred file.
     try:
         # Create a temporary directory as a subdirectory of the destination dir
         with TemporaryDirectory(dir=to_path.parent, prefix=".alpentemp") as tmpdir:
+            tmp_path = pathlib.Path(tmpdir, from_path.name)
+
             # Timeout for the pull
             timeout = _pull_timeout(size_b)
 
-            # If no timeout, just directly call shutil
+            # If no timeout, just directly copy
+            log.info(f'copying and hashing "{from_path}" to "{to_path}"')
             if timeout is None:
-                tmp_path = shutil.copy2(from_path, tmpdir)
+                md5 = _copy_md5(from_path, tmp_path, block_size)
             else:
                 # Otherwise copy the source into the dest, with timeout.
                 # Raises OSError or TimeoutError on failure
-                tmp_path = proc.timeout_call(shutil.copy2, timeout, from_path, tmpdir)
+                md5 = proc.timeout_call(
+                    _copy_md5, timeout, from_path, tmp_path, block_size
+                )
 
             # Copy succeeded!  Overwrite any existing file atomically
-            pathlib.Path(tmp_path).rename(to_path)
-
-        # Now MD5 the file to verify it.
-        log.info(f'verifying "{to_path}" after local copy')
-        md5 = proc.md5sum_file(to_path)
+            tmp_path.rename(to_path)
     except (OSError, TimeoutError) as e:
         # Copy failed for some reason
         log.warning(f"local copy failed: {e}")
@@ -403,65 +606,680 @@ def local_copy(
     return {"ret": 0, "md5sum": md5}
 
 
-def pull_async(
-    task: Task,
-    io: BaseNodeIO,
-    tree_lock: UpDownLock,
-    req: ArchiveFileCopyRequest,
-    did_search: bool,
-    path: pathlib.path | None = None,
+# Name prefix for resumable partial transfer directories.  Used
+# with the AFCR id.  Starts with ".alpentemp" so the partial is
+# recognised as a temporary file by the rest of alpenhorn.
+_PARTIAL_PREFIX = ".alpentemp_afcr"
+
+# Number of chunks between checkpoint writes in `parallel_copy`
+_CHECKPOINT_INTERVAL = 16
+
+
+def partial_dir(to_path: pathlib.Path, req: ArchiveFileCopyRequest) -> pathlib.Path:
+    """Return the partial-transfer directory for pulling `req` to `to_path`.
+
+    The path is deterministic, so that a subsequent attempt at the same
+    request can resume the transfer.
+    """
+    return to_path.with_name(f"{_PARTIAL_PREFIX}{req.id}")
+
+
+def _load_checkpoint(
+    path: pathlib.Path, size: int, mtime_ns: int, chunk_size: int
+) -> list[str]:
+    """Load the checkpoint of a parallel copy from `path`.
+
+    Returns the list of MD5 hashes of chunks previously completed, which is
+    empty if there's no checkpoint, or if the checkpoint is for a different
+    source file or chunk size.
+    """
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return []
+
+    if checkpoint.get("source") != [size, mtime_ns, chunk_size]:
+        return []
+
+    return checkpoint.get("chunks", [])
+
+
+def _save_checkpoint(
+    path: pathlib.Path, size: int, mtime_ns: int, chunk_size: int, chunks: list[str]
 ) -> None:
-    """Fulfill `req` by pulling a file onto the local node.
+    """Atomically write a parallel copy checkpoint to `path`."""
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"source": [size, mtime_ns, chunk_size], "chunks": chunks}, f)
+    tmp_path.rename(path)
+
+
+def parallel_copy(
+    from_path: str | os.PathLike,
+    to_path: str | os.PathLike,
+    size_b: int,
+    streams: int = 4,
+    chunk_size: int = 64 * 1024 * 1024,
+    progress: Metric | None = None,
+    partial: pathlib.Path | None = None,
+    md5sum: str | None = None,
+) -> dict:
+    """Copy `from_path` to `to_path` using several concurrent streams.
+
+    The file is split into chunks of `chunk_size` bytes, which are copied by
+    `streams` threads at once.  The MD5 hash of the whole file is computed
+    while copying, by hashing chunks in order as they complete, so at most
+    `streams` chunks are held in memory at once.  The MD5 hash of each chunk
+    is also computed.
+
+    Like `local_copy`, the destination is written in a temporary directory
+    and then atomically moved into place, and the copy attempt times out
+    after `_pull_timeout(size_b)` seconds have elapsed.  On timeout, the
+    copy streams are stopped and nothing is moved into place.  If `md5sum`
+    is given, the copy is only moved into place if its MD5 hash matches.
+
+    If `partial` is given, it is used as the temporary directory, and is
+    left in place if the copy fails.  The MD5 hashes of the chunks copied
+    are periodically checkpointed in it.  Copying into a `partial` directory
+    left behind by a previous attempt resumes the copy after the last
+    checkpointed chunk, so long as the source file hasn't been modified.
+    (The previously copied chunks are re-read from the partial file to
+    verify them and to compute the whole-file MD5 hash.)
 
-    Things to try:
-        - hard link (for nodes on the same filesystem)
-        - bbcp (remote transfers only)
-        - rsync
-        - shutil.copy (local transfers only)
+    Parameters
+    ----------
+    from_path : path-like
+        Source location
+    to_path : path-like
+        Destination location
+    size_b : int
+        Size in bytes of file.  Only used to set the timeout.
+    streams : int, optional
+        Number of concurrent copy streams
+    chunk_size : int, optional
+        Size of the chunks copied by each stream
+    progress : Metric, optional
+        If given, this metric is incremented by the size of each chunk
+        copied.
+    partial : pathlib.Path, optional
+        The directory used to hold a resumable partial copy.  Removed on
+        success.
+    md5sum : str, optional
+        The expected MD5 hash of the file.
+
+    Returns
+    -------
+    dict
+        Result of the transfer, with keys:
+        "ret": int
+            0 if copy succeeded; 1 if it failed
+        "md5sum": str
+            Only present if ret == 0: md5sum of the data copied
+        "chunk_md5": list of str
+            Only present if ret == 0: md5sums of each chunk copied
+        "resumed": int
+            Only present if ret == 0: the number of bytes which didn't
+            need copying because they were copied by a previous attempt.
+        "stderr": str
+            Only present if ret == 1: a message indicating what went wrong.
+    """
+
+    from_path = pathlib.Path(from_path)
+    to_path = pathlib.Path(to_path)
+
+    def _copy_chunk(src_fd: int, dst_fd: int, offset: int) -> bytes:
+        """Copy one chunk.  Runs in a stream thread."""
+        data = os.pread(src_fd, chunk_size, offset)
+        written = 0
+        while written < len(data):
+            written += os.pwrite(dst_fd, data[written:], offset + written)
+        if progress:
+            progress.add(len(data))
+        return data
+
+    # Set to stop the copy streams after a timeout
+    stop = threading.Event()
+
+    def _copy(workdir: pathlib.Path, resume: bool) -> tuple[str, list[str], int]:
+        """Perform the copy.  Runs in a thread which may be abandoned."""
+        hash_ = md5()
+        tmp_path = workdir.joinpath(from_path.name)
+        checkpoint = workdir.joinpath("checkpoint.json")
+
+        src_fd = os.open(from_path, os.O_RDONLY)
+        try:
+            stat = os.fstat(src_fd)
+            source = (stat.st_size, stat.st_mtime_ns, chunk_size)
+
+            # Look for chunks copied previously
+            chunk_md5 = []
+            if resume and tmp_path.exists():
+                chunk_md5 = _load_checkpoint(checkpoint, *source)
+
+            dst_fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                os.ftruncate(dst_fd, stat.st_size)
+
+                # Verify previously copied chunks
+                for index, expected in enumerate(chunk_md5):
+                    data = os.pread(dst_fd, chunk_size, index * chunk_size)
+                    if md5(data).hexdigest() != expected:
+                        log.info(f"Discarding bad checkpoint data for {to_path}")
+                        del chunk_md5[index:]
+                        break
+                    hash_.update(data)
+                resumed = copied = min(len(chunk_md5) * chunk_size, stat.st_size)
+                if resumed:
+                    log.info(f"Resuming copy of {from_path} at byte {resumed}")
+
+                with ThreadPoolExecutor(max_workers=streams) as executor:
+                    # The futures of chunks in progress.  We only keep
+                    # `streams` chunks in flight at once.
+                    pending = deque()
+                    offsets = iter(range(copied, stat.st_size, chunk_size))
+                    try:
+                        while True:
+                            if stop.is_set():
+                                raise TimeoutError("copy abandoned")
+
+                            for offset in offsets:
+                                pending.append(
+                                    executor.submit(_copy_chunk, src_fd, dst_fd, offset)
+                                )
+                                if len(pending) >= streams:
+                                    break
+
+                            if not pending:
+                                break
+
+                            # Hash the earliest chunk
+                            data = pending.popleft().result()
+                            copied += len(data)
+                            hash_.update(data)
+                            chunk_md5.append(md5(data).hexdigest())
+
+                            if resume and len(chunk_md5) % _CHECKPOINT_INTERVAL == 0:
+                                _save_checkpoint(checkpoint, *source, chunk_md5)
+                    except BaseException:
+                        # Save what we managed to do
+                        if resume:
+                            for future in pending:
+                                future.cancel()
+                            _save_checkpoint(checkpoint, *source, chunk_md5)
+                        raise
+            finally:
+                os.close(dst_fd)
+        finally:
+            os.close(src_fd)
+
+        # Check that the file didn't shrink while we were copying it
+        if copied != stat.st_size:
+            raise OSError(f"Short read from {from_path}")
+
+        return hash_.hexdigest(), chunk_md5, resumed
+
+    def _finish(workdir: pathlib.Path, resume: bool) -> tuple[str, list[str], int]:
+        """Perform the copy and move the result into place."""
+        timeout = _pull_timeout(size_b)
+        if timeout is None:
+            result = _copy(workdir, resume)
+        else:
+            # If the copy times out, the thread running _copy carries on,
+            # so tell it to stop.
+            timer = threading.Timer(timeout, stop.set)
+            timer.start()
+            try:
+                result = proc.timeout_call(_copy, timeout, workdir, resume)
+            finally:
+                timer.cancel()
+
+        # Only move a good copy into place
+        if md5sum is None or result[0] == md5sum:
+            tmp_path = workdir.joinpath(from_path.name)
+            shutil.copystat(from_path, tmp_path)
+            tmp_path.rename(to_path)
+
+        return result
+
+    try:
+        if partial is None:
+            with TemporaryDirectory(dir=to_path.parent, prefix=".alpentemp") as tmpdir:
+                result = _finish(pathlib.Path(tmpdir), False)
+        else:
+            partial.mkdir(exist_ok=True)
+            result = _finish(partial, True)
+            shutil.rmtree(partial, ignore_errors=True)
+    except (OSError, TimeoutError) as e:
+        stop.set()
+        log.warning(f"parallel copy failed: {e}")
+        return {"ret": 1, "stderr": str(e)}
+
+    copy_md5, chunk_md5, resumed = result
+    return {"ret": 0, "md5sum": copy_md5, "chunk_md5": chunk_md5, "resumed": resumed}
+
+
+def find_partials(node: StorageNode, max_age: float) -> set[int]:
+    """Find the copy requests which may have partial transfers on `node`.
+
+    Used to seed the partial transfer index of a node when the daemon
+    starts.  These are the requests for the node's group which are still
+    pending, or which were made in the last `max_age` seconds.
 
     Parameters
     ----------
-    task : Task
-        The task instance containing this async.
-    io : Node I/O instance
-        The I/O instance for the pull destination node.
-    tree_lock : UpDownLock
-        The directory tree modificiation lock.
-    req : ArchiveFileCopyRequest
-        The request we're fulfilling.
-    did_search : bool
-        True if a search for an existing unregistered copy was
-        already performed.
-    path : pathlib.Path, optional
-        If not None, this is the absolute destination path.  This parameter is
-        not used by Default I/O but is provided as a convenience to other I/O
-        Classes which wish to re-use this I/O async.  If not given, the file is
-        created as `req.file.path` under the node root.
+    node : StorageNode
+        The node to find partial transfers for
+    max_age : float
+        Maximum age, in seconds, of a partial transfer
+
+    Returns
+    -------
+    set of int
+        The ids of the copy requests.
     """
+    since = utcnow() - datetime.timedelta(seconds=max_age)
+    return {
+        afcr_id
+        for (afcr_id,) in ArchiveFileCopyRequest.select(ArchiveFileCopyRequest.id)
+        .where(
+            ArchiveFileCopyRequest.group_to == node.group,
+            (
+                (ArchiveFileCopyRequest.completed == 0)
+                & (ArchiveFileCopyRequest.cancelled == 0)
+            )
+            | (ArchiveFileCopyRequest.timestamp >= since),
+        )
+        .tuples()
+    }
 
-    # Before we were queued, NodeIO reserved space for this file.
-    # Automatically release bytes on task completion
-    task.on_cleanup(io.release_bytes, args=(req.file.size_b,))
 
-    pullrun_metric = Metric(
-        "pull_running_count",
-        "Count of in-progress pulls",
-        unbound={"method", "remote"},
-        bound={"node": io.node.name},
+def clean_partials(
+    node: StorageNode,
+    partials: set[int],
+    max_age: float,
+    max_bytes: int | None = None,
+) -> int:
+    """Remove stale partial transfers from `node`.
+
+    Rather than searching the whole node, only the partial transfers
+    of the copy requests listed in `partials` are considered.  Each of
+    these lives at the fixed `partial_dir` of its request.  A partial
+    transfer is removed if:
+
+    * it hasn't been modified in the last `max_age` seconds, or
+    * its copy request is no longer pending, or
+    * the total size of the newer partial transfers already
+      exceeds `max_bytes`.
+
+    The ids of requests with no partial transfer left on the node are
+    discarded from `partials`.
+
+    This should only be run when no pulls onto the node are in progress.
+
+    Parameters
+    ----------
+    node : StorageNode
+        The node to clean
+    partials : set of int
+        The ids of the copy requests which may have partial transfers on
+        the node.  Updated in place.
+    max_age : float
+        Maximum age, in seconds, of a partial transfer
+    max_bytes : int, optional
+        If not None, the maximum total size of partial transfers to keep.
+
+    Returns
+    -------
+    int
+        The number of directories removed.
+    """
+    now = time.time()
+
+    # Find partials: a list of (mtime, size, path, pending) tuples
+    found = []
+    for batch in pw.chunked(sorted(partials), 500):
+        query = (
+            ArchiveFileCopyRequest.select(
+                ArchiveFileCopyRequest, ArchiveFile, ArchiveAcq
+            )
+            .join(ArchiveFile)
+            .join(ArchiveAcq)
+            .where(ArchiveFileCopyRequest.id << batch)
+        )
+        missing = set(batch)
+        for req in query:
+            missing.discard(req.id)
+            path = partial_dir(pathlib.Path(node.root, req.file.path), req)
+            try:
+                mtime = path.stat().st_mtime
+                size = 0
+                for entry in path.iterdir():
+                    stat = entry.lstat()
+                    mtime = max(mtime, stat.st_mtime)
+                    size += stat.st_blocks * 512
+            except OSError:
+                # No partial transfer
+                partials.discard(req.id)
+                continue
+
+            found.append(
+                (mtime, size, path, req.id, not req.completed and not req.cancelled)
+            )
+
+        # Requests which have been deleted
+        partials.difference_update(missing)
+
+    # Newest first
+    found.sort(reverse=True)
+
+    removed = 0
+    total = 0
+    for mtime, size, path, afcr_id, pending in found:
+        if now - mtime > max_age:
+            reason = "stale"
+        elif not pending:
+            reason = "request no longer pending"
+        elif max_bytes is not None and total + size > max_bytes:
+            reason = "too much partial data"
+        else:
+            total += size
+            continue
+
+        log.info(f"Removing partial transfer {path} ({reason})")
+        shutil.rmtree(path, ignore_errors=True)
+        partials.discard(afcr_id)
+        removed += 1
+
+    return removed
+
+
+# The transfer engine registry.  Keys are engine names.  Values are
+# 3-tuples: (engine, local, remote) where `local` and `remote` indicate
+# which kinds of transfers the engine can handle.
+_engines = {}
+
+# Batch transfer engines, used by `pull_batch_async`.  Keys are engine
+# names, which must also be in `_engines`.
+_batch_engines = {}
+
+
+def register_engine(
+    name: str,
+    engine: Callable,
+    local: bool = True,
+    remote: bool = True,
+    batch: Callable | None = None,
+) -> None:
+    """Register a transfer engine.
+
+    See the module docstring for a description of transfer engines.
+    Re-registering an existing name replaces the old engine.
+
+    Parameters
+    ----------
+    name : str
+        The name of the engine, used in io_config and metrics
+    engine : callable
+        The transfer engine
+    local : bool, optional
+        Whether the engine can handle local (same-host) transfers
+    remote : bool, optional
+        Whether the engine can handle remote transfers
+    batch : callable, optional
+        If given, a batch transfer engine which is used instead of `engine`
+        when pulling several files at once.  See the module docstring.
+    """
+    _engines[name] = (engine, local, remote)
+    if batch is None:
+        _batch_engines.pop(name, None)
+    else:
+        _batch_engines[name] = batch
+
+
+def engine_names() -> list[str]:
+    """The names of all registered transfer engines."""
+    return list(_engines)
+
+
+def _link_engine(
+    req: ArchiveFileCopyRequest,
+    io: BaseNodeIO,
+    from_path: str | os.PathLike,
+    to_path: pathlib.Path,
+) -> dict | None:
+    """Transfer engine wrapping `hardlink`."""
+
+    # Don't create a hardlink between an archive node and a non-archive node
+    if req.node_from.archive != io.node.archive:
+        return None
+
+    ioresult = hardlink(from_path, to_path)
+    if ioresult is not None:
+        log.info(f"Hardlinked local file {req.file.path}")
+    return ioresult
+
+
+def _bbcp_engine(
+    req: ArchiveFileCopyRequest,
+    io: BaseNodeIO,
+    from_path: str | os.PathLike,
+    to_path: pathlib.Path,
+) -> dict | None:
+    """Transfer engine wrapping `bbcp`."""
+    if shutil.which("bbcp") is None:
+        return None
+
+    # bbcp can calculate the md5 hash as it goes, so we'll do that to save
+    # doing it at the end.
+    log.info(f"Pulling remote file {req.file.path} using bbcp")
+    return bbcp(from_path, to_path, req.file.size_b)
+
+
+def _rsync_engine(
+    req: ArchiveFileCopyRequest,
+    io: BaseNodeIO,
+    from_path: str | os.PathLike,
+    to_path: pathlib.Path,
+) -> dict | None:
+    """Transfer engine wrapping `rsync`."""
+    if shutil.which("rsync") is None:
+        return None
+
+    local = req.node_from.local
+    log.info(
+        f"Pulling {'local' if local else 'remote'} file {req.file.path} using rsync"
     )
 
-    # Rerun the database checks, because we don't know how long we've been in the queue
-    if not req.check(node_to=io.node):
-        return
+    # Remember the partial transfer, so the idle tidy can find it
+    io.partials.add(req.id)
+
+    return rsync(
+        from_path, to_path, req.file.size_b, local, partial=partial_dir(to_path, req)
+    )
+
+
+def _rsync_batch_engine(
+    reqs: list[ArchiveFileCopyRequest],
+    io: BaseNodeIO,
+    from_paths: list[str],
+    to_paths: list[pathlib.Path],
+) -> list[dict] | None:
+    """Batch transfer engine wrapping `rsync_many`."""
+    if shutil.which("rsync") is None:
+        return None
 
-    # We know dest is local, so if source is too, this is a local transfer
+    # We need a common source and target root, so the source and
+    # destination paths must be the same relative to their roots
+    source_root = None
+    for req, from_path, to_path in zip(reqs, from_paths, to_paths, strict=True):
+        rel_path = str(req.file.path)
+        if not from_path.endswith("/" + rel_path):
+            return None
+        if to_path != pathlib.Path(io.node.root, rel_path):
+            return None
+        root = from_path[: -len(rel_path)]
+        if source_root is None:
+            source_root = root
+        elif root != source_root:
+            return None
+
+    # Note which destination files already exist, so we can tell
+    # which files this transfer wrote, if it fails.
+    before = {}
+    for to_path in to_paths:
+        try:
+            stat = to_path.stat()
+            before[to_path] = (stat.st_ino, stat.st_mtime_ns)
+        except OSError:
+            pass
+
+    local = reqs[0].node_from.local
+    log.info(
+        f"Pulling {len(reqs)} {'local' if local else 'remote'} files "
+        f"from {reqs[0].node_from.name} using rsync"
+    )
+    ioresult = rsync_many(
+        source_root,
+        io.node.root,
+        [str(req.file.path) for req in reqs],
+        sum(req.file.size_b or 0 for req in reqs),
+        local,
+    )
+
+    if ioresult["ret"] == 0:
+        return [ioresult] * len(reqs)
+
+    # A failure of the whole batch doesn't implicate any particular
+    # source file
+    failed = dict(ioresult, check_src=False)
+
+    # On failure, files may still have been transferred.  Since rsync
+    # writes files atomically (by renaming a temporary file into place),
+    # any written by this transfer were copied in full, but we hash them
+    # to be sure.  Files which were already present are not trusted.
+    results = []
+    for to_path in to_paths:
+        try:
+            stat = to_path.stat()
+        except OSError:
+            results.append(failed)
+            continue
+
+        if before.get(to_path) == (stat.st_ino, stat.st_mtime_ns):
+            results.append(failed)
+            continue
+
+        md5sum = io.md5(to_path)
+        if md5sum is None:
+            results.append(failed)
+        else:
+            results.append({"ret": 0, "md5sum": md5sum})
+    return results
+
+
+def _internal_engine(
+    req: ArchiveFileCopyRequest,
+    io: BaseNodeIO,
+    from_path: str | os.PathLike,
+    to_path: pathlib.Path,
+) -> dict | None:
+    """Transfer engine wrapping `local_copy`."""
+    log.info(f"Pulling local file {req.file.path} using shutil")
+    return local_copy(from_path, to_path, req.file.size_b, io.read_block_size)
+
+
+def _parallel_engine(
+    req: ArchiveFileCopyRequest,
+    io: BaseNodeIO,
+    from_path: str | os.PathLike,
+    to_path: pathlib.Path,
+) -> dict | None:
+    """Transfer engine wrapping `parallel_copy`."""
+    log.info(f"Pulling local file {req.file.path} using parallel copy")
+
+    # Remember the partial transfer, so the idle tidy can find it
+    io.partials.add(req.id)
+
+    return parallel_copy(
+        from_path,
+        to_path,
+        req.file.size_b,
+        streams=io.pull_streams,
+        chunk_size=io.pull_chunk_size,
+        partial=partial_dir(to_path, req),
+        md5sum=req.file.md5sum,
+        progress=Metric(
+            "pull_bytes_copied",
+            "Bytes copied by the parallel transfer engine",
+            counter=True,
+            bound={"node": io.node.name},
+        ),
+    )
+
+
+register_engine("link", _link_engine, remote=False)
+register_engine("bbcp", _bbcp_engine, local=False)
+register_engine("rsync", _rsync_engine, batch=_rsync_batch_engine)
+register_engine("internal", _internal_engine, remote=False)
+register_engine("parallel", _parallel_engine, remote=False)
+
+# The default engine orders
+_DEFAULT_LOCAL_ENGINES = ["link", "rsync", "internal"]
+_DEFAULT_REMOTE_ENGINES = ["bbcp", "rsync"]
+_DEFAULT_LOCAL_BATCH_ENGINES = ["link", "internal"]
+_DEFAULT_REMOTE_BATCH_ENGINES = ["rsync", "bbcp"]
+
+
+def _engine_order(io: BaseNodeIO, req: ArchiveFileCopyRequest) -> list[str]:
+    """Return the names of the engines to try for `req`, in order.
+
+    These come from the "pull_engines_from" or "pull_engines" io_config
+    of the destination node, if set, or else the defaults.
+    """
     local = req.node_from.local
 
+    order = io.pull_engines_from.get(req.node_from.name)
+    if order is None:
+        order = io.pull_engines
+    if order is None:
+        order = _DEFAULT_LOCAL_ENGINES if local else _DEFAULT_REMOTE_ENGINES
+
+    return [
+        name for name in order if name in _engines and _engines[name][1 if local else 2]
+    ]
+
+
+def _pull_setup(
+    io: BaseNodeIO,
+    tree_lock: TreeLock,
+    req: ArchiveFileCopyRequest,
+    did_search: bool,
+    path: pathlib.Path | None,
+) -> tuple[str, pathlib.Path, pathlib.Path] | None:
+    """Prepare to pull `req`.
+
+    Re-checks the request, determines the source and destination, and
+    creates the destination directory and placeholder.
+
+    Returns
+    -------
+    tuple or None
+        None, if the pull should be skipped.  Otherwise, a 3-tuple with
+        the source path (or address), the destination path, and the path to
+        the placeholder.
+    """
+
+    # Rerun the database checks, because we don't know how long we've been in the queue
+    if not req.check(node_to=io.node):
+        return None
+
     # The Remote Node
-    remote = RemoteNode(req.node_from)
+    remote = remote_node(req.node_from)
 
-    # Source spec
-    if local:
+    # Source spec.  We know dest is local, so if source is too, this is a
+    # local transfer
+    if req.node_from.local:
         from_path = remote.io.file_path(req.file)
     else:
         try:
@@ -471,7 +1289,7 @@ def pull_async(
                 f"Skipping request for {req.file.path} "
                 f"due to unconfigured route to host for node {req.node_from.name}."
             )
-            return
+            return None
 
     to_file = path if path else pathlib.Path(io.node.root, req.file.path)
     to_dir = to_file.parent
@@ -489,7 +1307,7 @@ def pull_async(
 
                     # request not resolved.  Should be sorted out after
                     # the file check happens.
-                    return
+                    return None
         except OSError:
             # On error, try to do the pull
             pass
@@ -498,7 +1316,7 @@ def pull_async(
     placeholder = pathlib.Path(to_dir, f".{to_file.name}.placeholder")
 
     # Create directories.  This must be done while locking up the tree lock
-    with tree_lock.up:
+    with tree_lock.stripe(to_dir).up:
         if not to_dir.exists():
             log.info(f'Creating directory "{to_dir}".')
             to_dir.mkdir(parents=True, exist_ok=True)
@@ -508,74 +1326,20 @@ def pull_async(
         if not to_file.exists():
             placeholder.touch(mode=0o600, exist_ok=True)
 
-    # Giddy up!
-    start_time = time.time()
-
-    # Attempt to transfer the file. Each of the methods below needs to return
-    # a dict with required key:
-    #  - ret : integer
-    #        return code (0 == success)
-    # optional keys:
-    #  - md5sum : string or True
-    #        If True, the sum is guaranteed to be right; otherwise, it's a
-    #        md5sum to check against the source.  Must be present if ret == 0
-    #  - stderr : string
-    #        if given, printed to the log when ret != 0
-    #  - check_src : bool
-    #        if given and False, the source file will _not_ be marked suspect
-    #        when ret != 0; otherwise, a failure results in a source check
+    return from_path, to_file, placeholder
 
-    # First we need to check if we are copying over the network
-    if not local:
-        if shutil.which("bbcp") is not None:
-            # First try bbcp which is a fast multistream transfer tool. bbcp can
-            # calculate the md5 hash as it goes, so we'll do that to save doing
-            # it at the end.
-            log.info(f"Pulling remote file {req.file.path} using bbcp")
-            pullrun_metric.inc(method="bbcp", remote="1")
-            ioresult = bbcp(from_path, to_file, req.file.size_b)
-            pullrun_metric.dec(method="bbcp", remote="1")
-        elif shutil.which("rsync") is not None:
-            # Next try rsync over ssh.
-            log.info(f"Pulling remote file {req.file.path} using rsync")
-            pullrun_metric.inc(method="rsync", remote="1")
-            ioresult = rsync(from_path, to_file, req.file.size_b, local)
-            pullrun_metric.dec(method="rsync", remote="1")
-        else:
-            # We have no idea how to transfer the file...
-            log.error("No commands available to complete remote pull.")
-            ioresult = {"ret": -1, "check_src": False}
-
-    else:
-        # Okay, great we're just doing a local transfer.
-
-        # First try to just hard link the file. This will only work if we
-        # are on the same filesystem.  If it didn't work, ioresult will be None
-        #
-        # But don't do this if it creates a hardlink between an archive node and
-        # a non-archive node
-        if req.node_from.archive == io.node.archive:
-            pullrun_metric.inc(method="link", remote="0")
-            ioresult = hardlink(from_path, to_file)
-            pullrun_metric.dec(method="link", remote="0")
-            if ioresult is not None:
-                log.info(f"Hardlinked local file {req.file.path}")
-        else:
-            ioresult = None
 
-        # If we couldn't just link the file, try copying it with rsync.
-        if ioresult is None:
-            if shutil.which("rsync") is not None:
-                log.info(f"Pulling local file {req.file.path} using rsync")
-                pullrun_metric.inc(method="rsync", remote="0")
-                ioresult = rsync(from_path, to_file, req.file.size_b, local)
-                pullrun_metric.dec(method="rsync", remote="0")
-            else:
-                # No rsync?  Just use shutil.copy, I guess
-                log.warning("Falling back on shutil.copy to complete local pull.")
-                pullrun_metric.inc(method="internal", remote="0")
-                ioresult = local_copy(from_path, to_file, req.file.size_b)
-                pullrun_metric.dec(method="internal", remote="0")
+def _pull_finish(
+    task: Task,
+    io: BaseNodeIO,
+    req: ArchiveFileCopyRequest,
+    ioresult: dict,
+    to_file: pathlib.Path,
+    placeholder: pathlib.Path,
+    start_time: float,
+    path: pathlib.Path | None,
+) -> None:
+    """Clean up after pulling `req` and record the result."""
 
     # Delete the placeholder, if we created it
     placeholder.unlink(missing_ok=True)
@@ -584,7 +1348,7 @@ def pull_async(
     # before trying to do the update
     task.db_check()
 
-    if not req.finish(
+    if req.finish(
         io.node,
         io.storage_used,
         check_src=ioresult.get("check_src", True),
@@ -594,12 +1358,234 @@ def pull_async(
         success=(ioresult["ret"] == 0),
         path=path,
     ):
+        # The new file now takes up space on the node
+        if req.file.size_b:
+            io.adjust_bytes_avail(-req.file.size_b)
+    else:
         # Remove file, on error
         try:
             to_file.unlink(missing_ok=True)
         except OSError as e:
             log.error(f"Error removing corrupt file {to_file}: {e}")
 
+    # Once the transfer has succeeded, any partial transfer left behind is no
+    # longer needed.  (If the file turned out to be corrupt, it's not safe to
+    # resume from it either.)  Otherwise, keep it to resume next time.
+    if ioresult["ret"] == 0:
+        shutil.rmtree(partial_dir(to_file, req), ignore_errors=True)
+
+
+def _batch_engine_order(io: BaseNodeIO, req: ArchiveFileCopyRequest) -> list[str]:
+    """Return the names of the engines to try for a batch of requests.
+
+    Like `_engine_order`, except the defaults are different, to prefer the
+    engines which don't need a separate process for each file.
+    """
+    if io.pull_engines is None and req.node_from.name not in io.pull_engines_from:
+        order = (
+            _DEFAULT_LOCAL_BATCH_ENGINES
+            if req.node_from.local
+            else _DEFAULT_REMOTE_BATCH_ENGINES
+        )
+        return [name for name in order if name in _engines]
+
+    return _engine_order(io, req)
+
+
+def pull_async(
+    task: Task,
+    io: BaseNodeIO,
+    tree_lock: TreeLock,
+    req: ArchiveFileCopyRequest,
+    did_search: bool,
+    path: pathlib.path | None = None,
+) -> None:
+    """Fulfill `req` by pulling a file onto the local node.
+
+    The transfer engines returned by `_engine_order` are tried in turn.  By
+    default, these are, for local transfers:
+        - hard link (for nodes on the same filesystem)
+        - rsync
+        - shutil.copy
+    and, for remote transfers:
+        - bbcp
+        - rsync
+
+    Parameters
+    ----------
+    task : Task
+        The task instance containing this async.
+    io : Node I/O instance
+        The I/O instance for the pull destination node.
+    tree_lock : TreeLock
+        The directory tree modificiation lock.
+    req : ArchiveFileCopyRequest
+        The request we're fulfilling.
+    did_search : bool
+        True if a search for an existing unregistered copy was
+        already performed.
+    path : pathlib.Path, optional
+        If not None, this is the absolute destination path.  This parameter is
+        not used by Default I/O but is provided as a convenience to other I/O
+        Classes which wish to re-use this I/O async.  If not given, the file is
+        created as `req.file.path` under the node root.
+    """
+
+    # Before we were queued, NodeIO reserved space for this file.
+    # Automatically release bytes on task completion
+    task.on_cleanup(io.release_bytes, args=(req.file.size_b,))
+
+    pullrun_metric = Metric(
+        "pull_running_count",
+        "Count of in-progress pulls",
+        unbound={"method", "remote"},
+        bound={"node": io.node.name},
+    )
+
+    setup = _pull_setup(io, tree_lock, req, did_search, path)
+    if setup is None:
+        return
+    from_path, to_file, placeholder = setup
+    local = req.node_from.local
+
+    # Giddy up!
+    start_time = time.time()
+
+    # Attempt to transfer the file. Each of the methods below needs to return
+    # a dict with required key:
+    #  - ret : integer
+    #        return code (0 == success)
+    # optional keys:
+    #  - md5sum : string or True
+    #        If True, the sum is guaranteed to be right; otherwise, it's a
+    #        md5sum to check against the source.  Must be present if ret == 0
+    #  - stderr : string
+    #        if given, printed to the log when ret != 0
+    #  - check_src : bool
+    #        if given and False, the source file will _not_ be marked suspect
+    #        when ret != 0; otherwise, a failure results in a source check
+
+    # Try each of the engines in turn, until one of them accepts the transfer
+    remote_label = "0" if local else "1"
+    ioresult = None
+    for name in _engine_order(io, req):
+        pullrun_metric.inc(method=name, remote=remote_label)
+        try:
+            ioresult = _engines[name][0](req, io, from_path, to_file)
+        finally:
+            pullrun_metric.dec(method=name, remote=remote_label)
+        if ioresult is not None:
+            break
+    else:
+        # We have no idea how to transfer the file...
+        log.error(
+            f"No commands available to complete {'local' if local else 'remote'} pull."
+        )
+        ioresult = {"ret": -1, "check_src": False}
+
+    _pull_finish(task, io, req, ioresult, to_file, placeholder, start_time, path)
+
+    # Whatever has happened, update free space, if possible
+    new_avail = io.bytes_avail(fast=True)
+
+    # This was a fast update, so don't save "None" to the database
+    if new_avail is not None:
+        io.node.update_avail_gb(new_avail)
+
+
+def pull_batch_async(
+    task: Task,
+    io: BaseNodeIO,
+    tree_lock: TreeLock,
+    reqs: list[ArchiveFileCopyRequest],
+) -> None:
+    """Fulfill several requests from the same source node in one go.
+
+    This is the batched version of `pull_async`, used for small files.
+    Requests are set-up and finished individually, exactly as in
+    `pull_async`, but the transfers themselves are coalesced.
+
+    For each engine returned by `_batch_engine_order`, in turn, if the
+    engine has a batch engine registered (see `register_engine`), the
+    batch engine is given all the requests not yet handled.  Otherwise,
+    the regular engine is called for each of these requests.
+
+    Parameters
+    ----------
+    task : Task
+        The task instance containing this async.
+    io : Node I/O instance
+        The I/O instance for the pull destination node.
+    tree_lock : TreeLock
+        The directory tree modificiation lock.
+    reqs : list of ArchiveFileCopyRequest
+        The requests we're fulfilling.  All must have the same
+        `node_from`.
+    """
+
+    # Before we were queued, NodeIO reserved space for these files.
+    # Automatically release bytes on task completion
+    for req in reqs:
+        task.on_cleanup(io.release_bytes, args=(req.file.size_b,))
+
+    pullrun_metric = Metric(
+        "pull_running_count",
+        "Count of in-progress pulls",
+        unbound={"method", "remote"},
+        bound={"node": io.node.name},
+    )
+
+    # Set up the pulls, discarding the ones we don't need to do
+    pulls = []
+    for req in reqs:
+        setup = _pull_setup(io, tree_lock, req, False, None)
+        if setup is not None:
+            pulls.append((req, *setup))
+
+    if not pulls:
+        return
+
+    local = pulls[0][0].node_from.local
+    remote_label = "0" if local else "1"
+
+    start_time = time.time()
+
+    # The ioresult for each pull.  None for pulls not yet handled.
+    results = [None] * len(pulls)
+    for name in _batch_engine_order(io, pulls[0][0]):
+        todo = [index for index, result in enumerate(results) if result is None]
+        if not todo:
+            break
+
+        engine, batch_engine = _engines[name][0], _batch_engines.get(name)
+        pullrun_metric.add(len(todo), method=name, remote=remote_label)
+        try:
+            if batch_engine:
+                batch_results = batch_engine(
+                    [pulls[index][0] for index in todo],
+                    io,
+                    [pulls[index][1] for index in todo],
+                    [pulls[index][2] for index in todo],
+                )
+                if batch_results is not None:
+                    for index, result in zip(todo, batch_results, strict=True):
+                        results[index] = result
+            else:
+                for index in todo:
+                    req, from_path, to_file, _ = pulls[index]
+                    results[index] = engine(req, io, from_path, to_file)
+        finally:
+            pullrun_metric.add(-len(todo), method=name, remote=remote_label)
+
+    for (req, _, to_file, placeholder), ioresult in zip(pulls, results, strict=True):
+        if ioresult is None:
+            log.error(
+                "No commands available to complete "
+                f"{'local' if local else 'remote'} pull of {req.file.path}."
+            )
+            ioresult = {"ret": -1, "check_src": False}
+        _pull_finish(task, io, req, ioresult, to_file, placeholder, start_time, None)
+
     # Whatever has happened, update free space, if possible
     new_avail = io.bytes_avail(fast=True)
 
@@ -22,12 +22,27 @@ removing directories must do so while holding the down lock.
 
 The lock ensures only one operation (creation or removal) can
 happen at any given time.
+
+To avoid unrelated operations contending for the same lock, the
+StorageNode's directory tree is protected by a `TreeLock`, which
+stripes the tree over a fixed number of UpDownLocks, by hashing the
+name of the top-level directory.  Because two directories can only
+share a parent directory (other than the node root, which is never
+removed) if they're under the same top-level directory, operations in
+top-level directories with different stripes can't interfere with each
+other.
 """
 
+from __future__ import annotations
+
+import pathlib
 import threading
 import time
+import zlib
 from collections import defaultdict
 
+from ...daemon.metrics import Metric
+
 
 class _UpDownLock:
     """UpDownLock internals.
@@ -35,9 +50,18 @@ class _UpDownLock:
     Used to prevent a reference loop.
     """
 
-    __slots__ = ["_is_unlocked", "_lock", "_owners", "count"]
-
-    def __init__(self) -> None:
+    __slots__ = [
+        "_acquired_metric",
+        "_hold_metric",
+        "_is_unlocked",
+        "_lock",
+        "_locked_at",
+        "_owners",
+        "_wait_metric",
+        "count",
+    ]
+
+    def __init__(self, node: str | None) -> None:
         # This tracks the state of the lock:
         #  > 0: the lock is in the "up" state
         #  = 0: the lock is unlocked
@@ -59,9 +83,54 @@ class _UpDownLock:
         # unlock.
         self._is_unlocked = threading.Condition(threading.RLock())
 
+        # When the lock was last locked.
+        self._locked_at = None
+
+        # Contention metrics
+        if node is None:
+            self._acquired_metric = None
+            self._wait_metric = None
+            self._hold_metric = None
+        else:
+            self._acquired_metric = Metric(
+                "tree_lock_acquired",
+                "Count of tree lock acquisitions",
+                counter=True,
+                unbound={"state"},
+                bound={"node": node},
+            )
+            self._wait_metric = Metric(
+                "tree_lock_wait_seconds",
+                "Total time spent waiting to acquire the tree lock",
+                counter=True,
+                unbound={"state"},
+                bound={"node": node},
+            )
+            self._hold_metric = Metric(
+                "tree_lock_hold_seconds",
+                "Total time the tree lock was held",
+                counter=True,
+                unbound={"state"},
+                bound={"node": node},
+            )
+
     def acquire(self, blocking: bool, timeout: float, is_down: bool) -> bool:
         """Acquire the lock in the specified state."""
 
+        if self._acquired_metric is None:
+            return self._acquire(blocking, timeout, is_down)
+
+        start = time.monotonic()
+        result = self._acquire(blocking, timeout, is_down)
+        if result:
+            state = "down" if is_down else "up"
+            self._acquired_metric.inc(state=state)
+            self._wait_metric.add(time.monotonic() - start, state=state)
+        return result
+
+    def _acquire(self, blocking: bool, timeout: float, is_down: bool) -> bool:
+        """Try to acquire the lock.  Recursive."""
+
         now = time.monotonic()
         me = threading.get_ident()
 
@@ -73,6 +142,8 @@ class _UpDownLock:
                 ok_to_lock = self.count >= 0
 
             if ok_to_lock:
+                if self.count == 0:
+                    self._locked_at = time.monotonic()
                 if is_down:
                     self.count -= 1
                 else:
@@ -118,7 +189,7 @@ class _UpDownLock:
 
         # If we got here, we were notified of the lock unlocking; try again,
         # possibly with a reduced timeout and/or converted to non-blocking
-        return self.acquire(blocking, timeout, is_down)
+        return self._acquire(blocking, timeout, is_down)
 
     def release(self, is_down: bool) -> None:
         """Release the lock with the given state.
@@ -153,6 +224,11 @@ class _UpDownLock:
 
             # If we're now unlocked, notifiy waiters
             if self.count == 0:
+                if self._hold_metric is not None:
+                    self._hold_metric.add(
+                        time.monotonic() - self._locked_at,
+                        state="down" if is_down else "up",
+                    )
                 with self._is_unlocked:
                     self._is_unlocked.notify_all()
 
@@ -244,12 +320,20 @@ class UpDownLock:
     `release` methods which work as they do with the standard
     `threading.Lock`.  The accessors may also be used as context
     managers.
+
+    Parameters
+    ----------
+    node : str, optional
+        If given, the name of the StorageNode whose directory tree this
+        lock protects.  In this case, metrics on lock contention
+        (the number of acquisitions, and the total time spent waiting for,
+        and holding, the lock) are exported.
     """
 
     __slots__ = ["_internals", "down", "up"]
 
-    def __init__(self) -> None:
-        self._internals = _UpDownLock()
+    def __init__(self, node: str | None = None) -> None:
+        self._internals = _UpDownLock(node)
         self.up = _UpDownAccessor(is_down=False, internals=self._internals)
         self.down = _UpDownAccessor(is_down=True, internals=self._internals)
 
@@ -264,3 +348,83 @@ class UpDownLock:
         return (
             f"<UpDownLock object state={state} count={abs(count)} at {hex(id(self))}>"
         )
+
+    def stripe(self, path: pathlib.PurePath) -> UpDownLock:
+        """Return the lock protecting `path`.
+
+        An UpDownLock can be used in place of a `TreeLock` with a single
+        stripe, so this always returns the lock itself.
+        """
+        return self
+
+
+class TreeLock:
+    """A striped lock protecting a StorageNode's directory tree.
+
+    The tree is protected by `stripes` UpDownLocks.  Each top-level
+    directory under `root` is assigned to one of these by hashing its name,
+    so the number of locks doesn't grow with the number of directories.
+    Use `stripe` to get the lock for a particular path; e.g.:
+
+        with tree_lock.stripe(path).up:
+            path.mkdir(parents=True)
+
+    Parameters
+    ----------
+    root : path-like or None
+        The root of the tree.  If None, the whole tree is protected by a
+        single stripe.
+    node : str, optional
+        If given, passed on to the stripe UpDownLocks to enable contention
+        metrics.
+    stripes : int, optional
+        The number of stripes.
+    """
+
+    __slots__ = ["_lock", "_node", "_root", "_stripes"]
+
+    def __init__(
+        self,
+        root: str | pathlib.PurePath | None,
+        node: str | None = None,
+        stripes: int = 64,
+    ) -> None:
+        if stripes < 1:
+            raise ValueError(f"stripes non-positive (={stripes})")
+        self._root = None if root is None else pathlib.PurePath(root)
+        self._node = node
+
+        # Protects _stripes.  Stripes are created when first used.
+        self._lock = threading.Lock()
+        self._stripes = [None] * stripes
+
+    def stripe(self, path: pathlib.PurePath) -> UpDownLock:
+        """Return the lock protecting `path`.
+
+        Parameters
+        ----------
+        path : pathlib.PurePath
+            An absolute path.  Paths outside of the root share a stripe.
+        """
+        try:
+            parts = pathlib.PurePath(path).relative_to(self._root).parts
+        except (TypeError, ValueError):
+            parts = ()
+        key = parts[0] if parts else ""
+
+        # Python's hash() of a str varies between runs, so use crc32 to
+        # keep striping predictable.
+        index = zlib.crc32(key.encode(errors="surrogateescape")) % len(self._stripes)
+
+        with self._lock:
+            lock = self._stripes[index]
+            if lock is None:
+                lock = UpDownLock(self._node)
+                self._stripes[index] = lock
+            return lock
+
+    def __repr__(self) -> str:
+        return (
+            f"<TreeLock object root={self._root} stripes={len(self._stripes)} "
+            f"at {hex(id(self))}>"
+        )
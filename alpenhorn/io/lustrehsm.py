@@ -14,9 +14,11 @@ This module provides:
 
 from __future__ import annotations
 
+import datetime
 import logging
 import os
 import pathlib
+import threading
 import time
 from collections.abc import Generator, Hashable
 from typing import IO
@@ -26,14 +28,28 @@ import peewee as pw
 from ..common.util import pretty_bytes, pretty_deltat
 from ..daemon import UpdateableGroup, UpdateableNode
 from ..daemon.querywalker import QueryWalker
-from ..daemon.scheduler import FairMultiFIFOQueue, Task
-from ..db import ArchiveFile, ArchiveFileCopy, ArchiveFileCopyRequest, utcnow
-from .base import BaseNodeRemote, InternalIO
+from ..daemon.scheduler import PRIORITY_IDLE, PRIORITY_PULL, FairMultiFIFOQueue, Task
+from ..db import (
+    ArchiveAcq,
+    ArchiveFile,
+    ArchiveFileCopy,
+    ArchiveFileCopyRequest,
+    utcnow,
+)
+from ._hsmcache import HSMStateCache
+from ._lfs import HSMState
+from .base import BaseNodeIO, BaseNodeRemote, InternalIO
 from .default import DefaultGroupIO
 from .lustrequota import LustreQuotaNodeIO
 
 log = logging.getLogger(__name__)
 
+# Minimum time, in seconds, between writes of the HSM state cache to disk
+_STATE_CACHE_SAVE_INTERVAL = 600
+
+# Minimum time, in seconds, between expiries of stale HSM state cache entries
+_STATE_CACHE_EXPIRE_INTERVAL = 600
+
 
 class LustreHSMNodeRemote(BaseNodeRemote):
     """LustreHSMNodeRemote: information about a LustreHSM remote node."""
@@ -58,6 +74,34 @@ class LustreHSMNodeRemote(BaseNodeRemote):
 
         return copy.ready
 
+    def pull_ready_many(self, files: list[ArchiveFile]) -> set[ArchiveFile]:
+        """Which of `files` are ready for pulling from this remote node?
+
+        Parameters
+        ----------
+        files : list of ArchiveFile
+            the files being checked
+
+        Returns
+        -------
+        ready : set of ArchiveFile
+            The elements of `files` which are ready on the node.
+        """
+        ready_ids = set()
+        for batch in pw.chunked([file.id for file in files], 500):
+            ready_ids.update(
+                row[0]
+                for row in ArchiveFileCopy.select(ArchiveFileCopy.file)
+                .where(
+                    ArchiveFileCopy.node == self.node,
+                    ArchiveFileCopy.file << batch,
+                    ArchiveFileCopy.ready == 1,
+                )
+                .tuples()
+            )
+
+        return {file for file in files if file.id in ready_ids}
+
 
 class LustreHSMNodeIO(LustreQuotaNodeIO):
     """LustreHSM node I/O.
@@ -76,16 +120,30 @@ class LustreHSMNodeIO(LustreQuotaNodeIO):
         * lfs_timeout: the timeout, in seconds, for an lfs(1) call.  Calls
             that run longer than this will be abandonned.  Defaults to 60
             seconds if not given.
+        * lfs_helper: if true, run lfs(1) via a small pool of long-lived
+            helper processes, instead of forking the daemon for every call.
+            Defaults to false.
         * fixed_quota : integer
             the quota, in kiB, on the Lustre disk backing the HSM system
         * quota_type: One of "user", "group" or "project" indicating how to
             interpret the value of quota_id.  If omitted, "group" is assumed.
         * release_check_count : integer
             The number of files to check at a time when doing idle HSM status
-            update (see idle_update()).  Default is 100.
+            update (see idle_update()) or looking for files to release (see
+            release_files()).  Default is 100.
+        * restore_batch_size : integer
+            The maximum number of files to request restores for at once when
+            readying files for pulls (see ready_pull()).  Default is 100.
         * restore_wait : integer
             The number of seconds to wait between checking if a restore request
             has completed.  Default is 600 seconds (10 minutes).
+        * state_cache_age : float
+            The number of seconds for which a file's HSM state, once determined,
+            is used to plan releases (see release_files()).  Default is 86400
+            seconds (one day).
+        * state_cache_file : string
+            If given, a path to a file used to persist the HSM state cache
+            between runs of the daemon.
     """
 
     remote_class = LustreHSMNodeRemote
@@ -112,6 +170,23 @@ class LustreHSMNodeIO(LustreQuotaNodeIO):
         # For informational purposes.  Keys are elements in self._restoring.
         self._restore_start = {}
 
+        # Files waiting to be restored for pulls, as `ArchiveFile.id`s, and
+        # the files with restores in flight for pulls, as a dict of
+        # `ArchiveFileCopy`s keyed by `ArchiveFile.id`.  Both are managed by
+        # the restore poller task, which runs whenever either is non-empty.
+        # Elements of both are also in self._restoring.
+        self._restore_queue = set()
+        self._restore_inflight = {}
+        self._restore_poller = False
+        self._restore_lock = threading.Lock()
+
+        self._restore_batch_size = int(config.get("restore_batch_size", 100))
+        if self._restore_batch_size < 1:
+            raise ValueError(
+                "io_config key 'restore_batch_size' non-positive "
+                f"(={self._restore_batch_size})"
+            )
+
         self._restore_wait_time = int(config.get("restore_wait", 600))
         if self._restore_wait_time < 1:
             raise ValueError(
@@ -126,6 +201,73 @@ class LustreHSMNodeIO(LustreQuotaNodeIO):
                 f"io_config key 'release_check_count' non-positive (={self._nrelease})"
             )
 
+        # Cache of HSM states, used to plan releases
+        state_cache_age = float(config.get("state_cache_age", 86400))
+        if state_cache_age <= 0:
+            raise ValueError(
+                f"io_config key 'state_cache_age' non-positive (={state_cache_age})"
+            )
+        self._state_cache = HSMStateCache(
+            state_cache_age, config.get("state_cache_file", None)
+        )
+
+    def _cache_state(self, copy: ArchiveFileCopy, state: HSMState | None) -> None:
+        """Record `state` for `copy` in the HSM state cache."""
+        last_update = copy.last_update
+        if isinstance(last_update, datetime.datetime):
+            last_update = last_update.timestamp()
+        self._state_cache.update(
+            copy.id, state, last_update or 0, copy.file.size_b or 0, copy.path
+        )
+
+    def _release(self, items: list[tuple[int, str, int]]) -> tuple[int, int]:
+        """Release files.
+
+        Runs "lfs hsm_release" on the files, updates the database for the
+        released files, and records the result in the HSM state cache.
+
+        Parameters
+        ----------
+        items : list of tuples
+            The files to release as (copy id, path, size) tuples.  The files
+            should be restored.
+
+        Returns
+        -------
+        count : int
+            The number of files released.
+        size : int
+            The total size, in bytes, of the released files.
+        """
+        if not items:
+            return 0, 0
+
+        results = self._lfs.hsm_release_many([path for _, path, _ in items])
+
+        released = []
+        total_bytes = 0
+        for copy_id, path, size in items:
+            if results[path]:
+                log.debug(
+                    f"released file copy {path} "
+                    f"[={pretty_bytes(size)}] on node {self.node.name}"
+                )
+                released.append(copy_id)
+                total_bytes += size
+                self.adjust_bytes_avail(size)
+
+            # Released or not, this copy's state is no longer known to be
+            # RESTORED.
+            self._state_cache.update(copy_id, None)
+
+        # Update copy records immediately
+        for batch in pw.chunked(released, 500):
+            ArchiveFileCopy.update(ready=False, last_update=utcnow()).where(
+                ArchiveFileCopy.id << batch
+            ).execute()
+
+        return len(released), total_bytes
+
     def _restore_wait(self, copy: ArchiveFileCopy) -> bool | None:
         """Attempt to restore a file from HSM.
 
@@ -148,6 +290,7 @@ class LustreHSMNodeIO(LustreQuotaNodeIO):
 
         # What's the current situation?
         state = self._lfs.hsm_state(copy.path)
+        self._cache_state(copy, state)
 
         if state is None:
             log.warning(f"Unable to restore {copy.path}: state check failed.")
@@ -228,42 +371,73 @@ class LustreHSMNodeIO(LustreQuotaNodeIO):
         if headroom_needed <= 0:
             return
 
-        def _async(task, node, lfs, headroom_needed):
-            total_files = 0
-            total_bytes = 0
-
-            # loop through file copies until we've released enough
-            # (or we run out of files)
-            for copy in (
-                ArchiveFileCopy.select()
-                .where(
-                    ArchiveFileCopy.node == node,
-                    ArchiveFileCopy.has_file == "Y",
-                    ArchiveFileCopy.ready == True,  # noqa: E712
+        def _async(task, node_io, headroom_needed):
+            # First, release files picked from the HSM state cache, if possible
+            plan = node_io._state_cache.plan(headroom_needed)
+
+            # Only release copies the database still thinks are ready
+            ready = set()
+            for batch in pw.chunked([copy_id for copy_id, _, _ in plan], 500):
+                ready.update(
+                    row[0]
+                    for row in ArchiveFileCopy.select(ArchiveFileCopy.id)
+                    .where(
+                        ArchiveFileCopy.id << batch,
+                        ArchiveFileCopy.has_file == "Y",
+                        ArchiveFileCopy.ready == True,  # noqa: E712
+                    )
+                    .tuples()
                 )
-                .order_by(ArchiveFileCopy.last_update)
-            ):
-                # The only files we can release are ones that are fully restored
-                if lfs.hsm_state(copy.path) != lfs.HSM_RESTORED:
-                    continue
+            total_files, total_bytes = node_io._release(
+                [item for item in plan if item[0] in ready]
+            )
+
+            # If that wasn't enough, loop through file copies until we've
+            # released enough (or we run out of files).  HSM states are
+            # fetched in batches to limit the number of lfs(1) invocations.
+            if total_bytes < headroom_needed:
+                planned = {copy_id for copy_id, _, _ in plan}
+                for batch in pw.chunked(
+                    ArchiveFileCopy.select()
+                    .where(
+                        ArchiveFileCopy.node == node_io.node,
+                        ArchiveFileCopy.has_file == "Y",
+                        ArchiveFileCopy.ready == True,  # noqa: E712
+                    )
+                    .order_by(ArchiveFileCopy.last_update),
+                    node_io._nrelease,
+                ):
+                    states = node_io._lfs.hsm_state_many(
+                        [copy.path for copy in batch], restoring=False
+                    )
+
+                    # The only files we can release are ones that are fully
+                    # restored.
+                    items = []
+                    needed = headroom_needed - total_bytes
+                    for copy in batch:
+                        state = states[str(copy.path)]
+                        node_io._cache_state(copy, state)
+                        if (
+                            needed > 0
+                            and copy.id not in planned
+                            and state == HSMState.RESTORED
+                        ):
+                            items.append((copy.id, str(copy.path), copy.file.size_b))
+                            needed -= copy.file.size_b
+
+                    nfiles, nbytes = node_io._release(items)
+                    total_files += nfiles
+                    total_bytes += nbytes
+                    if total_bytes >= headroom_needed:
+                        break
+
+            node_io._state_cache.save()
 
-                log.debug(
-                    f"releasing file copy {copy.path} "
-                    f"[={pretty_bytes(copy.file.size_b)}] on node {self.node.name}"
-                )
-                lfs.hsm_release(copy.path)
-                # Update copy record immediately
-                ArchiveFileCopy.update(ready=False, last_update=utcnow()).where(
-                    ArchiveFileCopy.id == copy.id
-                ).execute()
-                total_files += 1
-                total_bytes += copy.file.size_b
-                if total_bytes >= headroom_needed:
-                    break
             log.info(
                 f"Released {pretty_bytes(total_bytes)} in {total_files} "
                 f"{'file' if total_files == 1 else 'files'} "
-                f"on node {self.node.name}"
+                f"on node {node_io.node.name}"
             )
             return
 
@@ -272,7 +446,7 @@ class LustreHSMNodeIO(LustreQuotaNodeIO):
             func=_async,
             queue=self._queue,
             key=self.fifo,
-            args=(self.node, self._lfs, headroom_needed),
+            args=(self, headroom_needed),
             name=f"Node {self.node.name}: HSM release {pretty_bytes(headroom_needed)}",
         )
 
@@ -298,6 +472,28 @@ class LustreHSMNodeIO(LustreQuotaNodeIO):
         # Continue with the update
         return True
 
+    def after_update(self) -> None:
+        """Post-update hook.
+
+        Starts the restore poller, if there are restores pending for pulls
+        and it isn't already running.
+        """
+        super().after_update()
+
+        with self._restore_lock:
+            if self._restore_poller or not self._restore_queue:
+                return
+            self._restore_poller = True
+
+        Task(
+            func=self._restore_poll,
+            queue=self._queue,
+            key=self.fifo,
+            name=f"Node {self.node.name}: HSM restore poller",
+            priority=PRIORITY_PULL,
+            requeue=True,
+        )
+
     def idle_update(self, newly_idle) -> None:
         """Update HSM state of copies when idle.
 
@@ -312,6 +508,9 @@ class LustreHSMNodeIO(LustreQuotaNodeIO):
         # Run DefautlIO idle checks
         super().idle_update(newly_idle)
 
+        # Forget stale cached states, whether or not the cache is persisted
+        self._state_cache.expire(interval=_STATE_CACHE_EXPIRE_INTERVAL)
+
         # Check the query walker.  Initialised if necessary.
         if self._statecheck_qw is None:
             try:
@@ -332,9 +531,13 @@ class LustreHSMNodeIO(LustreQuotaNodeIO):
             self._statecheck_qw = None
             return
 
-        def _async(task, node, lfs, copies):
+        def _async(task, node_io, copies):
+            node = node_io.node
+            lfs = node_io._lfs
+            states = lfs.hsm_state_many([copy.path for copy in copies])
             for copy in copies:
-                state = lfs.hsm_state(copy.path)
+                state = states[str(copy.path)]
+                node_io._cache_state(copy, state)
                 if state is None:
                     log.warning(
                         f"Unable to determine state for {copy.file.path} "
@@ -361,13 +564,16 @@ class LustreHSMNodeIO(LustreQuotaNodeIO):
                             ArchiveFileCopy.id == copy.id
                         ).execute()
 
+            node_io._state_cache.save(max_age=_STATE_CACHE_SAVE_INTERVAL)
+
         # Copies get checked in an async
         Task(
             func=_async,
             queue=self._queue,
             key=self.fifo,
-            args=(self.node, self._lfs, copies),
+            args=(self, copies),
             name=f"Node {self.node.name}: HSM state check of {len(copies)} files",
+            priority=PRIORITY_IDLE,
         )
 
     # I/O METHODS
@@ -443,7 +649,8 @@ class LustreHSMNodeIO(LustreQuotaNodeIO):
 
             # Release the file if the DB says it should be
             if not ArchiveFileCopy.get(id=copy.id).ready:
-                node_io._lfs.hsm_release(copy.path)
+                if node_io._lfs.hsm_release(copy.path):
+                    node_io._cache_state(copy, HSMState.RELEASED)
 
         # Only do this if another task isn't already restoring this file.
         if copy.file.id not in self._restoring:
@@ -457,6 +664,10 @@ class LustreHSMNodeIO(LustreQuotaNodeIO):
         else:
             log.debug(f"Skipping check of {copy.path}: restore in progress.")
 
+    # Each copy may need to be restored before it can be checked, so
+    # don't use DefaultNodeIO's batched checks.
+    check_many = BaseNodeIO.check_many
+
     def check_init(self) -> bool:
         """Check that this node is initialised.
 
@@ -467,15 +678,20 @@ class LustreHSMNodeIO(LustreQuotaNodeIO):
     def exists(self, path: pathlib.PurePath) -> bool:
         """Does `path` exist?
 
-        Checks whether `lfs hsm_state` returns ENOENT.
+        Checks whether `lfs hsm_state` returns ENOENT.  Whether a released
+        file is being restored doesn't matter here, so "lfs hsm_action" isn't
+        run.
 
         Parameters
         ----------
         path : pathlib.PurePath
             path relative to `node.root`
         """
-        full_path = pathlib.PurePath(self.node.root).joinpath(path)
-        return self._lfs.hsm_state(full_path) != self._lfs.HSM_MISSING
+        full_path = str(pathlib.PurePath(self.node.root).joinpath(path))
+        return (
+            self._lfs.hsm_state_many([full_path], restoring=False)[full_path]
+            != self._lfs.HSM_MISSING
+        )
 
     def storage_used(self, path: pathlib.Path) -> None:
         """Returns None.
@@ -577,59 +793,261 @@ class LustreHSMNodeIO(LustreQuotaNodeIO):
     def ready_pull(self, req: ArchiveFileCopyRequest) -> None:
         """Ready a file to be pulled as specified by `req`.
 
+        The file is added to the restore queue.  Restores are requested
+        and tracked in bulk by the restore poller, which is started, if
+        necessary, at the end of the update loop (see `after_update`).
+
         Parameters
         ----------
         req : ArchiveFileCopyRequest
             the copy request to ready.  We are the source node (i.e.
             `req.node_from == self.node`).
         """
-
-        # A small async to restore-and-wait for the file
-        def _async(task: Task, node_io: LustreHSMNodeIO, file_: ArchiveFile):
-            """Restore `file_` on `node` and wait for completion."""
-
-            try:
-                copy = ArchiveFileCopy.get(node=node_io.node, file=file_)
-            except pw.DoesNotExist:
+        with self._restore_lock:
+            # No need to do this more than once
+            if req.file.id in self._restoring:
+                log.debug(
+                    f"Skipping ready of {req.file.path} "
+                    f"on node {self.node.name}: restore in progress."
+                )
                 return
 
-            restore_wait = node_io._restore_wait(copy)
-            while restore_wait:
-                # Wait for a bit
-                yield self._restore_wait_time
+            self._restoring.add(req.file.id)
+            self._restore_start[req.file.id] = time.monotonic()
+            self._restore_queue.add(req.file.id)
 
-                # Now check again
-                restore_wait = node_io._restore_wait(copy)
+    def _restore_done(self, file_id: int) -> None:
+        """Stop tracking the restore of file `file_id`."""
+        with self._restore_lock:
+            self._restore_queue.discard(file_id)
+            self._restore_inflight.pop(file_id, None)
+            self._restore_start.pop(file_id, None)
+            self._restoring.discard(file_id)
 
-            # Update copy based on result.  restore_wait==False means the
-            # file was successfully restored.  On error, we assume the
-            # file is not ready (i.e. not restored).
-            ready = True if restore_wait is False else False
+    def _restore_update(self, copies: list[ArchiveFileCopy]) -> None:
+        """Check the HSM state of files being restored for pulls.
 
-            if copy.ready != ready:
-                copy.ready = ready
-                copy.last_update = utcnow()
-                copy.save()
-                log.info(
-                    f"File copy {file_.path} on node {node_io.node.name} now "
-                    + ("restored" if ready else "released")
+        Restored copies are marked ready; copies which can't be restored are
+        marked not ready and dropped; released copies are put back in the
+        restore queue.
+
+        Parameters
+        ----------
+        copies : list of ArchiveFileCopy
+            The copies to check.
+        """
+        states = self._lfs.hsm_state_many([copy.path for copy in copies])
+
+        ready = {True: [], False: []}
+        for copy in copies:
+            state = states[str(copy.path)]
+            self._cache_state(copy, state)
+
+            if state == HSMState.RESTORING:
+                with self._restore_lock:
+                    self._restore_queue.discard(copy.file.id)
+                    self._restore_inflight[copy.file.id] = copy
+                log.debug(f"Restore in progress: {copy.path}")
+                continue
+
+            if state == HSMState.RELEASED:
+                # Either not yet requested, or the request went missing
+                with self._restore_lock:
+                    self._restore_inflight.pop(copy.file.id, None)
+                    self._restore_queue.add(copy.file.id)
+                continue
+
+            if state is None or state == HSMState.MISSING:
+                log.warning(
+                    f"Unable to restore {copy.path}: "
+                    + ("state check failed." if state is None else "missing.")
                 )
+                ready[False].append(copy)
+            else:
+                # i.e. file is restored or unarchived, so we're done.
+                start = self._restore_start.get(copy.file.id)
+                if copy.file.id in self._restore_inflight:
+                    if start is not None:
+                        log.info(
+                            f"{copy.file.path} restored on node {self.node.name} "
+                            f"after {pretty_deltat(time.monotonic() - start)}"
+                        )
+                    # The restore has used up some of the free space
+                    self.adjust_bytes_avail(-(copy.file.size_b or 0))
+                else:
+                    log.debug(f"Already restored: {copy.path}")
+                ready[True].append(copy)
+            self._restore_done(copy.file.id)
+
+        # Update the copies whose readiness has changed
+        for value, done in ready.items():
+            ids = [copy.id for copy in done if copy.ready != value]
+            for batch in pw.chunked(ids, 500):
+                ArchiveFileCopy.update(ready=value, last_update=utcnow()).where(
+                    ArchiveFileCopy.id << batch
+                ).execute()
+            for copy in done:
+                if copy.ready != value:
+                    log.info(
+                        f"File copy {copy.file.path} on node {self.node.name} now "
+                        + ("restored" if value else "released")
+                    )
 
-        # No need to do this more than once
-        if req.file.id not in self._restoring:
-            Task(
-                func=_async,
-                queue=self._queue,
-                key=self.fifo,
-                args=(self, req.file),
-                name=f"Ready file {req.file.path} on node {self.node.name}",
+    def _restore_next(self) -> list[ArchiveFileCopy]:
+        """Pick the next batch of files to restore from the restore queue.
+
+        Files are ordered by acquisition, and then by name, to keep related
+        files together on the external storage.  The batch size is limited by
+        `restore_batch_size` and by the amount of free space above the headroom
+        not already claimed by restores in flight.  At least one file is picked
+        if nothing is in flight.
+
+        Returns
+        -------
+        copies : list of ArchiveFileCopy
+            The copies to restore.  May be empty.
+        """
+        with self._restore_lock:
+            queued = list(self._restore_queue)
+            inflight_bytes = sum(
+                copy.file.size_b or 0 for copy in self._restore_inflight.values()
             )
-        else:
-            log.debug(
-                f"Skipping ready of {req.file.path} "
-                f"on node {self.node.name}: restore in progress."
+            idle = not self._restore_inflight
+
+        # Fetch the copies, with their files and acqs
+        copies = []
+        for batch in pw.chunked(queued, 500):
+            copies.extend(
+                ArchiveFileCopy.select(ArchiveFileCopy, ArchiveFile, ArchiveAcq)
+                .join(ArchiveFile)
+                .join(ArchiveAcq)
+                .where(
+                    ArchiveFileCopy.node == self.node,
+                    ArchiveFileCopy.file << batch,
+                    ArchiveFileCopy.has_file == "Y",
+                )
             )
 
+        # Drop files without a copy here
+        found = {copy.file.id for copy in copies}
+        for file_id in queued:
+            if file_id not in found:
+                self._restore_done(file_id)
+
+        copies.sort(key=lambda copy: (copy.file.acq.name, copy.file.name))
+
+        # How much can we restore?
+        size_gib = self.node.avail_gb
+        if size_gib is None:
+            budget = None
+        else:
+            budget = int(size_gib * 2**30) - self._headroom - inflight_bytes
+
+        total_bytes = 0
+        next_copies = []
+        for copy in copies[: self._restore_batch_size]:
+            size = copy.file.size_b or 0
+            if budget is not None and total_bytes + size > budget:
+                if next_copies or not idle:
+                    break
+            next_copies.append(copy)
+            total_bytes += size
+
+        return next_copies
+
+    def _restore_poll(self, task: Task) -> Generator[int]:
+        """Restore poller task.
+
+        Restores the files in the restore queue in batches and tracks
+        the restores in flight until they complete.  Runs until there's
+        nothing left to restore.
+
+        If the task is requeued after a database error, the new task
+        carries on with the outstanding restores.  If the poller stops for
+        any other reason, they're forgotten, to be re-queued by `ready_pull`
+        during a later update.
+
+        Parameters
+        ----------
+        task : Task
+            The task instance containing this async.
+        """
+        stopped = False
+        try:
+            while True:
+                # Check restores in flight
+                with self._restore_lock:
+                    inflight = list(self._restore_inflight.values())
+                if inflight:
+                    self._restore_update(inflight)
+
+                # Check the state of the next batch before restoring it: some
+                # of the files may already be restored.
+                batch = self._restore_next()
+                if batch:
+                    self._restore_update(batch)
+
+                    with self._restore_lock:
+                        released = [
+                            copy
+                            for copy in batch
+                            if copy.file.id in self._restore_queue
+                        ]
+                    if released:
+                        log.info(
+                            f"Requesting restore of {len(released)} "
+                            f"{'file' if len(released) == 1 else 'files'} "
+                            f"on node {self.node.name}"
+                        )
+                        results = self._lfs.hsm_restore_many(
+                            [copy.path for copy in released]
+                        )
+                        for copy in released:
+                            result = results[str(copy.path)]
+                            if result is False:
+                                # Request failed.  Abandon the restore attempt
+                                # entirely, in case it was deleted from the node.
+                                log.warning(f"Restore request failed: {copy.path}")
+                                self._restore_done(copy.file.id)
+                                continue
+
+                            # Might have worked, if it timed out.  We'll find out
+                            # on the next check
+                            if result is None:
+                                log.warning(f"Restore request timeout: {copy.path}")
+                            with self._restore_lock:
+                                self._restore_queue.discard(copy.file.id)
+                                self._restore_inflight[copy.file.id] = copy
+
+                with self._restore_lock:
+                    if not self._restore_queue and not self._restore_inflight:
+                        self._restore_poller = False
+                        stopped = True
+                        return
+
+                # Wait for a bit
+                yield self._restore_wait_time
+        except pw.OperationalError:
+            # The requeued task will carry on where we left off
+            stopped = True
+            raise
+        finally:
+            if not stopped:
+                self._restore_abandon()
+
+    def _restore_abandon(self) -> None:
+        """Forget all outstanding restores for pulls.
+
+        Called when the restore poller stops unexpectedly.
+        """
+        with self._restore_lock:
+            for file_id in self._restore_queue | self._restore_inflight.keys():
+                self._restore_start.pop(file_id, None)
+                self._restoring.discard(file_id)
+            self._restore_queue.clear()
+            self._restore_inflight.clear()
+            self._restore_poller = False
+
     def release_bytes(self, size: int) -> None:
         """Does nothing."""
         pass
@@ -9,13 +9,21 @@ the `io_config`.
 
 The quota target can either be the one reported by "lfs quota" directly
 or else set to a fixed value via the `io_config`.
+
+Because running "lfs quota" is slow, the result is cached.  The cache is
+refreshed by the (slow) free space check done once per update loop, and
+adjusted locally in between as files are added to and removed from the
+node, so that fast free space checks can be answered from memory.
 """
 
 from __future__ import annotations
 
 import logging
+import threading
+import time
 from collections.abc import Hashable
 
+from ..daemon.metrics import Metric
 from ..daemon.scheduler import FairMultiFIFOQueue
 from ..db import StorageNode
 from ._lfs import LFS
@@ -25,6 +33,32 @@ from .default import DefaultNodeIO
 log = logging.getLogger(__name__)
 
 
+def _config_bool(config: dict, key: str, default: bool) -> bool:
+    """Parse the boolean io_config value `key`.
+
+    Accepts JSON booleans, as well as the strings "true"/"yes"/"on"/"1" and
+    "false"/"no"/"off"/"0" (case insensitive).
+
+    Raises
+    ------
+    ValueError
+        The value couldn't be interpreted as a boolean.
+    """
+    value = config.get(key, default)
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        lowered = value.strip().lower()
+        if lowered in ("true", "yes", "on", "1"):
+            return True
+        if lowered in ("false", "no", "off", "0"):
+            return False
+    elif value in (0, 1):
+        return bool(value)
+
+    raise ValueError(f"io_config key '{key}' not boolean (={value!r})")
+
+
 class LustreQuotaNodeIO(DefaultNodeIO):
     """An extension to DefaultNodeIO which uses the "lfs quota" to determine
     free space, rather than stat.
@@ -42,6 +76,12 @@ class LustreQuotaNodeIO(DefaultNodeIO):
         * lfs_timeout: the timeout, in seconds, for an lfs(1) call.  Calls
             that run longer than this will be abandonned.  Defaults to 60
             seconds if not given.
+        * lfs_helper: if true, run lfs(1) via a small pool of long-lived
+            helper processes, instead of forking the daemon for every call.
+            Defaults to false.
+        * quota_cache_ttl: the time, in seconds, after the last "lfs quota"
+            call for which fast free space checks are answered from the quota
+            cache.  Defaults to 900 seconds (15 minutes).
 
     Notes
     -----
@@ -88,28 +128,92 @@ class LustreQuotaNodeIO(DefaultNodeIO):
             fixed_quota=config.get("fixed_quota", None),
             lfs=config.get("lfs", "lfs"),
             timeout=config.get("lfs_timeout", None),
+            helper=_config_bool(config, "lfs_helper", False),
+        )
+
+        # The quota cache: the predicted free quota, in bytes, and the
+        # time.monotonic() it was last measured
+        self._quota_ttl = float(config.get("quota_cache_ttl", 900))
+        if self._quota_ttl <= 0:
+            raise ValueError(
+                f"io_config key 'quota_cache_ttl' non-positive (={self._quota_ttl})"
+            )
+        self._quota = None
+        self._quota_time = None
+        self._quota_lock = threading.Lock()
+
+        self._quota_age_metric = Metric(
+            "quota_cache_age_seconds",
+            "Age of the cached quota when last used",
+            bound={"node": node.name},
+        )
+        self._quota_drift_metric = Metric(
+            "quota_cache_drift_bytes",
+            "Measured minus predicted free quota at the last quota check",
+            bound={"node": node.name},
         )
 
+    def stop(self) -> None:
+        """Stop hook.
+
+        Also stops the lfs helper co-processes, if any.
+        """
+        super().stop()
+        self._lfs.close()
+
     # I/O METHODS
 
+    def adjust_bytes_avail(self, size: int) -> None:
+        """Adjust the cached quota by `size` bytes.
+
+        Parameters
+        ----------
+        size : int
+            The change, in bytes, in free space.
+        """
+        with self._quota_lock:
+            if self._quota is not None:
+                self._quota += size
+
     def bytes_avail(self, fast: bool = False) -> int | None:
         """Use "lfs quota" get the amount of free quota.
 
         Parameters
         ----------
         fast : bool
-            If True, then this is a fast call and we simply return None.
-            Otherwise (slow call) we do th "lfs quota" query.
+            If True, then this is a fast call and we return the cached quota,
+            or None, if the cache is empty or older than `quota_cache_ttl`.
+            Otherwise (slow call) we do the "lfs quota" query and update
+            the cache.
 
         Returns
         -------
         bytes_avail : int or None
-            None if `fast is True` otherwise, the available quota.
+            the available quota, or None if it couldn't be determined.
         """
         if fast:
-            return None
-
-        return self._lfs.quota_remaining(self.node.root)
+            with self._quota_lock:
+                if self._quota is None:
+                    return None
+
+                age = time.monotonic() - self._quota_time
+                self._quota_age_metric.set(age)
+                if age > self._quota_ttl:
+                    return None
+                return self._quota
+
+        avail = self._lfs.quota_remaining(self.node.root)
+
+        # On failure, leave the cache alone: it'll expire eventually
+        if avail is not None:
+            with self._quota_lock:
+                if self._quota is not None:
+                    self._quota_drift_metric.set(avail - self._quota)
+                self._quota = avail
+                self._quota_time = time.monotonic()
+                self._quota_age_metric.set(0)
+
+        return avail
 
 
 LustreQuotaIO = InternalIO(__name__, LustreQuotaNodeIO, None)
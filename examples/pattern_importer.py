@@ -15,23 +15,33 @@ users to use the standard "alpenhorn db init" CLI command to
 initialise these tables for the ImportDetectExtension's use.
 
 The ImportDetectExtension's callback function is `detect`.  The
-`detect` function loops through the AcqTypes and FileTypes to try
-to match the path supplied by alpenhorn to the patterns listed in the
-tables.  On a successful match, the import callback function `register_file`
-will be called by alpenhorn, which then stores the matched AcqType
-in the AcqData table and the matched FileType in the FileData table.
+`detect` function tries to match the path supplied by alpenhorn to the
+patterns listed in the AcqType and FileType tables.  On a successful match,
+the import callback function `register_file` will be called by alpenhorn,
+which then stores the matched AcqType in the AcqData table and the matched
+FileType in the FileData table.
+
+To avoid querying the database for every file, the patterns from all the
+types in each table are compiled into a single regular expression, which
+is rebuilt whenever the tables change, and the result of matching each
+acquisition directory is cached.  The extension also provides `detect_many`
+to let alpenhorn detect many files at once.
 """
 
 from __future__ import annotations
 
 import json
+import logging
 import os
 import pathlib
 import re
+import threading
+import time
 from functools import partial
 
 import peewee as pw
 
+from alpenhorn.common.extload import DetectCache
 from alpenhorn.daemon import UpdateableNode
 from alpenhorn.db import (
     ArchiveAcq,
@@ -41,6 +51,8 @@ from alpenhorn.db import (
 )
 from alpenhorn.extensions.import_detect import ImportCallback
 
+log = logging.getLogger(__name__)
+
 # The schema version for the tables defined here.  Every time
 # the table metadata changes, this should be incremented.
 schema_version = 2
@@ -83,6 +95,23 @@ class TypeBase(base_model):
             The matched substring, if a successful match was made.
             None if matching failed.
 
+        Raises
+        ------
+        ValueError:
+            The value of `self.patterns` was invalid.
+        """
+        # Loop over patterns and check for matches
+        for pattern in self.pattern_list:
+            result = re.fullmatch(pattern, name)
+            if result:
+                return result[0]
+
+        return None
+
+    @property
+    def pattern_list(self) -> list[str]:
+        """The parsed list of patterns.
+
         Raises
         ------
         ValueError:
@@ -102,13 +131,7 @@ class TypeBase(base_model):
                     f'(Got "{self.patterns}")'
                 )
 
-        # Loop over patterns and check for matches
-        for pattern in self._pattern_list:
-            result = re.fullmatch(pattern, name)
-            if result:
-                return result[0]
-
-        return None
+        return self._pattern_list
 
 
 # These are just differently named copies of TypeBase
@@ -217,48 +240,172 @@ def register_file(
         FileData.create(file=new_file, type=file_type)
 
 
-def detect(
-    path: pathlib.PurePath, node: UpdateableNode
-) -> tuple[pathlib.PurePath | None, ImportCallback | None]:
-    """The primary detection routine for this extension.
+class _Matcher:
+    """Compiled patterns for all the types in a type table.
+
+    Each pattern is compiled on its own.  Runs of consecutive simple patterns
+    (ones with no groups and no global inline flags) are then combined into
+    a single regular expression, with each pattern in its own named group, so
+    that the matching type can be identified from the group which matched.
+    Other patterns are tried individually.
+
+    A type with an invalid pattern is skipped.
 
     Parameters
     ----------
-    path
-        the path to the file being imported.  Relative to `node.db.root`
-    node
-        the node on which the import is happening.  Unused.
+    types : list of AcqType or FileType
+        The types, in the order they should be tried.
+    """
 
-    Returns
-    -------
-    acq_name : pathlib.Path or None
-        If detection succeeded, the name of the acquisition, a parent of
-        `path`.  If detection fails, this is None
-    callback : callable or None
-        If detection succeeded, this is a `functools.partial`-wrapped
-        version of the `register_file()` function.  If detection fails,
-        this is also None.
+    def __init__(self, types: list[TypeBase]) -> None:
+        compiled = []
+        for type_ in types:
+            try:
+                regexes = [re.compile(pattern) for pattern in type_.pattern_list]
+            except (ValueError, re.error) as e:
+                log.warning(f'Ignoring {type(type_).__name__} "{type_.name}": {e}')
+                continue
+            compiled.extend((type_, regex) for regex in regexes)
+
+        # Each entry is a (regex, types) pair.  For a combined regex, `types`
+        # is a dict of types keyed by group name.  Otherwise it's the type.
+        self._entries = []
+        run = []
+        for type_, regex in compiled + [(None, None)]:
+            if regex is not None and self._simple(regex):
+                run.append((type_, regex))
+                continue
+
+            if len(run) == 1:
+                self._entries.append((run[0][1], run[0][0]))
+            elif run:
+                groups = {}
+                alternatives = []
+                for run_type, run_regex in run:
+                    group = f"_type{len(groups)}"
+                    groups[group] = run_type
+                    alternatives.append(f"(?P<{group}>{run_regex.pattern})")
+                self._entries.append((re.compile("|".join(alternatives)), groups))
+            run = []
+
+            if regex is not None:
+                self._entries.append((regex, type_))
+
+    @staticmethod
+    def _simple(regex: re.Pattern) -> bool:
+        """Can `regex` be combined with others?"""
+        return regex.groups == 0 and regex.flags == re.UNICODE
+
+    def match(self, name: str) -> tuple[TypeBase | None, str | None]:
+        """Match `name` against the patterns.
+
+        Returns
+        -------
+        type_ : AcqType or FileType or None
+            The first type with a pattern matching the whole of `name`,
+            or None, if nothing matched
+        match : str or None
+            The matched string, or None if nothing matched.
+        """
+        for regex, types in self._entries:
+            result = regex.fullmatch(name)
+            if result is not None:
+                if isinstance(types, dict):
+                    return types[result.lastgroup], result[0]
+                return types, result[0]
+
+        return None, None
+
+
+class _Patterns:
+    """The compiled patterns from the AcqType and FileType tables.
+
+    The tables are re-checked for changes at most once every `check_interval`
+    seconds, and the patterns recompiled if they've changed.
+
+    Parameters
+    ----------
+    check_interval : float
+        How often, in seconds, to look for changes in the type tables.
+    """
+
+    def __init__(self, check_interval: float = 60) -> None:
+        self._check_interval = check_interval
+        self._lock = threading.Lock()
+        self._last_check = None
+        self._token = None
+
+        self.acq = None
+        self.file = None
+
+        # Caches acq-directory matches.  Keys are directories; values
+        # are (acq_type, acq_name) pairs.
+        self.acq_dirs = DetectCache(maxsize=4096, ttl=3600)
+
+    def refresh(self) -> None:
+        """Recompile the patterns, if the type tables have changed."""
+        with self._lock:
+            now = time.monotonic()
+            if (
+                self._last_check is not None
+                and now - self._last_check < self._check_interval
+            ):
+                return
+            self._last_check = now
+
+            acq_types = list(AcqType.select().order_by(AcqType.id))
+            file_types = list(FileType.select().order_by(FileType.id))
+
+            token = (
+                tuple((type_.id, type_.patterns) for type_ in acq_types),
+                tuple((type_.id, type_.patterns) for type_ in file_types),
+            )
+            if token == self._token:
+                return
+
+            self.acq = _Matcher(acq_types)
+            # When more than one FileType matches, the last one wins, so
+            # try them in reverse order.
+            self.file = _Matcher(file_types[::-1])
+            self.acq_dirs.clear()
+            self._token = token
+
+
+_patterns = _Patterns()
+
+
+def _match_acq(path: pathlib.PurePath) -> tuple[AcqType | None, str | None]:
+    """Find the acquisition containing `path`.
+
+    Tries successive parents of `path`, starting with the closest one, until
+    one matches an AcqType pattern.  The result is cached per directory.
     """
-    # Iterate over all known acquisition types to try and find one that
-    # can handle the acquisition path.  For a given type, each time
-    # matching fails, try successive parent paths until we run out of
-    # directory segments
-    acq_type = None
+    dirname = path.parent
+    try:
+        return _patterns.acq_dirs.get(dirname)
+    except KeyError:
+        pass
+
+    result = None, None
     for name in path.parents:
         if str(name) == ".":
             break  # Out of path elements
 
-        for type_ in AcqType.select():
-            result = type_.check_match(str(name))
-            if result:
-                acq_type = type_
-                acq_name = result
-                break
-
-        # If the inner loop found a match, stop trying path elements
+        acq_type, acq_name = _patterns.acq.match(str(name))
         if acq_type is not None:
+            result = acq_type, acq_name
             break
 
+    _patterns.acq_dirs.put(dirname, result)
+    return result
+
+
+def _detect(
+    path: pathlib.PurePath,
+) -> tuple[pathlib.PurePath | None, ImportCallback | None]:
+    """Detect `path` using the current patterns."""
+    acq_type, acq_name = _match_acq(path)
+
     # If acq type couldn't be found, indicate failure
     if acq_type is None:
         return None, None
@@ -267,10 +414,7 @@ def detect(
     file_name = os.path.relpath(path, acq_name)
 
     # Now figure out the file type
-    file_type = None
-    for type_ in FileType.select():
-        if type_.check_match(file_name):
-            file_type = type_
+    file_type, _ = _patterns.file.match(file_name)
 
     # If file type couldn't be found, indicate failure
     if file_type is None:
@@ -283,6 +427,53 @@ def detect(
     return acq_name, callback
 
 
+def detect(
+    path: pathlib.PurePath, node: UpdateableNode
+) -> tuple[pathlib.PurePath | None, ImportCallback | None]:
+    """The primary detection routine for this extension.
+
+    Parameters
+    ----------
+    path
+        the path to the file being imported.  Relative to `node.db.root`
+    node
+        the node on which the import is happening.  Unused.
+
+    Returns
+    -------
+    acq_name : pathlib.Path or None
+        If detection succeeded, the name of the acquisition, a parent of
+        `path`.  If detection fails, this is None
+    callback : callable or None
+        If detection succeeded, this is a `functools.partial`-wrapped
+        version of the `register_file()` function.  If detection fails,
+        this is also None.
+    """
+    _patterns.refresh()
+    return _detect(path)
+
+
+def detect_many(
+    paths: list[pathlib.PurePath], node: UpdateableNode
+) -> list[tuple[pathlib.PurePath | None, ImportCallback | None]]:
+    """The batched detection routine for this extension.
+
+    Parameters
+    ----------
+    paths
+        the paths to the files being imported.  Relative to `node.db.root`
+    node
+        the node on which the import is happening.  Unused.
+
+    Returns
+    -------
+    list of tuples
+        The results of `detect` for each of the `paths`.
+    """
+    _patterns.refresh()
+    return [_detect(path) for path in paths]
+
+
 def demo_init() -> None:
     """Extension init for alpenhorn demo
 
@@ -344,6 +535,7 @@ def register_extensions() -> list:
             "PatternImporterDetect",
             alpenversion,
             detect=detect,
+            detect_many=detect_many,
             require_schema={"pattern_importer": schema_version},
         ),
     ]
@@ -193,3 +193,41 @@ def test_io_extension_missing():
     """Test a failed load in io_extension()."""
 
     assert extload.io_extension("Missing") is None
+
+
+def test_detect_cache():
+    """Test DetectCache get and put."""
+
+    cache = extload.DetectCache(maxsize=2, ttl=None)
+
+    with pytest.raises(KeyError):
+        cache.get("a")
+
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+
+    # Evicts "b", the least-recently used entry
+    cache.put("c", 3)
+    assert len(cache) == 2
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    with pytest.raises(KeyError):
+        cache.get("b")
+
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_detect_cache_ttl():
+    """Test DetectCache expiry."""
+
+    cache = extload.DetectCache(ttl=10)
+
+    with patch("time.monotonic", return_value=100):
+        cache.put("a", 1)
+    with patch("time.monotonic", return_value=105):
+        assert cache.get("a") == 1
+    with patch("time.monotonic", return_value=111):
+        with pytest.raises(KeyError):
+            cache.get("a")
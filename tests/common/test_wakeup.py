@@ -0,0 +1,42 @@
+"""Test alpenhorn.common.wakeup."""
+
+from alpenhorn.common import wakeup
+
+
+def test_no_socket(set_config):
+    """Without daemon.wakeup_socket, nothing happens."""
+
+    assert wakeup.socket_path() is None
+    assert not wakeup.poke()
+
+
+def test_poke_no_listener(set_config, tmp_path):
+    """Poking without a listener is not an error."""
+
+    set_config["daemon"] = {"wakeup_socket": str(tmp_path / "wakeup.sock")}
+
+    assert not wakeup.poke()
+
+
+def test_listener(set_config, tmp_path):
+    """Test poking a WakeupListener."""
+
+    path = tmp_path / "wakeup.sock"
+    set_config["daemon"] = {"wakeup_socket": str(path)}
+
+    # Create a stale file, which will be replaced
+    path.write_text("stale")
+
+    listener = wakeup.WakeupListener(path)
+
+    # No poke
+    assert not listener.wait(0)
+
+    # Multiple pokes result in a single wake-up
+    assert wakeup.poke()
+    assert wakeup.poke()
+    assert listener.wait(1)
+    assert not listener.wait(0)
+
+    listener.close()
+    assert not path.exists()
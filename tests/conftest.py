@@ -16,6 +16,7 @@ from peewee import SqliteDatabase
 import alpenhorn.common.logger
 from alpenhorn import db
 from alpenhorn.common import config, extload
+from alpenhorn.daemon import update
 from alpenhorn.daemon.scheduler import FairMultiFIFOQueue
 from alpenhorn.daemon.update import UpdateableGroup, UpdateableNode
 from alpenhorn.db import (
@@ -259,10 +260,10 @@ def have_lfs():
 def mock_lfs(have_lfs, request):
     """Mocks methods of alpenhorn.lfs.LFS for testing.
 
-    the mocked hsm_state() method will return values specified in the
-    lfs_hsm_state marker.  Passing a path not specified in the marker returns
-    HSMState.MISSING.  The values in this dict may be updated by calling
-    hms_restore() and hsm_release()
+    the mocked hsm_state() and hsm_state_many() methods will return values
+    specified in the lfs_hsm_state marker.  Passing a path not specified in
+    the marker returns HSMState.MISSING.  The values in this dict may be updated by calling
+    hsm_restore(), hsm_restore_many(), hsm_release() and hsm_release_many()
 
     The mocked quota_remaining() method will retun the value of the
     lfs_quota_remaining marker.  If that marker isn't set, behaves as if
@@ -305,6 +306,15 @@ def mock_lfs(have_lfs, request):
 
         raise ValueError("Bad state in lfs_hsm_state marker: {state} for path {path}")
 
+    def _mocked_lfs_hsm_state_many(self, paths, restoring=True):
+        states = {}
+        for path in paths:
+            state = _mocked_lfs_hsm_state(self, path)
+            if not restoring and state == HSMState.RESTORING:
+                state = HSMState.RELEASED
+            states[str(path)] = state
+        return states
+
     def _mocked_lfs_hsm_restore(self, path):
         nonlocal request, lfs_hsm_state
 
@@ -355,6 +365,12 @@ def mock_lfs(have_lfs, request):
         # Missing, unarchived, or restoring
         return False
 
+    def _mocked_lfs_hsm_restore_many(self, paths):
+        return {str(path): _mocked_lfs_hsm_restore(self, path) for path in paths}
+
+    def _mocked_lfs_hsm_release_many(self, paths):
+        return {str(path): _mocked_lfs_hsm_release(self, path) for path in paths}
+
     marker = request.node.get_closest_marker("lfs_quota_remaining")
     if marker is None:
         lfs_quota = None
@@ -368,14 +384,30 @@ def mock_lfs(have_lfs, request):
     patches = []
     if "hsm_state" not in lfs_dont_mock:
         patches.append(patch("alpenhorn.io._lfs.LFS.hsm_state", _mocked_lfs_hsm_state))
+    if "hsm_state_many" not in lfs_dont_mock:
+        patches.append(
+            patch("alpenhorn.io._lfs.LFS.hsm_state_many", _mocked_lfs_hsm_state_many)
+        )
     if "hsm_release" not in lfs_dont_mock:
         patches.append(
             patch("alpenhorn.io._lfs.LFS.hsm_release", _mocked_lfs_hsm_release),
         )
+    if "hsm_release_many" not in lfs_dont_mock:
+        patches.append(
+            patch(
+                "alpenhorn.io._lfs.LFS.hsm_release_many", _mocked_lfs_hsm_release_many
+            ),
+        )
     if "hsm_restore" not in lfs_dont_mock:
         patches.append(
             patch("alpenhorn.io._lfs.LFS.hsm_restore", _mocked_lfs_hsm_restore),
         )
+    if "hsm_restore_many" not in lfs_dont_mock:
+        patches.append(
+            patch(
+                "alpenhorn.io._lfs.LFS.hsm_restore_many", _mocked_lfs_hsm_restore_many
+            ),
+        )
     if "quota_remaining" not in lfs_dont_mock:
         patches.append(
             patch("alpenhorn.io._lfs.LFS.quota_remaining", _mocked_lfs_quota_remaining),
@@ -587,6 +619,9 @@ def dbproxy(set_config, reset_extensions):
 
     db.close()
 
+    # Forget cached RemoteNodes, since they refer to records in this database
+    update._remote_nodes.clear()
+
 
 @pytest.fixture
 def dbtables(dbproxy):
@@ -1,11 +1,19 @@
 """FairMultiFIFOQueue tests."""
 
 import threading
-from time import time
+from time import sleep, time
 from unittest.mock import MagicMock, patch
 
 import pytest
 
+from alpenhorn.daemon.scheduler import (
+    PRIORITY_IDLE,
+    PRIORITY_IMPORT,
+    PRIORITY_PULL,
+    FairMultiFIFOQueue,
+)
+from alpenhorn.daemon.scheduler.queue import PRIORITY_NAMES
+
 
 @pytest.fixture
 def clean_queue(queue):
@@ -330,3 +338,223 @@ def test_clear_deferred(clean_queue):
 
     assert clean_queue.qsize == 0
     assert clean_queue.deferred_size == 0
+
+
+def test_priority_bad(clean_queue):
+    """put() rejects unknown priority classes."""
+
+    with pytest.raises(ValueError):
+        clean_queue.put(1, "fifo", priority=-1)
+    with pytest.raises(ValueError):
+        clean_queue.put(1, "fifo", priority=len(PRIORITY_NAMES))
+
+    assert clean_queue.qsize == 0
+
+
+def test_priority_fifo(clean_queue):
+    """Higher priority items come out of a FIFO first."""
+
+    clean_queue.put(1, "fifo", priority=PRIORITY_IDLE)
+    clean_queue.put(2, "fifo")
+    clean_queue.put(3, "fifo", priority=PRIORITY_IMPORT)
+    clean_queue.put(4, "fifo", priority=PRIORITY_PULL)
+    clean_queue.put(5, "fifo", priority=PRIORITY_IMPORT)
+
+    items = []
+    while clean_queue.qsize:
+        item, key = clean_queue.get()
+        items.append(item)
+        clean_queue.task_done(key)
+
+    assert items == [4, 3, 5, 2, 1]
+
+
+def test_priority_fair(clean_queue):
+    """Priority trumps fairness when choosing FIFOs."""
+
+    clean_queue.put(1, "fifo1")
+    clean_queue.put(2, "fifo1", priority=PRIORITY_PULL)
+    clean_queue.put(3, "fifo2")
+
+    # Both FIFOs are idle, but fifo1 has a pull
+    assert clean_queue.get() == (2, "fifo1")
+
+    # Now fifo1 is busy and both FIFOs offer the same
+    # priority, so fairness picks fifo2
+    assert clean_queue.get() == (3, "fifo2")
+    clean_queue.task_done("fifo2")
+
+    # Now fifo1 is still busy, but fifo2 offers a lower priority item
+    clean_queue.put(4, "fifo2", priority=PRIORITY_IDLE)
+    assert clean_queue.get() == (1, "fifo1")
+    assert clean_queue.get() == (4, "fifo2")
+
+    clean_queue.task_done("fifo1")
+    clean_queue.task_done("fifo1")
+    clean_queue.task_done("fifo2")
+
+
+def test_priority_exclusive(clean_queue):
+    """A high-priority exclusive item blocks its FIFO while it's busy."""
+
+    clean_queue.put(1, "fifo")
+    assert clean_queue.get() == (1, "fifo")
+
+    clean_queue.put(2, "fifo")
+    clean_queue.put(3, "fifo", exclusive=True, priority=PRIORITY_PULL)
+
+    # Nothing available: the exclusive item is next
+    assert clean_queue.get(timeout=0.1) is None
+
+    clean_queue.task_done("fifo")
+
+    assert clean_queue.get() == (3, "fifo")
+    clean_queue.task_done("fifo")
+    assert clean_queue.get() == (2, "fifo")
+    clean_queue.task_done("fifo")
+
+
+def test_priority_starvation():
+    """Starving items are promoted."""
+
+    queue = FairMultiFIFOQueue(starvation_time=0.1)
+
+    queue.put(1, "fifo", priority=PRIORITY_IDLE)
+    queue.put(2, "fifo", priority=PRIORITY_IMPORT)
+    sleep(0.15)
+    queue.put(3, "fifo", priority=PRIORITY_PULL)
+
+    # The import and idle items have both been waiting long enough to be
+    # promoted ahead of the pull.
+    items = []
+    while queue.qsize:
+        item, key = queue.get()
+        items.append(item)
+        queue.task_done(key)
+
+    assert items == [2, 1, 3]
+
+
+def test_priority_starvation_fifos():
+    """A starving item beats a fresher higher-priority item in another FIFO."""
+
+    queue = FairMultiFIFOQueue(starvation_time=0.1)
+
+    queue.put(1, "fifo1", priority=PRIORITY_IDLE)
+    sleep(0.15)
+    queue.put(2, "fifo2")
+
+    assert queue.get() == (1, "fifo1")
+    assert queue.get() == (2, "fifo2")
+    queue.task_done("fifo1")
+    queue.task_done("fifo2")
+
+
+def test_priority_index(clean_queue):
+    """Only non-empty FIFOs are in the head index."""
+
+    for fifo in range(100):
+        clean_queue.put(fifo, fifo)
+        assert clean_queue.get() == (fifo, fifo)
+        clean_queue.task_done(fifo)
+
+    clean_queue.put("a", "fifoA", priority=PRIORITY_IMPORT)
+    clean_queue.put("b", "fifoB", priority=PRIORITY_IDLE)
+
+    assert [sum(len(keys) for keys in by_count) for by_count in clean_queue._heads] == [
+        0,
+        1,
+        0,
+        1,
+    ]
+
+    assert clean_queue.get() == ("a", "fifoA")
+    assert clean_queue.get() == ("b", "fifoB")
+    assert not any(keys for by_count in clean_queue._heads for keys in by_count)
+    clean_queue.task_done("fifoA")
+    clean_queue.task_done("fifoB")
+
+
+def test_limit_inprogress(clean_queue):
+    """Test per-FIFO in-progress limits."""
+
+    clean_queue.set_fifo_limits("fifo1", max_inprogress=1)
+
+    clean_queue.put(1, "fifo1")
+    clean_queue.put(2, "fifo1")
+    clean_queue.put(3, "fifo2")
+    clean_queue.put(4, "fifo2")
+
+    assert clean_queue.get() == (1, "fifo1")
+    assert clean_queue.get() == (3, "fifo2")
+
+    # fifo1 is at its limit
+    assert clean_queue.get() == (4, "fifo2")
+    assert clean_queue.get(timeout=0.1) is None
+
+    clean_queue.task_done("fifo1")
+    assert clean_queue.get() == (2, "fifo1")
+
+    # Remove the limit
+    clean_queue.set_fifo_limits("fifo1")
+    clean_queue.put(5, "fifo1")
+    assert clean_queue.get() == (5, "fifo1")
+
+    clean_queue.task_done("fifo1")
+    clean_queue.task_done("fifo1")
+    clean_queue.task_done("fifo2")
+    clean_queue.task_done("fifo2")
+
+
+def test_limit_inprogress_wake(clean_queue):
+    """Finishing a task wakes a getter blocked by a limit."""
+
+    clean_queue.set_fifo_limits("fifo", max_inprogress=1)
+    clean_queue.put(1, "fifo")
+    clean_queue.put(2, "fifo")
+    assert clean_queue.get() == (1, "fifo")
+
+    def _task_done():
+        sleep(0.1)
+        clean_queue.task_done("fifo")
+
+    thread = threading.Thread(target=_task_done, daemon=True)
+    thread.start()
+
+    # Much sooner than the 10 second get period
+    start = time()
+    assert clean_queue.get(timeout=5) == (2, "fifo")
+    assert time() - start < 1
+
+    thread.join()
+    clean_queue.task_done("fifo")
+
+
+def test_limit_rate(clean_queue):
+    """Test per-FIFO byte-rate budgets."""
+
+    # 100 kB/s
+    clean_queue.set_fifo_limits("fifo", max_rate=100000)
+
+    # The first item uses up a tenth of a second of budget more than
+    # is available.
+    clean_queue.put(1, "fifo", io_bytes=110000)
+    clean_queue.put(2, "fifo", io_bytes=1000)
+
+    assert clean_queue.get() == (1, "fifo")
+    start = time()
+    assert clean_queue.get(timeout=0.01) is None
+    assert clean_queue.get() == (2, "fifo")
+    assert time() - start >= 0.09
+
+    clean_queue.task_done("fifo")
+    clean_queue.task_done("fifo")
+
+
+def test_limit_bad(clean_queue):
+    """Bad limits are rejected."""
+
+    with pytest.raises(ValueError):
+        clean_queue.set_fifo_limits("fifo", max_inprogress=0)
+    with pytest.raises(ValueError):
+        clean_queue.set_fifo_limits("fifo", max_rate=0)
@@ -4,6 +4,7 @@ from unittest.mock import patch
 
 import peewee as pw
 
+from alpenhorn.daemon.scheduler.queue import PRIORITY_PULL
 from alpenhorn.daemon.scheduler.task import Task
 
 
@@ -326,3 +327,32 @@ def test_db_check(queue):
 
     # Check results.  Everything should be True
     assert results == [True] * len(results)
+
+
+def test_priority(queue):
+    """Task priority is used when queueing and requeueing."""
+
+    def _task(task):
+        task.requeue()
+        yield
+
+    Task(_task, queue, "fifo", name="normal")
+    Task(_task, queue, "fifo", requeue=True, priority=PRIORITY_PULL)
+
+    # The pull task is retrieved first, despite being put second
+    task, key = queue.get()
+    assert str(task) == "Task"
+
+    # Running it requeues a copy and re-puts the generator, both at
+    # the same priority.
+    task()
+    queue.task_done(key)
+
+    for _ in range(2):
+        task, key = queue.get()
+        assert str(task) == "Task"
+        queue.task_done(key)
+
+    task, key = queue.get()
+    assert str(task) == "normal"
+    queue.task_done(key)
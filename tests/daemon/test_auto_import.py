@@ -2,7 +2,7 @@
 
 import datetime
 import pathlib
-from unittest.mock import call, patch
+from unittest.mock import MagicMock, call, patch
 
 import peewee as pw
 import pytest
@@ -509,7 +509,7 @@ def test_update_observers_force_stop(xfs, dbtables, unode, queue):
     auto_import.stop_observers()
 
 
-@patch("alpenhorn.daemon.auto_import.import_file")
+@patch("alpenhorn.daemon.auto_import.import_batch")
 def test_scan_new(mocked_import, xfs, dbtables, unode, queue):
     """Test auto_import.scan with new files."""
 
@@ -519,16 +519,39 @@ def test_scan_new(mocked_import, xfs, dbtables, unode, queue):
     xfs.create_file("/node/acq2/file1")
 
     auto_import.scan(None, unode, queue, ".", True, None)
-    mocked_import.assert_has_calls(
-        [
-            call(unode, queue, pathlib.PurePath("acq1/file1"), True, None),
-            call(unode, queue, pathlib.PurePath("acq1/file2"), True, None),
-            call(unode, queue, pathlib.PurePath("acq2/file1"), True, None),
-        ],
-    )
+
+    assert len(mocked_import.mock_calls) == 1
+    args = mocked_import.mock_calls[0].args
+    assert args[:2] == (unode, queue)
+    assert sorted(args[2]) == [
+        pathlib.PurePath("acq1/file1"),
+        pathlib.PurePath("acq1/file2"),
+        pathlib.PurePath("acq2/file1"),
+    ]
+    assert args[3] is True
 
 
+@pytest.mark.alpenhorn_config({"daemon": {"import_batch_size": 2}})
 @patch("alpenhorn.daemon.auto_import.import_file")
+@patch("alpenhorn.daemon.auto_import.import_batch")
+def test_scan_batch_size(mocked_batch, mocked_import, xfs, dbtables, unode, queue):
+    """Test auto_import.scan splits new files into batches."""
+
+    unode.io.walk_threads = 1
+
+    xfs.create_file("/node/acq/file1")
+    xfs.create_file("/node/acq/file2")
+    xfs.create_file("/node/acq/file3")
+
+    auto_import.scan(None, unode, queue, ".", True, None)
+
+    # Two files in a batch, the last one imported on its own
+    assert len(mocked_batch.mock_calls) == 1
+    assert len(mocked_batch.mock_calls[0].args[2]) == 2
+    assert len(mocked_import.mock_calls) == 1
+
+
+@patch("alpenhorn.daemon.auto_import.import_batch")
 def test_scan_exists(
     mocked_import,
     xfs,
@@ -565,9 +588,16 @@ def test_scan_exists(
 
     # Only files4 through 6 should be imported
     assert mocked_import.mock_calls == [
-        call(unode, queue, pathlib.PurePath("simpleacq/file4"), True, None),
-        call(unode, queue, pathlib.PurePath("simpleacq/file5"), True, None),
-        call(unode, queue, pathlib.PurePath("simpleacq/file6"), True, None),
+        call(
+            unode,
+            queue,
+            [
+                pathlib.PurePath("simpleacq/file4"),
+                pathlib.PurePath("simpleacq/file5"),
+                pathlib.PurePath("simpleacq/file6"),
+            ],
+            True,
+        ),
     ]
 
 
@@ -587,5 +617,338 @@ def test_scan_file(
 
     # File is imported
     assert mocked_import.mock_calls == [
-        call(unode, queue, pathlib.Path("simpleacq/file1"), True, None),
+        call(unode, queue, pathlib.Path("simpleacq/file1"), True, None, is_file=True),
+    ]
+
+
+def _run_tasks(queue):
+    """Run all the tasks in the queue."""
+    while queue.qsize:
+        task, key = queue.get()
+        task()
+        queue.task_done(key)
+
+
+def test_import_batch(xfs, dbtables, unode, queue, patch_import_detect):
+    """Test a batched import creating acqs, files and copies."""
+
+    xfs.create_file("/node/acq/file1", contents="1")
+    xfs.create_file("/node/acq/file2", contents="22")
+    xfs.create_file("/node/acq/.file3")
+
+    callback_args = []
+
+    def callback(copy, file_, acq, node):
+        callback_args.append([copy, file_, acq, node])
+
+    paths = [
+        pathlib.PurePath("acq/file1"),
+        pathlib.PurePath("acq/file2"),
+        pathlib.PurePath("acq/.file3"),
+    ]
+    with patch_import_detect("acq", callback):
+        auto_import.import_batch(unode, queue, paths, True)
+        _run_tasks(queue)
+
+    acq = ArchiveAcq.get(name="acq")
+    file1 = ArchiveFile.get(name="file1", acq=acq)
+    file2 = ArchiveFile.get(name="file2", acq=acq)
+    assert file1.size_b == 1
+    assert file2.md5sum == "b6d767d2f8ed5d21a44b0e5886680cb9"
+    assert ArchiveFile.select().count() == 2
+
+    copy1 = ArchiveFileCopy.get(file=file1, node=unode.db)
+    copy2 = ArchiveFileCopy.get(file=file2, node=unode.db)
+    assert copy1.has_file == "Y"
+    assert copy1.ready
+
+    # The new acq is only reported once
+    assert callback_args == [
+        [copy1, file1, acq, unode],
+        [copy2, file2, None, unode],
+    ]
+
+
+def test_import_batch_race(xfs, dbtables, unode, queue, patch_import_detect):
+    """Records created by someone else during a batched import aren't new."""
+
+    xfs.create_file("/node/acq/file1", contents="1")
+    xfs.create_file("/node/acq/file2", contents="22")
+
+    callback_args = []
+
+    def callback(copy, file_, acq, node):
+        callback_args.append([copy, file_, acq, node])
+
+    # Someone else creates the acq, and then file2, just before we do
+    insert_new = auto_import._insert_new
+
+    def racing_insert_new(model, rows):
+        if model is ArchiveAcq:
+            ArchiveAcq.create(name="acq")
+        elif model is ArchiveFile:
+            ArchiveFile.create(
+                acq=ArchiveAcq.get(name="acq"),
+                name="file2",
+                size_b=2,
+                md5sum="b6d767d2f8ed5d21a44b0e5886680cb9",
+            )
+        return insert_new(model, rows)
+
+    paths = [pathlib.PurePath("acq/file1"), pathlib.PurePath("acq/file2")]
+    with (
+        patch_import_detect("acq", callback),
+        patch("alpenhorn.daemon.auto_import._insert_new", racing_insert_new),
+    ):
+        auto_import.import_batch(unode, queue, paths, True)
+        _run_tasks(queue)
+
+    acq = ArchiveAcq.get(name="acq")
+    file1 = ArchiveFile.get(name="file1", acq=acq)
+    file2 = ArchiveFile.get(name="file2", acq=acq)
+    assert ArchiveFile.select().count() == 2
+
+    # Only file1 was created by the import
+    assert callback_args == [
+        [ArchiveFileCopy.get(file=file1, node=unode.db), file1, None, unode],
+        [ArchiveFileCopy.get(file=file2, node=unode.db), None, None, unode],
     ]
+
+
+def test_import_batch_existing(
+    xfs,
+    dbtables,
+    unode,
+    queue,
+    simpleacq,
+    archivefile,
+    archivefilecopy,
+    patch_import_detect,
+):
+    """Test a batched import of registered files."""
+
+    af1 = archivefile(name="file1", acq=simpleacq)
+    af2 = archivefile(name="file2", acq=simpleacq)
+    af3 = archivefile(name="file3", acq=simpleacq)
+    archivefilecopy(node=unode.db, file=af1, has_file="N", wants_file="Y")
+    archivefilecopy(node=unode.db, file=af2, has_file="N", wants_file="N")
+    archivefilecopy(node=unode.db, file=af3, has_file="Y", wants_file="Y")
+
+    for name in ["file1", "file2", "file3", "file4"]:
+        xfs.create_file("/node/simpleacq/" + name)
+
+    paths = [
+        pathlib.PurePath("simpleacq/" + name)
+        for name in ["file1", "file2", "file3", "file4"]
+    ]
+    with patch_import_detect("simpleacq", None):
+        auto_import.import_batch(unode, queue, paths, False)
+        _run_tasks(queue)
+
+    # Missing file is now suspect
+    copy = ArchiveFileCopy.get(file=af1, node=unode.db)
+    assert copy.has_file == "M"
+    assert copy.wants_file == "Y"
+
+    # Removed file is back
+    copy = ArchiveFileCopy.get(file=af2, node=unode.db)
+    assert copy.has_file == "Y"
+    assert copy.wants_file == "Y"
+
+    # Unregistered file wasn't registered
+    assert ArchiveFile.select().count() == 3
+
+
+def test_import_copies_race(
+    xfs, dbtables, unode, simpleacq, archivefile, archivefilecopy
+):
+    """Copies created by another worker don't get post-import processing."""
+
+    af1 = archivefile(name="file1", acq=simpleacq)
+    af2 = archivefile(name="file2", acq=simpleacq)
+
+    def storage_used(path):
+        # Another worker creates the second copy while we're working
+        if path == "simpleacq/file2":
+            archivefilecopy(node=unode.db, file=af2, has_file="Y", wants_file="Y")
+        return 1
+
+    callback = MagicMock()
+    items = [
+        ("simpleacq/file1", af1, af1, None, callback),
+        ("simpleacq/file2", af2, af2, None, callback),
+    ]
+    with patch.object(unode.io, "storage_used", storage_used):
+        auto_import._import_copies(unode, items)
+
+    # Both copies exist, but only one is ours
+    assert ArchiveFileCopy.select().count() == 2
+    callback.assert_called_once()
+    assert callback.call_args.args[0].file == af1
+
+
+def test_detect_many(dbtables, unode):
+    """Test detection with a mix of detect and detect_many extensions."""
+    from alpenhorn.extensions import ImportDetectExtension
+
+    batches = []
+
+    def detect_many(paths, node):
+        batches.append(list(paths))
+        return [("acq2", None) if path.name == "b" else (None, None) for path in paths]
+
+    extensions = [
+        ImportDetectExtension(
+            "Test1",
+            "0",
+            detect=lambda path, node: (
+                ("acq1", None) if path.name == "a" else (None, None)
+            ),
+        ),
+        ImportDetectExtension(
+            "Test2",
+            "0",
+            detect=lambda path, node: (None, None),
+            detect_many=detect_many,
+        ),
+    ]
+    for ext in extensions:
+        ext.full_name = ext.name
+
+    paths = [
+        pathlib.PurePath("acq1/a"),
+        pathlib.PurePath("acq2/b"),
+        pathlib.PurePath("acq3/c"),
+    ]
+    with patch("alpenhorn.common.extload._id_ext", extensions):
+        results = auto_import._detect_many(unode, paths)
+
+    assert results == [
+        ("acq1", None, None),
+        ("acq2", None, None),
+        (None, None, "no detection"),
+    ]
+
+    # Only undetected paths were passed on
+    assert batches == [paths[1:]]
+
+
+def test_detect_many_bad_length(dbtables, unode, caplog):
+    """A detect_many returning the wrong number of results is skipped."""
+    from alpenhorn.extensions import ImportDetectExtension
+
+    extensions = [
+        ImportDetectExtension(
+            "Bad",
+            "0",
+            detect=lambda path, node: (None, None),
+            detect_many=lambda paths, node: [("bad", None)],
+        ),
+        ImportDetectExtension(
+            "Good",
+            "0",
+            detect=lambda path, node: (path.parts[0], None),
+        ),
+    ]
+    for ext in extensions:
+        ext.full_name = ext.name
+
+    paths = [pathlib.PurePath("acq1/a"), pathlib.PurePath("acq2/b")]
+    with patch("alpenhorn.common.extload._id_ext", extensions):
+        results = auto_import._detect_many(unode, paths)
+
+    assert results == [("acq1", None, None), ("acq2", None, None)]
+    assert 'Ignoring import detect extension "Bad"' in caplog.text
+
+
+@pytest.mark.alpenhorn_config({"daemon": {"auto_import_quiet_period": 0}})
+@patch("alpenhorn.daemon.auto_import._import_found")
+def test_register_file_immediate(mocked_import, xfs, dbtables, unode, queue):
+    """Test RegisterFile with no quiet period imports on creation."""
+
+    from watchdog.events import FileCreatedEvent
+
+    xfs.create_file("/node/acq/file")
+    xfs.create_file("/node/acq/.dotfile")
+
+    handler = auto_import.RegisterFile(unode, queue)
+    handler.on_created(FileCreatedEvent("/node/acq/.dotfile"))
+    handler.on_created(FileCreatedEvent("/node/acq/file"))
+
+    mocked_import.assert_called_once_with(
+        unode, queue, [pathlib.PurePath("acq/file")], True
+    )
+    handler.stop()
+
+
+@pytest.mark.alpenhorn_config({"daemon": {"auto_import_quiet_period": 600}})
+@patch("alpenhorn.daemon.auto_import._import_found")
+def test_register_file_coalesce(mocked_import, xfs, dbtables, unode, queue):
+    """Test RegisterFile coalesces events."""
+
+    from watchdog.events import (
+        FileCreatedEvent,
+        FileDeletedEvent,
+        FileModifiedEvent,
+        FileMovedEvent,
+    )
+
+    xfs.create_file("/node/acq/file1")
+    xfs.create_file("/node/acq/file2")
+    xfs.create_file("/node/acq/file3")
+
+    handler = auto_import.RegisterFile(unode, queue)
+
+    # Repeated events for file1
+    handler.on_created(FileCreatedEvent("/node/acq/file1"))
+    handler.on_modified(FileModifiedEvent("/node/acq/file1"))
+    handler.on_modified(FileModifiedEvent("/node/acq/file1"))
+
+    # Modification of a file not pending is ignored
+    handler.on_modified(FileModifiedEvent("/node/acq/file3"))
+
+    # A temporary file renamed to file2
+    handler.on_created(FileCreatedEvent("/node/acq/tmp"))
+    handler.on_moved(FileMovedEvent("/node/acq/tmp", "/node/acq/file2"))
+
+    # A file which was deleted
+    handler.on_created(FileCreatedEvent("/node/acq/gone"))
+    handler.on_deleted(FileDeletedEvent("/node/acq/gone"))
+
+    # Nothing is quiet yet
+    handler.flush()
+    mocked_import.assert_not_called()
+
+    handler.flush(force=True)
+    mocked_import.assert_called_once()
+    args = mocked_import.mock_calls[0].args
+    assert sorted(args[2]) == [
+        pathlib.PurePath("acq/file1"),
+        pathlib.PurePath("acq/file2"),
+    ]
+    handler.stop()
+
+
+@pytest.mark.alpenhorn_config({"daemon": {"auto_import_quiet_period": 600}})
+@patch("alpenhorn.daemon.auto_import._import_found")
+def test_register_file_locked(mocked_import, xfs, dbtables, unode, queue):
+    """Test RegisterFile defers locked files until the lock is deleted."""
+
+    from watchdog.events import FileCreatedEvent, FileDeletedEvent
+
+    xfs.create_file("/node/acq/file")
+    xfs.create_file("/node/acq/.file.lock")
+
+    handler = auto_import.RegisterFile(unode, queue)
+    handler.on_created(FileCreatedEvent("/node/acq/file"))
+    handler.flush(force=True)
+    mocked_import.assert_not_called()
+
+    # Delete the lock
+    xfs.remove("/node/acq/.file.lock")
+    handler.on_deleted(FileDeletedEvent("/node/acq/.file.lock"))
+    handler.flush(force=True)
+    mocked_import.assert_called_once_with(
+        unode, queue, [pathlib.PurePath("acq/file")], True
+    )
+    handler.stop()
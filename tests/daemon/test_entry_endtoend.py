@@ -280,7 +280,7 @@ def mock_rsync(xfs):
 
         return original_which(cmd, mode, path)
 
-    def _mocked_rsync(from_path, to_dir, size_b, local):
+    def _mocked_rsync(from_path, to_dir, size_b, local, partial=None):
         """A default.pull.rsync mock."""
 
         nonlocal xfs
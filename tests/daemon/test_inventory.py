@@ -0,0 +1,135 @@
+"""Test FileInventory"""
+
+import datetime
+import pathlib
+import time
+from unittest.mock import patch
+
+import peewee as pw
+
+from alpenhorn.daemon.inventory import FileInventory
+from alpenhorn.db import ArchiveFileCopy
+
+
+def test_inventory(simplenode, simpleacq, archiveacq, archivefile, archivefilecopy):
+    """Test populating and querying a FileInventory."""
+
+    acq2 = archiveacq(name="acq/two")
+    files = {
+        name: archivefile(name=name, acq=simpleacq)
+        for name in ["fileY", "fileM", "fileX", "fileN"]
+    }
+    files["sub/file"] = archivefile(name="sub/file", acq=acq2)
+
+    for name, file in files.items():
+        has_file = name[-1] if name != "sub/file" else "Y"
+        archivefilecopy(file=file, node=simplenode, has_file=has_file)
+
+    inv = FileInventory(simplenode.id, simplenode.name)
+    assert len(inv) == 0
+
+    inv.refresh()
+    assert len(inv) == 4
+
+    assert pathlib.PurePath(simpleacq.name, "fileY") in inv
+    assert pathlib.PurePath(simpleacq.name, "fileM") in inv
+    assert pathlib.PurePath(simpleacq.name, "fileX") in inv
+    assert pathlib.PurePath(simpleacq.name, "fileN") not in inv
+    assert "acq/two/sub/file" in inv
+    assert "acq/two/file" not in inv
+    assert "acq" not in inv
+
+
+def test_inventory_incremental(simplenode, simplefile, archivefilecopy):
+    """Test incremental inventory refresh."""
+
+    copy = archivefilecopy(file=simplefile, node=simplenode, has_file="N")
+
+    inv = FileInventory(simplenode.id, simplenode.name)
+    inv.refresh()
+    assert simplefile.path not in inv
+
+    # Now present
+    copy.has_file = "Y"
+    copy.last_update = pw.utcnow()
+    copy.save()
+
+    # Not yet refreshed
+    inv.refresh(max_age=1000)
+    assert simplefile.path not in inv
+
+    inv.refresh()
+    assert simplefile.path in inv
+
+    # Removed
+    ArchiveFileCopy.update(has_file="N", last_update=pw.utcnow()).execute()
+    inv.refresh()
+    assert simplefile.path not in inv
+
+
+def test_inventory_rebuild(simplenode, simplefile, archivefilecopy):
+    """Updates missing last_update are found via a rebuild."""
+
+    archivefilecopy(
+        file=simplefile,
+        node=simplenode,
+        has_file="Y",
+        last_update=datetime.datetime(2000, 1, 1),
+    )
+
+    inv = FileInventory(simplenode.id, simplenode.name)
+    inv.refresh()
+    assert simplefile.path in inv
+
+    # Bypass last_update
+    ArchiveFileCopy.update(has_file="N").execute()
+    inv.refresh()
+    assert simplefile.path not in inv
+
+
+def test_inventory_rebuild_same_count(
+    simplenode, simpleacq, archiveacq, archivefile, archivefilecopy
+):
+    """Changes without last_update which keep the total count are found."""
+
+    old = datetime.datetime(1990, 1, 1)
+    acq2 = archiveacq(name="acq2")
+    file1 = archivefile(name="file1", acq=simpleacq)
+    file2 = archivefile(name="file2", acq=acq2)
+    archivefilecopy(file=file1, node=simplenode, has_file="Y", last_update=old)
+    archivefilecopy(file=file2, node=simplenode, has_file="N", last_update=old)
+
+    # A newer copy, so the older ones aren't re-fetched by incremental refreshes
+    archivefilecopy(
+        file=archivefile(name="file4", acq=simpleacq),
+        node=simplenode,
+        has_file="Y",
+        last_update=datetime.datetime(2000, 1, 1),
+    )
+
+    inv = FileInventory(simplenode.id, simplenode.name)
+    inv.refresh()
+    assert file1.path in inv
+    assert file2.path not in inv
+
+    # Swap the files, bypassing last_update
+    ArchiveFileCopy.update(has_file="N").where(ArchiveFileCopy.file == file1).execute()
+    ArchiveFileCopy.update(has_file="Y").where(ArchiveFileCopy.file == file2).execute()
+    inv.refresh()
+    assert file1.path not in inv
+    assert file2.path in inv
+
+    # Swapping files in the same acq is only found by the periodic rebuild
+    file3 = archivefile(name="file3", acq=acq2)
+    archivefilecopy(file=file3, node=simplenode, has_file="N", last_update=old)
+    inv.refresh()
+    ArchiveFileCopy.update(has_file="N").where(ArchiveFileCopy.file == file2).execute()
+    ArchiveFileCopy.update(has_file="Y").where(ArchiveFileCopy.file == file3).execute()
+
+    inv.refresh()
+    assert file2.path in inv
+
+    with patch("time.monotonic", return_value=time.monotonic() + 3600):
+        inv.refresh()
+    assert file2.path not in inv
+    assert file3.path in inv
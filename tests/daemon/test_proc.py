@@ -1,5 +1,13 @@
 """alpenhorn.daemon.proc tests."""
 
+import multiprocessing
+import os
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
 from alpenhorn.daemon import proc
 
 
@@ -48,3 +56,150 @@ def test_md5sum_file(tmp_path):
 
     file.write_text("The quick brown fox jumps over the lazy dog")
     assert proc.md5sum_file(file) == "9e107d9d372bb6826bd81d3542a419d6"
+
+
+@pytest.mark.alpenhorn_config({"daemon": {"hash_block_size": 4}})
+def test_md5sum_file_blocks(tmp_path, set_config):
+    """Test proc.md5sum_file with a small read size"""
+
+    file = tmp_path.joinpath("tmp")
+    file.write_text("The quick brown fox jumps over the lazy dog")
+    assert proc.md5sum_file(file) == "9e107d9d372bb6826bd81d3542a419d6"
+
+
+@pytest.fixture
+def hash_pool():
+    """Shuts down the hash pool after the test."""
+
+    yield
+    if proc._hash_pool is not None:
+        proc._hash_pool.close()
+        proc._hash_pool = None
+
+
+@pytest.mark.alpenhorn_config({"daemon": {"hash_engine": "process"}})
+def test_md5sum_file_process(tmp_path, set_config, hash_pool):
+    """Test proc.md5sum_file with the process engine"""
+
+    file = tmp_path.joinpath("tmp")
+    file.write_text("The quick brown fox jumps over the lazy dog")
+    assert proc.md5sum_file(file) == "9e107d9d372bb6826bd81d3542a419d6"
+
+    # Errors are passed through
+    with pytest.raises(FileNotFoundError):
+        proc.md5sum_file(tmp_path.joinpath("missing"))
+
+    # The worker survives
+    assert proc.md5sum_file(file) == "9e107d9d372bb6826bd81d3542a419d6"
+
+
+@pytest.mark.alpenhorn_config(
+    {"daemon": {"hash_engine": "process", "hash_processes": 2}}
+)
+def test_md5sum_file_process_hung(tmp_path, set_config, hash_pool):
+    """Only a hung worker is killed on timeout"""
+
+    file = tmp_path.joinpath("tmp")
+    file.write_text("The quick brown fox jumps over the lazy dog")
+
+    # Reading a FIFO with no writer blocks forever
+    fifo = tmp_path.joinpath("fifo")
+    os.mkfifo(fifo)
+
+    results = []
+    with patch("alpenhorn.daemon.proc._MD5_TIMEOUT", 2):
+        thread = threading.Thread(target=lambda: results.append(proc.md5sum_file(fifo)))
+        thread.start()
+
+        # Meanwhile, the other worker carries on
+        assert proc.md5sum_file(file) == "9e107d9d372bb6826bd81d3542a419d6"
+        thread.join()
+
+    assert results == [None]
+
+    # One worker was killed; the other is still running
+    workers = list(proc._hash_pool._free.queue)
+    assert workers.count(None) == 1
+    assert [worker.alive for worker in workers if worker is not None] == [True]
+
+    # The killed worker is replaced when needed
+    assert proc.md5sum_file(file) == "9e107d9d372bb6826bd81d3542a419d6"
+
+
+def test_hash_worker_progress():
+    """The timeout applies to each chunk, not the whole file"""
+
+    # A stand-in for the worker process, which hashes five chunks slowly
+    worker = proc._HashWorker.__new__(proc._HashWorker)
+    worker._conn, child_conn = multiprocessing.Pipe()
+
+    def _work():
+        child_conn.recv()
+        for _ in range(5):
+            time.sleep(0.4)
+            child_conn.send(("progress", None))
+        child_conn.send(("done", "md5"))
+
+    thread = threading.Thread(target=_work)
+    thread.start()
+    with patch("alpenhorn.daemon.proc._MD5_TIMEOUT", 1):
+        assert worker.md5sum("file", 4, False) == "md5"
+    thread.join()
+
+    # But a stalled worker times out
+    child_conn.send(("progress", None))
+    with patch("alpenhorn.daemon.proc._MD5_TIMEOUT", 0.5):
+        with pytest.raises(TimeoutError):
+            worker.md5sum("file", 4, False)
+
+
+@pytest.mark.alpenhorn_config(
+    {"daemon": {"hash_engine": "process", "hash_processes": 1}}
+)
+def test_md5sum_file_process_died(tmp_path, set_config, hash_pool):
+    """A hash is retried if its worker dies"""
+
+    file = tmp_path.joinpath("tmp")
+    file.write_text("The quick brown fox jumps over the lazy dog")
+    assert proc.md5sum_file(file) == "9e107d9d372bb6826bd81d3542a419d6"
+
+    # Kill the (idle) worker
+    worker = proc._hash_pool._free.queue[0]
+    worker._process.kill()
+    worker._process.join()
+
+    assert proc.md5sum_file(file) == "9e107d9d372bb6826bd81d3542a419d6"
+
+
+@pytest.mark.alpenhorn_config({"daemon": {"hash_engine": "gpu"}})
+def test_md5sum_file_bad_engine(tmp_path, set_config):
+    """Test an unknown hash engine"""
+
+    file = tmp_path.joinpath("tmp")
+    file.write_text("")
+    with pytest.raises(ValueError):
+        proc.md5sum_file(file)
+
+
+def test_md5sum_file_fadvise(tmp_path):
+    """Test page-cache advice in proc.md5sum_file"""
+
+    file = tmp_path.joinpath("tmp")
+    file.write_text("The quick brown fox jumps over the lazy dog")
+
+    with patch("os.posix_fadvise") as mock:
+        assert (
+            proc.md5sum_file(file, block_size=8, drop_cache=True)
+            == "9e107d9d372bb6826bd81d3542a419d6"
+        )
+
+    advice = [call.args[1:] for call in mock.call_args_list]
+    assert advice == [
+        (0, 0, os.POSIX_FADV_SEQUENTIAL),
+        (0, 43, os.POSIX_FADV_DONTNEED),
+    ]
+
+    # Without drop_cache, only the sequential advice is given
+    with patch("os.posix_fadvise") as mock:
+        proc.md5sum_file(file, block_size=8)
+    mock.assert_called_once()
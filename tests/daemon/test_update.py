@@ -85,6 +85,47 @@ def test_sethost_default(simplehost):
     update._host = None
 
 
+def test_refresh_storage(daemon_host, storagegroup, storagenode):
+    """Test update._refresh_storage()."""
+
+    group = storagegroup(name="group")
+    node1 = storagenode(name="node1", group=group, host=daemon_host, active=True)
+    storagenode(name="node2", group=group, host=daemon_host, active=False)
+
+    update._host = None
+    host_, nodes, token = update._refresh_storage()
+
+    assert host_ == daemon_host
+    assert host() == daemon_host
+    assert nodes == {"node1": node1}
+
+    # Nothing changed
+    assert update._refresh_storage()[2] == token
+
+    # Updates to the available space are not a change
+    node1.update_avail_gb(1000)
+    assert update._refresh_storage()[2] == token
+
+    # But other changes to the node are
+    node1.io_config = "{}"
+    node1.save()
+    new_token = update._refresh_storage()[2]
+    assert new_token != token
+
+    # As are changes to the group
+    group.notes = "Notes"
+    group.save()
+    assert update._refresh_storage()[2] != new_token
+
+
+def test_refresh_storage_nonodes(daemon_host, dbtables):
+    """Test update._refresh_storage() with no nodes."""
+
+    update._host = None
+    assert update._refresh_storage()[:2] == (daemon_host, {})
+    assert host() == daemon_host
+
+
 def test_update_abort():
     """Test update_loop with global_abort set."""
 
@@ -422,3 +463,72 @@ def test_deactivate_update(
 
     # Start the loop
     update.update_loop(queue, emptypool, False)
+
+
+def test_remote_node_registry(dbtables, simplenode, storagenode, simplegroup):
+    """Test caching of RemoteNodes by update.remote_node()."""
+
+    remote = update.remote_node(simplenode)
+    assert remote.db == simplenode
+
+    # Same node, new instance: cache hit
+    new_node = StorageNode.get(id=simplenode.id)
+    assert update.remote_node(new_node) is remote
+    assert remote.db is new_node
+    assert remote.io.node is new_node
+
+    # Changed io_config: cache miss
+    new_node = StorageNode.get(id=simplenode.id)
+    new_node.io_config = "{}"
+    new_remote = update.remote_node(new_node)
+    assert new_remote is not remote
+    assert new_remote.db is new_node
+
+    # Different node
+    other = storagenode(name="other", group=simplegroup)
+    assert update.remote_node(other) is not new_remote
+
+    # Delete the other node: it is pruned, but simplenode is kept
+    other.delete_instance()
+    update.prune_remote_nodes()
+    assert other.id not in update._remote_nodes
+    assert update._remote_nodes[simplenode.id] is new_remote
+
+
+@pytest.mark.alpenhorn_config({"daemon": {"min_update_interval": 0.2}})
+def test_wait_for_next_loop_wakeup(set_config, tmp_path):
+    """A poke ends the wait between loops early."""
+    import threading
+    import time
+
+    from alpenhorn.common import wakeup
+
+    # Other tests may leave this set
+    pool.global_abort.clear()
+
+    path = tmp_path / "wakeup.sock"
+    set_config["daemon"]["wakeup_socket"] = str(path)
+    listener = wakeup.WakeupListener(path)
+
+    # Without a poke, we wait the whole interval
+    start = time.monotonic()
+    update._wait_for_next_loop(listener, 0, 0.3)
+    assert time.monotonic() - start >= 0.3
+
+    # With a poke, we wait only the minimum interval
+    wakeup.poke()
+    start = time.monotonic()
+    update._wait_for_next_loop(listener, 0, 60)
+    elapsed = time.monotonic() - start
+    assert 0.2 <= elapsed < 1
+
+    # A poke after the minimum interval has passed ends the wait immediately
+    timer = threading.Timer(0.4, wakeup.poke)
+    timer.start()
+    start = time.monotonic()
+    update._wait_for_next_loop(listener, 0, 60)
+    elapsed = time.monotonic() - start
+    timer.join()
+    assert 0.4 <= elapsed < 0.55
+
+    listener.close()
@@ -170,6 +170,36 @@ def test_update_group_multicopy(
     mockio.group.pull.assert_called_once()
 
 
+def test_update_group_nonlocal(
+    mockgroupandnode, hostname, queue, pull, simplenode, storagehost
+):
+    """Test cancelling a non-local pull from a node refusing remote pulls."""
+
+    mockio, group, _ = mockgroupandnode
+    file, _, _ = pull
+
+    # Source is on some other host
+    simplenode.host = storagehost(name="otherhost")
+    simplenode.save()
+
+    # Source refuses remote pulls
+    with patch(
+        "alpenhorn.io.default.DefaultNodeRemote.remote_pull_ok",
+        lambda self, host: False,
+    ):
+        group.update()
+
+    # afcr is cancelled
+    assert not ArchiveFileCopyRequest.get(file=file).completed
+    assert ArchiveFileCopyRequest.get(file=file).cancelled
+    mockio.group.pull.assert_not_called()
+
+    # Now allow it
+    ArchiveFileCopyRequest.update(cancelled=False).execute()
+    group.update()
+    mockio.group.pull.assert_called_once()
+
+
 def test_update_group_copy_state(
     mockgroupandnode,
     hostname,
@@ -686,7 +686,7 @@ def test_update_node_run(
     calls = list(mock.mock_calls)
     assert len(calls) == 5
     assert call.bytes_avail(fast=False) in calls
-    assert call.check(badcopyY) in calls
+    assert call.check_many([badcopyY]) in calls
     assert call.delete([badcopyN]) in calls
     assert call.ready_pull(afcr_good) in calls
 
@@ -694,6 +694,45 @@ def test_update_node_run(
     assert pull_ready_calls == {goodfile, readyfile}
 
 
+@pytest.mark.alpenhorn_config({"daemon": {"max_checks_per_update": 2}})
+def test_update_check_cap(unode, set_config, simpleacq, archivefile, archivefilecopy):
+    """update_check() dispatches at most max_checks_per_update copies."""
+
+    copies = [
+        archivefilecopy(
+            node=unode.db,
+            file=archivefile(name=f"file{i}", acq=simpleacq),
+            has_file="M",
+            wants_file="Y",
+        )
+        for i in range(3)
+    ]
+
+    mock_check_many = MagicMock()
+    with patch.object(unode.io, "check_many", mock_check_many):
+        unode.update_check()
+
+    mock_check_many.assert_called_once_with(copies[:2])
+    assert unode._io_happened
+
+
+def test_update_check_none(unode, simpleacq, archivefile, archivefilecopy):
+    """update_check() does nothing if there are no suspect copies."""
+
+    archivefilecopy(
+        node=unode.db,
+        file=archivefile(name="file", acq=simpleacq),
+        has_file="Y",
+        wants_file="Y",
+    )
+
+    mock_check_many = MagicMock()
+    with patch.object(unode.io, "check_many", mock_check_many):
+        unode.update_check()
+
+    mock_check_many.assert_not_called()
+
+
 def test_update_import_absolute(unode, queue, archivefileimportrequest):
     """update_import() should skip absolute paths."""
 
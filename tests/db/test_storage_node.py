@@ -261,6 +261,68 @@ def test_allfiles(simplenode, simpleacq, archivefile, archivefilecopy):
                     )
 
 
+def test_plan_deletions(
+    set_config,
+    simplegroup,
+    storagenode,
+    simpleacq,
+    archivefile,
+    archivefilecopy,
+    archivefilecopyrequest,
+):
+    """Test StorageNode.plan_deletions()."""
+
+    arc1 = storagenode(name="arc1", group=simplegroup, archive=True)
+    arc2 = storagenode(name="arc2", group=simplegroup, archive=True)
+    node = storagenode(name="node", group=simplegroup)
+
+    def _file(name, archived, **kwargs):
+        file = archivefile(name=name, acq=simpleacq, size_b=100)
+        for arc in (arc1, arc2)[:archived]:
+            archivefilecopy(file=file, node=arc, has_file="Y")
+        return archivefilecopy(file=file, node=node, **kwargs)
+
+    # Deletable
+    copyN = _file("fileN", 2, has_file="Y", wants_file="N")
+    # Wanted
+    _file("fileY", 2, has_file="Y", wants_file="Y")
+    # Not present
+    _file("fileGone", 2, has_file="N", wants_file="N")
+    # Not archived enough
+    _file("fileArc", 1, has_file="Y", wants_file="N")
+    # Transfer pending
+    copyP = _file("filePending", 2, has_file="Y", wants_file="N")
+    archivefilecopyrequest(file=copyP.file, node_from=node, group_to=simplegroup)
+    # Discretionary
+    copyM1 = _file("fileM1", 2, has_file="Y", wants_file="M", size_b=150)
+    copyM2 = _file("fileM2", 2, has_file="Y", wants_file="M")
+
+    # Only copyN is deletable without discretionary cleaning
+    assert list(node.plan_deletions(avail_needed=0)) == [(copyN, 0)]
+
+    # If we need to free some space, discretionary copies are yielded, but
+    # only until we've freed up enough
+    assert list(node.plan_deletions(avail_needed=100)) == [
+        (copyN, 0),
+    ]
+    assert list(node.plan_deletions(avail_needed=200)) == [
+        (copyN, 100),
+        (copyM1, -50),
+    ]
+
+    # With avail_needed=None, discretionary copies are always deletable
+    assert list(node.plan_deletions()) == [
+        (copyN, None),
+        (copyM1, None),
+        (copyM2, None),
+    ]
+
+    # Candidates can be restricted by the caller
+    assert list(node.plan_deletions(ArchiveFileCopy.id << [copyM2.id, copyP.id])) == [
+        (copyM2, None)
+    ]
+
+
 def test_update_avail_gb(simplenode):
     """test StorageNode.update_avail_gb()"""
 
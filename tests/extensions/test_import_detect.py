@@ -21,3 +21,14 @@ def test_detect():
 
     # But this is fine
     ImportDetectExtension("Test", "1", detect=_func)
+
+
+def test_detect_many():
+    """detect_many must be callable, if given."""
+
+    with pytest.raises(ValueError):
+        ImportDetectExtension("Test", "1", detect=_func, detect_many=1)
+
+    # But these are fine
+    assert ImportDetectExtension("Test", "1", detect=_func).detect_many is None
+    ImportDetectExtension("Test", "1", detect=_func, detect_many=_func)
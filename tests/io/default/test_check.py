@@ -1,6 +1,9 @@
 """Test DefaultNodeIO.check()."""
 
 import pathlib
+from unittest.mock import patch
+
+import pytest
 
 from alpenhorn.db.archive import ArchiveFileCopy
 
@@ -147,3 +150,71 @@ def test_check_async_path(xfs, simpleacq, archivefile, unode, archivefilecopy):
 
     # copy should be fine
     assert ArchiveFileCopy.get(file=file, node=unode.db).has_file == "Y"
+
+
+def test_check_many(xfs, queue, simpleacq, archivefile, unode, archivefilecopy):
+    """Test batching in DefaultNodeIO.check_many()."""
+
+    copies = []
+    for i in range(12):
+        file = archivefile(
+            name=f"file{i}",
+            acq=simpleacq,
+            size_b=43,
+            md5sum="9e107d9d372bb6826bd81d3542a419d6",
+        )
+        copy = archivefilecopy(file=file, node=unode.db, has_file="M")
+        xfs.create_file(
+            copy.path, contents="The quick brown fox jumps over the lazy dog"
+        )
+        copies.append(copy)
+
+    # queue
+    unode.io.check_many(copies)
+
+    # Default batch size is ten, so there are two tasks.
+    assert queue.qsize == 2
+
+    # Call the asyncs
+    for _ in range(2):
+        task, key = queue.get()
+        task()
+        queue.task_done(key)
+
+    # All copies are now okay.
+    for copy in copies:
+        assert ArchiveFileCopy.get(id=copy.id).has_file == "Y"
+
+
+def test_check_batch_size_bad(simplenode, queue):
+    """Test a non-positive check_batch_size."""
+    from alpenhorn.daemon.update import UpdateableNode
+
+    simplenode.io_config = '{"check_batch_size": 0}'
+
+    with pytest.raises(ValueError):
+        UpdateableNode(queue, simplenode)
+
+
+def test_check_async_old_md5(xfs, simpleacq, archivefile, unode, archivefilecopy):
+    """check_async works with an md5 which doesn't take drop_cache."""
+    from alpenhorn.io.default import check_async
+
+    file = archivefile(
+        name="file",
+        acq=simpleacq,
+        size_b=43,
+        md5sum="9e107d9d372bb6826bd81d3542a419d6",
+    )
+    copy = archivefilecopy(file=file, node=unode.db, has_file="M")
+    xfs.create_file(copy.path, contents="The quick brown fox jumps over the lazy dog")
+
+    default_md5 = unode.io.md5
+
+    def md5(path, *segments):
+        return default_md5(path, *segments)
+
+    with patch.object(unode.io, "md5", md5):
+        check_async(None, unode.io, copy)
+
+    assert ArchiveFileCopy.get(file=file, node=unode.db).has_file == "Y"
@@ -1,7 +1,6 @@
 """Test DefaultNodeIO.delete()."""
 
 import pathlib
-from unittest.mock import MagicMock, patch
 
 import pytest
 
@@ -17,37 +16,45 @@ def test_zero_len(queue, unode):
     assert queue.qsize == 0
 
 
+@pytest.mark.alpenhorn_config({"daemon": {"archive_copy_count": 0}})
 def test_delete_check(
     xfs,
     queue,
+    set_config,
     simplegroup,
     storagenode,
     archiveacq,
     archivefile,
     archivefilecopy,
+    archivefilecopyrequest,
 ):
-    """The delete async calls the ArchiveFileCopy.check_delete."""
+    """The delete async re-checks whether copies can be deleted."""
     node = storagenode(name="node", group=simplegroup, root="/node")
     acq = archiveacq(name="acq")
     copy1 = archivefilecopy(
         file=archivefile(name="file1", acq=acq),
         node=node,
         has_file="Y",
+        wants_file="N",
     )
     xfs.create_file(copy1.path, contents=copy1.file.name)
     copy2 = archivefilecopy(
         file=archivefile(name="file2", acq=acq),
         node=node,
         has_file="Y",
+        wants_file="N",
     )
     xfs.create_file(copy2.path, contents=copy2.file.name)
 
-    mock = MagicMock()
-    mock.return_value = False
+    # Now, after planning, copy1 is wanted again and copy2 is the
+    # source of a new copy request.
+    ArchiveFileCopy.update(wants_file="Y").where(
+        ArchiveFileCopy.id == copy1.id
+    ).execute()
+    afcr = archivefilecopyrequest(file=copy2.file, node_from=node, group_to=simplegroup)
 
-    with patch("alpenhorn.db.archive.ArchiveFileCopy.check_delete", mock):
-        # Call async directly with a fake UpDownLock
-        delete_async(None, UpDownLock(), [copy1, copy2])
+    # Call async directly with a fake UpDownLock
+    delete_async(None, UpDownLock(), [copy1, copy2])
 
     # Nothing was deleted
     assert ArchiveFileCopy.select().where(ArchiveFileCopy.has_file == "Y").count() == 2
@@ -56,22 +63,25 @@ def test_delete_check(
     assert pathlib.Path(copy1.path).exists()
     assert pathlib.Path(copy2.path).exists()
 
-    # Now do the same, but returning true
-    mock.return_value = True
-    with patch("alpenhorn.db.archive.ArchiveFileCopy.check_delete", mock):
-        delete_async(None, UpDownLock(), [copy1, copy2])
+    # Now cancel the copy request and try again.
+    afcr.cancelled = 1
+    afcr.save()
+    delete_async(None, UpDownLock(), [copy1, copy2])
 
-    # Both were deleted
-    assert ArchiveFileCopy.select().where(ArchiveFileCopy.has_file == "Y").count() == 0
+    # Only copy2 was deleted
+    assert ArchiveFileCopy.get(id=copy1.id).has_file == "Y"
+    assert ArchiveFileCopy.get(id=copy2.id).has_file == "N"
 
     # Check files
-    assert not pathlib.Path(copy1.path).exists()
+    assert pathlib.Path(copy1.path).exists()
     assert not pathlib.Path(copy2.path).exists()
 
 
+@pytest.mark.alpenhorn_config({"daemon": {"archive_copy_count": 0}})
 def test_delete_dirs(
     xfs,
     queue,
+    set_config,
     dbtables,
     simplegroup,
     storagenode,
@@ -90,6 +100,7 @@ def test_delete_dirs(
             file=archivefile(name="file/1", acq=acq1),
             node=node,
             has_file="Y",
+            wants_file="N",
         )
     )
     copies.append(
@@ -97,6 +108,7 @@ def test_delete_dirs(
             file=archivefile(name="file/2", acq=acq1),
             node=node,
             has_file="Y",
+            wants_file="N",
         )
     )
     copies.append(
@@ -104,6 +116,7 @@ def test_delete_dirs(
             file=archivefile(name="file/3", acq=acq1),
             node=node,
             has_file="Y",
+            wants_file="N",
         )
     )
 
@@ -113,6 +126,7 @@ def test_delete_dirs(
             file=archivefile(name="file/4", acq=acq2),
             node=node,
             has_file="Y",
+            wants_file="N",
         )
     )
     copies.append(
@@ -120,6 +134,7 @@ def test_delete_dirs(
             file=archivefile(name="file/5", acq=acq2),
             node=node,
             has_file="Y",
+            wants_file="N",
         )
     )
 
@@ -129,6 +144,7 @@ def test_delete_dirs(
             file=archivefile(name="file6", acq=acq3),
             node=node,
             has_file="Y",
+            wants_file="N",
         )
     )
 
@@ -140,12 +156,8 @@ def test_delete_dirs(
     delete_copies = copies.copy()
     del delete_copies[2]
 
-    with patch(
-        "alpenhorn.db.archive.ArchiveFileCopy.check_delete",
-        lambda discretionary=True: True,
-    ):
-        # Call async directly with a fake UpDownLock
-        delete_async(None, UpDownLock(), delete_copies)
+    # Call async directly with a fake UpDownLock
+    delete_async(None, UpDownLock(), delete_copies)
 
     # Only copies[2] remains
     assert ArchiveFileCopy.select().where(ArchiveFileCopy.has_file == "Y").count() == 1
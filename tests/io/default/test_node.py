@@ -103,6 +103,58 @@ def test_file_walk_path(unode, xfs):
     ]
 
 
+def test_file_walk_serial(unode, xfs):
+    """test DefaultNodeIO.file_walk() with one thread"""
+
+    unode.io.walk_threads = 1
+
+    xfs.create_file("/node/dir1/file1")
+    xfs.create_file("/node/dir1/sub/file2")
+    xfs.create_file("/node/dir2/file3")
+
+    assert sorted(unode.io.file_walk(pathlib.PurePath("."))) == [
+        pathlib.PurePath("/node/dir1/file1"),
+        pathlib.PurePath("/node/dir1/sub/file2"),
+        pathlib.PurePath("/node/dir2/file3"),
+    ]
+
+
+def test_file_walk_depth(unode, xfs):
+    """test DefaultNodeIO.file_walk() with max_depth"""
+
+    xfs.create_file("/node/file0")
+    xfs.create_file("/node/dir/file1")
+    xfs.create_file("/node/dir/sub/file2")
+
+    assert sorted(unode.io.file_walk(pathlib.PurePath("."), max_depth=0)) == [
+        pathlib.PurePath("/node/file0"),
+    ]
+    assert sorted(unode.io.file_walk(pathlib.PurePath("."), max_depth=1)) == [
+        pathlib.PurePath("/node/dir/file1"),
+        pathlib.PurePath("/node/file0"),
+    ]
+
+
+def test_file_walk_prefix(unode, xfs):
+    """test DefaultNodeIO.file_walk() with prefix"""
+
+    xfs.create_file("/node/2024/acq1/file1")
+    xfs.create_file("/node/2024/acq2/file2")
+    xfs.create_file("/node/2024/bcq3/file3")
+    xfs.create_file("/node/2025/acq4/file4")
+
+    assert sorted(unode.io.file_walk(pathlib.PurePath("."), prefix="2024/a")) == [
+        pathlib.PurePath("/node/2024/acq1/file1"),
+        pathlib.PurePath("/node/2024/acq2/file2"),
+    ]
+
+    # Prefix on a file path
+    assert (
+        list(unode.io.file_walk(pathlib.PurePath("2025/acq4/file4"), prefix="2024"))
+        == []
+    )
+
+
 def test_file_walk_missing(unode, xfs):
     """test DefaultNodeIO.file_walk() with a missing path"""
 
@@ -305,3 +357,49 @@ def test_idle_cleanup_rate(unode, queue):
         unode.io.idle_update(False)
 
     assert queue.qsize == 6
+
+
+def test_io_limits(simplenode, queue):
+    """io_config sets FIFO limits."""
+    from alpenhorn.daemon.update import UpdateableNode
+
+    simplenode.io_config = '{"max_concurrent_io": 2, "max_read_mbps": 1.5}'
+    node = UpdateableNode(queue, simplenode)
+
+    assert queue._fifo_limits[node.io.fifo] == 2
+    assert queue._fifo_budgets[node.io.fifo][0] == 1.5e6
+
+
+@pytest.mark.parametrize(
+    "io_config",
+    [
+        '{"max_concurrent_io": 0}',
+        '{"max_read_mbps": -1}',
+        '{"partial_max_days": 0}',
+        '{"partial_max_bytes": -1}',
+    ],
+)
+def test_io_limits_bad(simplenode, queue, io_config):
+    """Non-positive limits are rejected."""
+    from alpenhorn.daemon.update import UpdateableNode
+
+    simplenode.io_config = io_config
+
+    with pytest.raises(ValueError):
+        UpdateableNode(queue, simplenode)
+
+
+def test_md5_block_size(simplenode, queue, xfs):
+    """io_config read_block_size is used by md5()."""
+    from unittest.mock import patch
+
+    from alpenhorn.daemon.update import UpdateableNode
+
+    simplenode.io_config = '{"read_block_size": 4096}'
+    node = UpdateableNode(queue, simplenode)
+
+    with patch("alpenhorn.io.default.node.md5sum_file") as mock:
+        node.io.md5("file", drop_cache=True)
+    mock.assert_called_once_with(
+        pathlib.Path("/node/file"), block_size=4096, drop_cache=True
+    )
@@ -621,10 +621,14 @@ def test_pull_async_path_rsync(
     # Call the async directly
     pull_async(MagicMock(), unode.io, unode.io.tree_lock, req, True, path=dest)
 
-    # rsync ran with the non-standard path
+    # rsync ran with the non-standard path, keeping a partial transfer
     cmd = have_rsync()["cmd"]
     assert "rsync" in cmd
     assert str(dest) in cmd
+    assert any(arg.startswith("--partial-dir=") for arg in cmd)
+
+    # The partial transfer is tracked for the idle tidy-up
+    assert unode.io.partials == {req.id}
 
 
 @pytest.mark.run_command_result(0, "", "md5 d41d8cd98f00b204e9800998ecf8427e")
@@ -685,3 +689,265 @@ def test_pull_async_path_bbcp(
     cmd = have_bbcp()["cmd"]
     assert "bbcp" in cmd
     assert str(dest) in cmd
+
+
+def test_pull_async_engine_config(
+    xfs, dbtables, mock_filesize, test_req, queue, skip_db_checks
+):
+    """Test choosing transfer engines via io_config."""
+
+    unode, req = test_req
+
+    # Only the parallel engine.
+    unode.io.pull_engines = ["parallel"]
+
+    mock = MagicMock(return_value={"ret": 0, "md5sum": True})
+    with patch("alpenhorn.io.default.pull.parallel_copy", mock):
+        pull_async(MagicMock(), unode.io, unode.io.tree_lock, req, True)
+    mock.assert_called_once()
+    assert mock.call_args.kwargs["md5sum"] == req.file.md5sum
+
+    # The partial transfer is tracked for the idle tidy-up
+    assert unode.io.partials == {req.id}
+
+    # Per-source override, using a remote-only engine: nothing can
+    # do the transfer.
+    unode.io.pull_engines_from = {"node_from": ["bbcp"]}
+
+    mock = MagicMock(return_value={"ret": 0, "md5sum": True})
+    with patch("alpenhorn.io.default.pull.parallel_copy", mock):
+        pull_async(MagicMock(), unode.io, unode.io.tree_lock, req, True)
+    mock.assert_not_called()
+
+
+def test_pull_async_register_engine(
+    xfs, dbtables, mock_filesize, test_req, queue, skip_db_checks
+):
+    """Test registering a new transfer engine."""
+
+    from alpenhorn.io.default import pull
+
+    unode, req = test_req
+
+    # An engine which declines the transfer, and one which accepts it
+    decline = MagicMock(return_value=None)
+    accept = MagicMock(return_value={"ret": 0, "md5sum": True})
+    pull.register_engine("decline", decline)
+    pull.register_engine("accept", accept)
+    try:
+        unode.io.pull_engines = ["decline", "accept", "internal"]
+        pull_async(MagicMock(), unode.io, unode.io.tree_lock, req, True)
+    finally:
+        del pull._engines["decline"]
+        del pull._engines["accept"]
+
+    decline.assert_called_once()
+    accept.assert_called_once()
+
+
+def test_pull_engine_bad(simplenode, queue):
+    """Unknown engines in io_config are rejected."""
+
+    simplenode.io_config = '{"pull_engines": ["teleport"]}'
+
+    with pytest.raises(ValueError):
+        UpdateableNode(queue, simplenode)
+
+
+@pytest.fixture
+def batch_reqs(
+    dbtables, test_req, queue, archivefile, archivefilecopy, archivefilecopyrequest
+):
+    """Create small-file copy requests for batching.
+
+    Returns a two-element tuple: (node_to, list of copy requests).  The
+    node_to has batching enabled, with a batch size of 2."""
+    node, req = test_req
+
+    node.db.io_config = '{"pull_batch_size": 2}'
+    node = UpdateableNode(queue, node.db)
+
+    reqs = []
+    for name in ["file1", "file2", "file3"]:
+        file = archivefile(
+            name=name,
+            acq=req.file.acq,
+            size_b=1000,
+            md5sum="d41d8cd98f00b204e9800998ecf8427e",
+        )
+        archivefilecopy(file=file, node=req.node_from, has_file="Y")
+        reqs.append(
+            archivefilecopyrequest(
+                file=file, node_from=req.node_from, group_to=req.group_to
+            )
+        )
+
+    return node, reqs
+
+
+def test_pull_batch(queue, batch_reqs):
+    """Small files are pulled in batches."""
+
+    node, reqs = batch_reqs
+
+    for req in reqs:
+        node.io.pull(req, False)
+
+    # The first two were batched together and dispatched
+    assert queue.qsize == 1
+
+    # The remaining one is dispatched at the end of the update
+    node.io.after_update()
+    assert queue.qsize == 2
+
+    task, key = queue.get()
+    assert str(task) == f"AFCR#{reqs[0].id}+1: node_from -> node_to"
+    queue.task_done(key)
+
+    task, key = queue.get()
+    assert str(task) == f"AFCR#{reqs[2].id}: node_from -> node_to"
+    queue.task_done(key)
+
+
+def test_pull_batch_big(queue, batch_reqs, test_req):
+    """Big files and searched requests aren't batched."""
+
+    node, reqs = batch_reqs
+    _, big_req = test_req
+
+    node.io.pull(big_req, False)
+    node.io.pull(reqs[0], True)
+
+    assert queue.qsize == 2
+    assert node.io._pull_batches == {}
+
+
+def test_pull_batch_bytes(queue, batch_reqs):
+    """The batch byte limit is respected."""
+
+    node, reqs = batch_reqs
+    node.io.pull_batch_bytes = 1500
+
+    node.io.pull(reqs[0], False)
+    node.io.pull(reqs[1], False)
+
+    # First req was dispatched alone to make room for the second
+    assert queue.qsize == 1
+    task, key = queue.get()
+    assert str(task) == f"AFCR#{reqs[0].id}: node_from -> node_to"
+    queue.task_done(key)
+
+
+def test_pull_batch_bad(queue, test_req):
+    """Non-positive batch limits are rejected."""
+
+    node, _ = test_req
+
+    node.db.io_config = '{"pull_batch_size": 0}'
+    with pytest.raises(ValueError):
+        UpdateableNode(queue, node.db)
+
+
+def test_pull_batch_async_rsync(
+    queue, have_rsync, mock_filesize, batch_reqs, skip_db_checks, storagehost
+):
+    """Test a batched remote rsync pull."""
+
+    node, reqs = batch_reqs
+
+    # Make the requests non-local
+    reqs[0].node_from.host = storagehost(
+        name="other-host", address="addr", username="user"
+    )
+    reqs[0].node_from.save()
+
+    node.io.pull(reqs[0], False)
+    node.io.pull(reqs[1], False)
+
+    task, key = queue.get()
+    task()
+    queue.task_done(key)
+
+    # A single rsync ran for both files
+    cmd = have_rsync()["cmd"]
+    assert "rsync" in cmd
+    assert any(arg.startswith("--files-from=") for arg in cmd)
+    assert "user@addr:/node_from/" in cmd
+    assert "/node_to/" in cmd
+
+    # Reqs are complete.
+    for req in reqs[:2]:
+        afcr = ArchiveFileCopyRequest.get(id=req.id)
+        assert afcr.completed is True
+        assert ArchiveFileCopy.get(node=node.db, file=req.file).has_file == "Y"
+
+
+def test_pull_batch_async_local(xfs, queue, mock_filesize, batch_reqs, skip_db_checks):
+    """Test a batched local pull."""
+
+    node, reqs = batch_reqs
+
+    # Make node non-archival to avoid hardlinking
+    node.db.archive = False
+    node.db.save()
+
+    for req in reqs[:2]:
+        xfs.create_file(f"/node_from/{req.file.path}")
+
+    node.io.pull(reqs[0], False)
+    node.io.pull(reqs[1], False)
+
+    task, key = queue.get()
+    task()
+    queue.task_done(key)
+
+    for req in reqs[:2]:
+        afcr = ArchiveFileCopyRequest.get(id=req.id)
+        assert afcr.completed is True
+        assert pathlib.Path("/node_to", req.file.path).exists()
+
+
+def test_pull_batch_stop(queue, batch_reqs):
+    """Stopping the node releases the space reserved for pending batches."""
+
+    from alpenhorn.io.default import node as default_node
+
+    node, reqs = batch_reqs
+
+    reserved = default_node._reserved_bytes["node_to"]
+    node.io.pull(reqs[0], False)
+    assert default_node._reserved_bytes["node_to"] > reserved
+
+    node.stop()
+    assert node.io._pull_batches == {}
+    assert default_node._reserved_bytes["node_to"] == reserved
+
+
+def test_rsync_batch_engine_fail(xfs, batch_reqs):
+    """Only files written by a failed batch rsync are trusted."""
+
+    from alpenhorn.io.default import pull
+
+    node, reqs = batch_reqs
+
+    from_paths = [f"/node_from/{req.file.path}" for req in reqs]
+    to_paths = [pathlib.Path("/node_to", req.file.path) for req in reqs]
+
+    # The first file is already present
+    xfs.create_file(to_paths[0])
+
+    def _rsync_many(*args):
+        # The second file arrives; the third doesn't
+        xfs.create_file(to_paths[1])
+        return {"ret": 1, "stderr": "connection reset"}
+
+    node.io.md5 = MagicMock(return_value="md5")
+    with (
+        patch("shutil.which", return_value="/usr/bin/rsync"),
+        patch("alpenhorn.io.default.pull.rsync_many", _rsync_many),
+    ):
+        results = pull._rsync_batch_engine(reqs, node.io, from_paths, to_paths)
+
+    failed = {"ret": 1, "stderr": "connection reset", "check_src": False}
+    assert results == [failed, {"ret": 0, "md5sum": "md5"}, failed]
+    node.io.md5.assert_called_once_with(to_paths[1])
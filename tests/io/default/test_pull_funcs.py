@@ -1,6 +1,10 @@
 """Test the low-level Default I/O pull functions."""
 
+import datetime
+import os
 import pathlib
+import time
+from unittest.mock import MagicMock, patch
 
 import pytest
 
@@ -153,6 +157,34 @@ def test_rsync_good(mock_run_command):
 
 
 @pytest.mark.run_command_result(0, "", "")
+def test_rsync_partial(mock_run_command):
+    """Test pull.rsync() with a partial dir."""
+
+    pull.rsync("from/path", "to/dir", 1e8, True, partial=pathlib.Path("to/.partial"))
+
+    args = mock_run_command()
+    assert "--partial-dir=to/.partial" in args["cmd"]
+
+
+def test_rsync_many(mock_run_command):
+    """Test pull.rsync_many()."""
+
+    files_from = None
+
+    def _run_command(cmd, timeout=None, **kwargs):
+        nonlocal files_from
+        for arg in cmd:
+            if arg.startswith("--files-from="):
+                files_from = pathlib.Path(arg[13:]).read_text()
+        return (0, "", "")
+
+    with patch("alpenhorn.daemon.proc.run_command", _run_command):
+        result = pull.rsync_many("host:/from", "/to/", ["acq/a", "acq/b"], 1e8, False)
+
+    assert result["ret"] == 0
+    assert files_from == "acq/a\nacq/b\n"
+
+
 def test_rsync_pathlib(mock_run_command):
     """Test passing pathlib.Path to pull.rsync()."""
 
@@ -266,6 +298,31 @@ def test_local_copy(xfs, set_config):
     assert destfile.read_text() == "data"
 
 
+def test_local_copy_blocks(xfs, set_config):
+    """Test pull.local_copy() with many blocks."""
+
+    data = "The quick brown fox jumps over the lazy dog"
+    file = "/src/file"
+    xfs.create_file(file, contents=data)
+    os.utime(file, (1000, 2000))
+    destfile = pathlib.Path("/dest/file")
+    xfs.create_dir(destfile.parent)
+
+    # The copy is hashed as it goes: the file isn't re-read
+    with patch("alpenhorn.daemon.proc.md5sum_file") as mock:
+        assert pull.local_copy(file, destfile, len(data), block_size=5) == {
+            "ret": 0,
+            "md5sum": "9e107d9d372bb6826bd81d3542a419d6",
+        }
+    mock.assert_not_called()
+
+    assert destfile.read_text() == data
+    assert destfile.stat().st_mtime == 2000
+
+    # No temporary files left behind
+    assert list(destfile.parent.iterdir()) == [destfile]
+
+
 def test_local_copy_clobber(xfs, set_config):
     """Test successful overwrite in pull.local_copy() call."""
 
@@ -308,3 +365,277 @@ def test_local_copy_fail(xfs, set_config):
 
     with pytest.raises(PermissionError):
         destfile.read_text()
+
+
+def test_parallel_copy(tmp_path, set_config):
+    """Test pull.parallel_copy()."""
+
+    data = b"The quick brown fox jumps over the lazy dog"
+    src = tmp_path.joinpath("src")
+    src.write_bytes(data)
+    os.utime(src, (1000, 2000))
+    dest = tmp_path.joinpath("dest")
+    dest.write_bytes(b"clobber")
+
+    progress = MagicMock()
+    result = pull.parallel_copy(
+        src, dest, len(data), streams=3, chunk_size=5, progress=progress
+    )
+
+    assert result["ret"] == 0
+    assert result["md5sum"] == "9e107d9d372bb6826bd81d3542a419d6"
+    assert len(result["chunk_md5"]) == 9
+    assert result["chunk_md5"][0] == "6131a51747610d0ae4e86c3a3416788c"
+
+    assert dest.read_bytes() == data
+    assert dest.stat().st_mtime == 2000
+    assert sum(call.args[0] for call in progress.add.call_args_list) == len(data)
+
+    # No temporary files left behind
+    assert sorted(tmp_path.iterdir()) == [dest, src]
+
+
+def test_parallel_copy_empty(tmp_path, set_config):
+    """Test pull.parallel_copy() on an empty file."""
+
+    src = tmp_path.joinpath("src")
+    src.write_bytes(b"")
+    dest = tmp_path.joinpath("dest")
+
+    assert pull.parallel_copy(src, dest, 0) == {
+        "ret": 0,
+        "md5sum": "d41d8cd98f00b204e9800998ecf8427e",
+        "chunk_md5": [],
+        "resumed": 0,
+    }
+    assert dest.exists()
+
+
+def test_parallel_copy_fail(tmp_path, set_config):
+    """Test failed pull.parallel_copy() call."""
+
+    src = tmp_path.joinpath("src")
+    src.write_bytes(b"data")
+
+    result = pull.parallel_copy(src, tmp_path.joinpath("missing", "dest"), 4)
+    assert result["ret"] == 1
+    assert "stderr" in result
+
+
+def test_parallel_copy_md5_bad(tmp_path, set_config):
+    """A copy with the wrong MD5 hash isn't moved into place."""
+
+    src = tmp_path.joinpath("src")
+    src.write_bytes(b"data")
+    dest = tmp_path.joinpath("dest")
+
+    result = pull.parallel_copy(src, dest, 4, md5sum="0" * 32)
+    assert result["ret"] == 0
+    assert result["md5sum"] == "8d777f385d3dfec8815d20f7496026dc"
+    assert not dest.exists()
+
+
+def test_parallel_copy_timeout(tmp_path, set_config):
+    """A timed out copy is stopped and not moved into place."""
+
+    data = b"The quick brown fox jumps over the lazy dog"
+    src = tmp_path.joinpath("src")
+    src.write_bytes(data)
+    dest = tmp_path.joinpath("dest")
+    partial = tmp_path.joinpath(".alpentemp_afcr1")
+
+    real_pwrite = os.pwrite
+    writes = []
+
+    def _pwrite(fd, data, offset):
+        writes.append(offset)
+        time.sleep(0.1)
+        return real_pwrite(fd, data, offset)
+
+    with (
+        patch("os.pwrite", _pwrite),
+        patch("alpenhorn.io.default.pull._pull_timeout", return_value=0.3),
+    ):
+        result = pull.parallel_copy(
+            src, dest, len(data), streams=1, chunk_size=1, partial=partial
+        )
+        assert result["ret"] == 1
+        count = len(writes)
+
+        # Give an abandoned copy time to carry on
+        time.sleep(0.5)
+
+    assert len(writes) <= count + 1
+    assert len(writes) < len(data)
+    assert not dest.exists()
+
+
+def test_parallel_copy_resume(tmp_path, set_config):
+    """Test resuming an interrupted pull.parallel_copy()."""
+
+    data = b"The quick brown fox jumps over the lazy dog"
+    src = tmp_path.joinpath("src")
+    src.write_bytes(data)
+    dest = tmp_path.joinpath("dest")
+    partial = tmp_path.joinpath(".alpentemp_afcr1")
+
+    # Interrupt the copy after the first chunk
+    real_pwrite = os.pwrite
+
+    def _pwrite(fd, data, offset):
+        if offset >= 5:
+            raise OSError("interrupted")
+        return real_pwrite(fd, data, offset)
+
+    with patch("os.pwrite", _pwrite):
+        result = pull.parallel_copy(
+            src, dest, len(data), streams=1, chunk_size=5, partial=partial
+        )
+    assert result["ret"] == 1
+    assert not dest.exists()
+
+    # Partial and checkpoint left behind
+    assert partial.joinpath("src").exists()
+    assert partial.joinpath("checkpoint.json").exists()
+
+    # Try again
+    result = pull.parallel_copy(
+        src, dest, len(data), streams=3, chunk_size=5, partial=partial
+    )
+    assert result["ret"] == 0
+    assert result["resumed"] == 5
+    assert result["md5sum"] == "9e107d9d372bb6826bd81d3542a419d6"
+    assert dest.read_bytes() == data
+
+    # Partial cleaned up
+    assert not partial.exists()
+
+
+def test_parallel_copy_resume_bad(tmp_path, set_config):
+    """Test pull.parallel_copy() ignoring a bad checkpoint."""
+
+    data = b"The quick brown fox jumps over the lazy dog"
+    src = tmp_path.joinpath("src")
+    src.write_bytes(data)
+    stat = src.stat()
+    dest = tmp_path.joinpath("dest")
+
+    # Make a partial with corrupt data
+    partial = tmp_path.joinpath(".alpentemp_afcr1")
+    partial.mkdir()
+    partial.joinpath("src").write_bytes(b"Thy quick brown fox")
+    pull._save_checkpoint(
+        partial.joinpath("checkpoint.json"),
+        stat.st_size,
+        stat.st_mtime_ns,
+        5,
+        ["6131a51747610d0ae4e86c3a3416788c"] * 3,
+    )
+
+    result = pull.parallel_copy(
+        src, dest, len(data), streams=3, chunk_size=5, partial=partial
+    )
+    assert result["ret"] == 0
+    assert result["resumed"] == 0
+    assert result["md5sum"] == "9e107d9d372bb6826bd81d3542a419d6"
+    assert dest.read_bytes() == data
+
+
+def test_find_partials(
+    simplenode, simplefile, storagegroup, archivefilecopyrequest, dbtables
+):
+    """Test pull.find_partials()."""
+
+    group = simplenode.group
+
+    pending = archivefilecopyrequest(
+        file=simplefile, node_from=simplenode, group_to=group
+    )
+    recent = archivefilecopyrequest(
+        file=simplefile, node_from=simplenode, group_to=group, cancelled=1
+    )
+    archivefilecopyrequest(
+        file=simplefile,
+        node_from=simplenode,
+        group_to=group,
+        completed=1,
+        timestamp=datetime.datetime(2000, 1, 1),
+    )
+    archivefilecopyrequest(
+        file=simplefile, node_from=simplenode, group_to=storagegroup(name="other")
+    )
+
+    assert pull.find_partials(simplenode, 100) == {pending.id, recent.id}
+
+
+def test_clean_partials(
+    tmp_path, storagenode, simplegroup, simplefile, archivefilecopyrequest, dbtables
+):
+    """Test pull.clean_partials()."""
+
+    node = storagenode(name="node", group=simplegroup, root=str(tmp_path))
+
+    def _req(**kwargs):
+        return archivefilecopyrequest(
+            file=simplefile, node_from=node, group_to=simplegroup, **kwargs
+        )
+
+    pending = _req()
+    done = _req(completed=1)
+    old = _req()
+    untracked = _req()
+    no_partial = _req()
+
+    def _partial(req, age, size=0):
+        path = pull.partial_dir(tmp_path.joinpath(simplefile.path), req)
+        path.mkdir(parents=True)
+        path.joinpath("file").write_bytes(b"x" * size)
+        mtime = time.time() - age
+        os.utime(path.joinpath("file"), (mtime, mtime))
+        os.utime(path, (mtime, mtime))
+        return path
+
+    keep = _partial(pending, 10)
+    finished = _partial(done, 10)
+    stale = _partial(old, 1000)
+    other = _partial(untracked, 1000)
+
+    partials = {pending.id, done.id, old.id, no_partial.id, 999}
+    assert pull.clean_partials(node, partials, 100) == 2
+    assert keep.exists()
+    assert not finished.exists()
+    assert not stale.exists()
+    assert other.exists()
+
+    # Only the remaining partial is still tracked
+    assert partials == {pending.id}
+
+
+def test_clean_partials_size(
+    tmp_path, storagenode, simplegroup, simplefile, archivefilecopyrequest, dbtables
+):
+    """Test pull.clean_partials() with a size limit."""
+
+    node = storagenode(name="node", group=simplegroup, root=str(tmp_path))
+    old_req = archivefilecopyrequest(
+        file=simplefile, node_from=node, group_to=simplegroup
+    )
+    new_req = archivefilecopyrequest(
+        file=simplefile, node_from=node, group_to=simplegroup
+    )
+
+    old = pull.partial_dir(tmp_path.joinpath(simplefile.path), old_req)
+    old.mkdir(parents=True)
+    old.joinpath("file").write_bytes(b"x" * 10000)
+    os.utime(old.joinpath("file"), (time.time() - 10, time.time() - 10))
+    new = pull.partial_dir(tmp_path.joinpath(simplefile.path), new_req)
+    new.mkdir()
+    new.joinpath("file").write_bytes(b"x" * 10000)
+
+    size = sum(entry.stat().st_blocks * 512 for entry in new.rglob("*"))
+
+    partials = {old_req.id, new_req.id}
+    assert pull.clean_partials(node, partials, 100, max_bytes=size) == 1
+    assert not old.exists()
+    assert new.exists()
+    assert partials == {new_req.id}
@@ -1,11 +1,12 @@
 """Test the UpDownLock"""
 
 import threading
+from pathlib import PurePath
 from time import sleep
 
 import pytest
 
-from alpenhorn.io.default.updownlock import UpDownLock
+from alpenhorn.io.default.updownlock import TreeLock, UpDownLock
 
 
 @pytest.fixture
@@ -342,3 +343,88 @@ def test_waiting(udlock):
     # Clean up
     up.join()
     down.join()
+
+
+def test_treelock_stripes():
+    """TreeLock stripes by top-level directory."""
+
+    tlock = TreeLock("/node")
+
+    # Same top-level directory: same stripe
+    assert tlock.stripe(PurePath("/node/acq1/a")) is tlock.stripe(
+        PurePath("/node/acq1/b/c")
+    )
+
+    # Different top-level directory: different stripes
+    assert tlock.stripe(PurePath("/node/acq1")) is not tlock.stripe(
+        PurePath("/node/acq2")
+    )
+
+    # The root and paths outside it share a stripe
+    assert tlock.stripe(PurePath("/node")) is tlock.stripe(PurePath("/elsewhere"))
+
+
+def test_treelock_bounded():
+    """The number of TreeLock stripes doesn't grow with the tree."""
+
+    tlock = TreeLock("/node", stripes=4)
+
+    locks = {id(tlock.stripe(PurePath(f"/node/acq{i}"))) for i in range(100)}
+    assert len(locks) <= 4
+
+    with pytest.raises(ValueError):
+        TreeLock("/node", stripes=0)
+
+
+def test_treelock_independent():
+    """Locks in different stripes don't block each other."""
+
+    tlock = TreeLock("/node")
+
+    results = []
+
+    def downthread():
+        results.append(
+            tlock.stripe(PurePath("/node/acq2")).down.acquire(blocking=False)
+        )
+        results.append(
+            tlock.stripe(PurePath("/node/acq1/x")).down.acquire(blocking=False)
+        )
+        tlock.stripe(PurePath("/node/acq2")).down.release()
+
+    assert tlock.stripe(PurePath("/node/acq1")).up.acquire()
+
+    thread = threading.Thread(target=downthread, daemon=True)
+    thread.start()
+    thread.join()
+
+    tlock.stripe(PurePath("/node/acq1")).up.release()
+
+    assert results == [True, False]
+
+
+def test_treelock_no_root():
+    """A TreeLock with no root has a single stripe."""
+
+    tlock = TreeLock(None)
+
+    assert tlock.stripe(PurePath("/a")) is tlock.stripe(PurePath("/b"))
+
+
+def test_updownlock_stripe():
+    """UpDownLock.stripe returns itself."""
+
+    udlock = UpDownLock()
+    assert udlock.stripe(PurePath("/any/path")) is udlock
+
+
+def test_updownlock_metrics():
+    """A named UpDownLock still works with metrics enabled."""
+
+    udlock = UpDownLock(node="node")
+
+    with udlock.up:
+        assert "locked up" in repr(udlock)
+    with udlock.down:
+        assert "locked down" in repr(udlock)
+    assert "unlocked" in repr(udlock)
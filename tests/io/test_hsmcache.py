@@ -0,0 +1,151 @@
+"""Test alpenhorn.io._hsmcache."""
+
+import json
+from unittest.mock import patch
+
+import pytest
+
+from alpenhorn.io._hsmcache import HSMStateCache
+from alpenhorn.io._lfs import HSMState
+
+
+def test_init_bad_age():
+    """max_age must be positive."""
+
+    with pytest.raises(ValueError):
+        HSMStateCache(0)
+
+
+def test_update_get():
+    """Test recording and retrieving states."""
+
+    cache = HSMStateCache(100)
+
+    assert cache.get(1) is None
+
+    cache.update(1, HSMState.RESTORED)
+    cache.update(2, HSMState.RESTORED)
+    cache.update(3, HSMState.RELEASED)
+    assert len(cache) == 2
+    assert cache.get(1) == HSMState.RESTORED
+    assert cache.get(2) == HSMState.RESTORED
+    assert cache.get(3) is None
+
+    # Copies which aren't restored are forgotten
+    cache.update(1, None)
+    cache.update(2, HSMState.RELEASED)
+    assert len(cache) == 0
+
+
+def test_stale():
+    """Stale states are ignored."""
+
+    cache = HSMStateCache(100)
+
+    with patch("time.time", return_value=1000):
+        cache.update(1, HSMState.RESTORED, size=10, path="/file")
+
+    with patch("time.time", return_value=1050):
+        assert cache.get(1) == HSMState.RESTORED
+
+    with patch("time.time", return_value=1150):
+        assert cache.get(1) is None
+        assert cache.plan(10) == []
+
+    assert len(cache) == 0
+
+
+def test_expire():
+    """Stale states are discarded by expire, which can be throttled."""
+
+    cache = HSMStateCache(100)
+
+    with patch("time.time", return_value=1000):
+        cache.update(1, HSMState.RESTORED)
+    with patch("time.time", return_value=1080):
+        cache.update(2, HSMState.RESTORED)
+
+    with patch("time.time", return_value=1150):
+        cache.expire(interval=600)
+    assert len(cache) == 1
+
+    # Too soon
+    with patch("time.time", return_value=1200):
+        cache.expire(interval=600)
+    assert len(cache) == 1
+
+    with patch("time.time", return_value=1200):
+        cache.expire()
+    assert len(cache) == 0
+
+
+def test_plan():
+    """Test release planning."""
+
+    cache = HSMStateCache(100)
+
+    cache.update(1, HSMState.RESTORED, last_access=3, size=10, path="/file1")
+    cache.update(2, HSMState.RESTORED, last_access=1, size=20, path="/file2")
+    cache.update(3, HSMState.RELEASED, last_access=0, size=40, path="/file3")
+    cache.update(4, HSMState.RESTORED, last_access=2, size=30, path="/file4")
+    cache.update(5, HSMState.RESTORED, last_access=4, size=50, path="/file5")
+
+    # Updating again with the same state doesn't duplicate the file
+    cache.update(2, HSMState.RESTORED, last_access=1, size=20, path="/file2")
+
+    # File 1 is no longer restored
+    cache.update(1, HSMState.RELEASED, last_access=3, size=10, path="/file1")
+
+    # Least-recently accessed first
+    assert cache.plan(40) == [(2, "/file2", 20), (4, "/file4", 30)]
+
+    # Planned files are forgotten
+    assert cache.get(2) is None
+    assert cache.get(4) is None
+
+    # Only one restored file left
+    assert cache.plan(1000) == [(5, "/file5", 50)]
+    assert cache.plan(1000) == []
+
+
+def test_save_load(xfs):
+    """Test persisting the cache."""
+
+    xfs.create_dir("/cache")
+
+    cache = HSMStateCache(100, "/cache/hsm.json")
+    assert len(cache) == 0
+
+    cache.update(1, HSMState.RESTORED, last_access=2, size=10, path="/file1")
+    cache.update(2, HSMState.RESTORED, last_access=1, size=20, path="/file2")
+    cache.save()
+
+    with open("/cache/hsm.json") as f:
+        assert set(json.load(f)) == {"1", "2"}
+
+    cache = HSMStateCache(100, "/cache/hsm.json")
+    assert len(cache) == 2
+    assert cache.plan(1000) == [(2, "/file2", 20), (1, "/file1", 10)]
+
+
+def test_save_max_age(xfs):
+    """Test throttling saves."""
+
+    xfs.create_dir("/cache")
+
+    cache = HSMStateCache(100, "/cache/hsm.json")
+    cache.save(max_age=600)
+    cache.update(1, HSMState.RESTORED)
+    cache.save(max_age=600)
+
+    with open("/cache/hsm.json") as f:
+        assert json.load(f) == {}
+
+
+def test_load_bad(xfs):
+    """A corrupt cache file is ignored."""
+
+    xfs.create_file("/cache/hsm.json", contents="{bad")
+
+    cache = HSMStateCache(100, "/cache/hsm.json")
+    assert len(cache) == 0
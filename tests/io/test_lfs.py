@@ -1,6 +1,7 @@
 """Test alpenhorn.io._lfs LFS wrapper."""
 
 import pathlib
+from unittest.mock import patch
 
 import pytest
 
@@ -289,6 +290,90 @@ def test_hsm_state_released(xfs, lfs, mock_run_command):
     assert lfs.hsm_state("/path") == lfs.HSM_RELEASED
 
 
+@pytest.mark.run_command_result(
+    2,
+    "/unarchived: (0x00000000)\n"
+    "/restored: (0x00000009) exists archived, archive_id:2\n"
+    "/released: (0x0000000d) released exists archived, archive_id:2\n",
+    "lfs hsm_state: cannot get HSM state of '/missing': No such file or directory",
+)
+def test_hsm_state_many(lfs, mock_run_command):
+    """Test hsm_state_many without checking for restores."""
+
+    assert lfs.hsm_state_many(
+        ["/unarchived", "/missing", pathlib.Path("/restored"), "/released"],
+        restoring=False,
+    ) == {
+        "/unarchived": lfs.HSM_UNARCHIVED,
+        "/missing": lfs.HSM_MISSING,
+        "/restored": lfs.HSM_RESTORED,
+        "/released": lfs.HSM_RELEASED,
+    }
+
+    # One command for all the paths
+    assert mock_run_command()["cmd"] == [
+        "LFS",
+        "hsm_state",
+        "/unarchived",
+        "/missing",
+        "/restored",
+        "/released",
+    ]
+
+
+def test_hsm_state_many_restoring(lfs):
+    """Test hsm_state_many checking for restores."""
+
+    calls = []
+
+    def _run_command(cmd, timeout=None, **kwargs):
+        calls.append(cmd)
+        if cmd[1] == "hsm_state":
+            return (
+                0,
+                "/restored: (0x00000009) exists archived, archive_id:2\n"
+                "/released: (0x0000000d) released exists archived, archive_id:2\n"
+                "/restoring: (0x0000000d) released exists archived, archive_id:2\n",
+                "",
+            )
+        return 0, "/released: NOOP\n/restoring: RESTORE running\n", ""
+
+    with patch("alpenhorn.daemon.proc.run_command", _run_command):
+        assert lfs.hsm_state_many(["/restored", "/released", "/restoring"]) == {
+            "/restored": lfs.HSM_RESTORED,
+            "/released": lfs.HSM_RELEASED,
+            "/restoring": lfs.HSM_RESTORING,
+        }
+
+    # hsm_action only run on the released files
+    assert calls[1] == ["LFS", "hsm_action", "/released", "/restoring"]
+
+
+def test_hsm_state_many_chunked(lfs):
+    """Test hsm_state_many splits many paths into chunks."""
+
+    calls = []
+
+    def _run_command(cmd, timeout=None, **kwargs):
+        calls.append(cmd)
+        return 0, "".join(f"{path}: (0x00000000)\n" for path in cmd[2:]), ""
+
+    paths = [f"/file{i}" for i in range(5)]
+    with patch("alpenhorn.daemon.proc.run_command", _run_command):
+        with patch("alpenhorn.io._lfs._MANY_MAX_PATHS", 2):
+            states = lfs.hsm_state_many(paths)
+
+    assert states == dict.fromkeys(paths, lfs.HSM_UNARCHIVED)
+    assert [len(cmd) - 2 for cmd in calls] == [2, 2, 1]
+
+
+@pytest.mark.run_command_result(None, "", "")
+def test_hsm_state_many_timeout(lfs, mock_run_command):
+    """Test hsm_state_many timing out."""
+
+    assert lfs.hsm_state_many(["/a", "/b"]) == {"/a": None, "/b": None}
+
+
 @pytest.mark.lfs_hsm_state(
     {
         "/missing": "missing",
@@ -394,3 +479,97 @@ def test_hsm_release(mock_lfs, mock_run_command):
     assert lfs.hsm_release("/restored")
     assert "hsm_release" in mock_run_command()["cmd"]
     assert "/restored" in mock_run_command()["cmd"]
+
+
+def test_hsm_release_many(lfs):
+    """Test hsm_release_many()."""
+
+    calls = []
+
+    def _run_command(cmd, timeout=None, **kwargs):
+        calls.append(cmd)
+        # lfs resolves all the paths first, so nothing is released
+        if "/missing" in cmd:
+            return (
+                2,
+                "",
+                "lfs hsm_release: cannot release '/missing': "
+                "No such file or directory",
+            )
+        return 0, "", ""
+
+    with patch("alpenhorn.daemon.proc.run_command", _run_command):
+        assert lfs.hsm_release_many(["/file1", pathlib.Path("/missing"), "/file2"]) == {
+            "/file1": True,
+            "/missing": False,
+            "/file2": True,
+        }
+
+    # Re-run without the missing file
+    assert calls == [
+        ["LFS", "hsm_release", "/file1", "/missing", "/file2"],
+        ["LFS", "hsm_release", "/file1", "/file2"],
+    ]
+
+
+def test_hsm_restore_many(lfs):
+    """Test hsm_restore_many()."""
+
+    calls = []
+
+    def _run_command(cmd, timeout=None, **kwargs):
+        calls.append(cmd)
+        errors = []
+        if "/missing" in cmd:
+            errors.append(
+                "lfs hsm_restore: cannot restore '/missing': No such file or directory"
+            )
+        if "/bad" in cmd:
+            errors.append(
+                "lfs hsm_restore: cannot restore '/bad': Operation not permitted"
+            )
+        if errors:
+            return 2, "", "\n".join(errors)
+        return 0, "", ""
+
+    with patch("alpenhorn.daemon.proc.run_command", _run_command):
+        assert lfs.hsm_restore_many(["/file", "/missing", "/bad"]) == {
+            "/file": True,
+            "/missing": False,
+            "/bad": None,
+        }
+
+    assert calls == [
+        ["LFS", "hsm_restore", "/file", "/missing", "/bad"],
+        ["LFS", "hsm_restore", "/file"],
+    ]
+
+
+def test_hsm_release_many_unnamed_failure(lfs):
+    """Test hsm_release_many when lfs gives up after the first failure."""
+
+    calls = []
+
+    def _run_command(cmd, timeout=None, **kwargs):
+        calls.append(cmd)
+        # Fails on the first path, without trying the rest
+        if cmd[2] == "/bad":
+            return 1, "", "lfs hsm_release: cannot release '/bad': Invalid argument"
+        # Fails without naming the path
+        if "/worse" in cmd:
+            return 1, "", "lfs hsm_release: Input/output error"
+        return 0, "", ""
+
+    with patch("alpenhorn.daemon.proc.run_command", _run_command):
+        assert lfs.hsm_release_many(["/bad", "/file", "/worse"]) == {
+            "/bad": False,
+            "/file": True,
+            "/worse": False,
+        }
+
+    assert calls == [
+        ["LFS", "hsm_release", "/bad", "/file", "/worse"],
+        ["LFS", "hsm_release", "/file", "/worse"],
+        ["LFS", "hsm_release", "/file"],
+        ["LFS", "hsm_release", "/worse"],
+    ]
@@ -0,0 +1,137 @@
+"""Test alpenhorn.io._lfshelper."""
+
+import sys
+import threading
+import time
+
+import pytest
+
+from alpenhorn.io._lfs import LFS
+from alpenhorn.io._lfshelper import LFSHelper
+
+# A stand-in for lfs(1) which emulates the output of "lfs hsm_state"
+FAKE_LFS = f"""#!{sys.executable}
+import sys
+
+command, *paths = sys.argv[1:]
+if command != "hsm_state":
+    sys.exit(1)
+
+ret = 0
+for path in paths:
+    if "missing" in path:
+        print(
+            f"lfs hsm_state: cannot get HSM state of '{{path}}': "
+            "No such file or directory",
+            file=sys.stderr,
+        )
+        ret = 2
+    elif "released" in path:
+        print(f"{{path}}: (0x0000000d) released exists archived, archive_id:2")
+    else:
+        print(f"{{path}}: (0x00000009) exists archived, archive_id:2")
+sys.exit(ret)
+"""
+
+
+@pytest.fixture
+def fake_lfs(tmp_path):
+    """Create the lfs(1) stand-in.  Returns its directory."""
+
+    lfs = tmp_path / "lfs"
+    lfs.write_text(FAKE_LFS)
+    lfs.chmod(0o755)
+    return tmp_path
+
+
+@pytest.fixture
+def helper():
+    """Yields an LFSHelper, closing it afterwards."""
+
+    helper = LFSHelper()
+    yield helper
+    helper.close()
+
+
+def test_run_command(helper, fake_lfs):
+    """Test running a command via the helper."""
+
+    assert helper.run_command([str(fake_lfs / "lfs"), "hsm_state", "/file"]) == (
+        0,
+        "/file: (0x00000009) exists archived, archive_id:2\n",
+        "",
+    )
+
+    # The helper is reused
+    pid = helper._procs[0].pid
+    assert helper.run_command([str(fake_lfs / "lfs"), "other"])[0] == 1
+    assert helper._procs[0].pid == pid
+
+    # No other helpers were started
+    assert helper._procs[1:] == [None] * (len(helper._procs) - 1)
+
+
+def test_run_command_timeout(helper):
+    """Test a command timing out."""
+
+    assert helper.run_command(
+        [sys.executable, "-c", "import time; time.sleep(10)"], timeout=0.5
+    ) == (None, "", "")
+
+    # The helper is still working
+    assert helper.run_command(["true"])[0] == 0
+
+
+def test_run_command_not_found(helper):
+    """Test running a non-existent command."""
+
+    ret, _, stderr = helper.run_command(["/no/such/command"])
+    assert ret == 127
+    assert "No such file" in stderr
+
+
+def test_concurrent(helper):
+    """Commands run concurrently in separate helpers."""
+
+    results = []
+
+    def _run():
+        results.append(
+            helper.run_command([sys.executable, "-c", "import time; time.sleep(1)"])
+        )
+
+    threads = [threading.Thread(target=_run) for _ in range(2)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert time.monotonic() - start < 1.9
+    assert [result[0] for result in results] == [0, 0]
+    assert helper._procs[0] is not None and helper._procs[1] is not None
+
+
+def test_restart(helper):
+    """The helper is restarted if it dies."""
+
+    assert helper.run_command(["true"])[0] == 0
+    helper._procs[0].kill()
+    helper._procs[0].wait()
+
+    assert helper.run_command(["true"])[0] == 0
+
+
+def test_lfs_helper(fake_lfs):
+    """Test LFS using the helper."""
+
+    lfs = LFS("quota_id", "group", path=str(fake_lfs), helper=True)
+
+    assert lfs.hsm_state("/file") == lfs.HSM_RESTORED
+    assert lfs.hsm_state_many(["/file", "/released", "/missing"], restoring=False) == {
+        "/file": lfs.HSM_RESTORED,
+        "/released": lfs.HSM_RELEASED,
+        "/missing": lfs.HSM_MISSING,
+    }
+
+    lfs._helper.close()
@@ -166,6 +166,57 @@ def test_release_files(queue, mock_lfs, node):
     assert lfs.hsm_state("/node/simpleacq/file7") == lfs.HSM_RESTORING
 
 
+@pytest.mark.lfs_hsm_state(
+    {
+        "/node/simpleacq/file1": "restored",
+        "/node/simpleacq/file2": "restored",
+        "/node/simpleacq/file3": "restored",
+        "/node/simpleacq/file4": "restored",
+        "/node/simpleacq/file5": "restored",
+    }
+)
+def test_release_files_cached(queue, mock_lfs, node):
+    """Test release_files using the HSM state cache."""
+
+    from alpenhorn.io._lfs import HSMState
+
+    node.db.avail_gb = 10000000.0 / 2**30
+    node.db.save()
+
+    # Put file4 (800 kB) in the cache, which is enough to clear the headroom
+    node.io._cache_state(ArchiveFileCopy.get(id=4), HSMState.RESTORED)
+
+    node.io.release_files()
+
+    # No states need to be fetched
+    with patch("alpenhorn.io._lfs.LFS.hsm_state_many") as hsm_state_many:
+        task, key = queue.get()
+        task()
+        queue.task_done(key)
+    hsm_state_many.assert_not_called()
+
+    # Only file4 was released
+    for copy in ArchiveFileCopy.select():
+        assert copy.ready == (copy.id != 4)
+
+    lfs = mock_lfs("", "group")
+    assert lfs.hsm_state("/node/simpleacq/file4") == lfs.HSM_RELEASED
+    assert node.io._state_cache.get(4) is None
+
+
+def test_init_bad_state_cache_age(simplenode, queue, have_lfs):
+    """Check for bad state_cache_age."""
+
+    simplenode.io_class = "LustreHSM"
+    simplenode.io_config = (
+        '{"quota_id": "qgroup", "quota_type": "group", '
+        '"headroom": 300000, "state_cache_age": 0}'
+    )
+
+    with pytest.raises(ValueError):
+        UpdateableNode(queue, simplenode)
+
+
 def test_before_update(queue, node):
     """Test LustreHSMNodeIO.before_update()"""
 
@@ -426,6 +477,10 @@ def test_ready_pull_restored(mock_lfs, node, queue, archivefilecopyrequest):
 
     node.io.ready_pull(afcr)
 
+    # Nothing happens until the end of the update
+    assert queue.qsize == 0
+    node.io.after_update()
+
     # Task in queue
     assert queue.qsize == 1
 
@@ -460,6 +515,10 @@ def test_ready_pull_restoring(mock_lfs, node, queue, archivefilecopyrequest):
 
     node.io.ready_pull(afcr)
 
+    # Nothing happens until the end of the update
+    assert queue.qsize == 0
+    node.io.after_update()
+
     # Task in queue
     assert queue.qsize == 1
 
@@ -491,6 +550,10 @@ def test_ready_pull_released(mock_lfs, node, queue, archivefilecopyrequest):
 
     node.io.ready_pull(afcr)
 
+    # Nothing happens until the end of the update
+    assert queue.qsize == 0
+    node.io.after_update()
+
     # Task in queue
     assert queue.qsize == 1
 
@@ -505,6 +568,7 @@ def test_ready_pull_released(mock_lfs, node, queue, archivefilecopyrequest):
 
     # Calling ready_pull again doesn't add another task
     node.io.ready_pull(afcr)
+    node.io.after_update()
     assert queue.qsize == 0
 
     # Don't wait for the deferral to expire, just run the task again
@@ -515,6 +579,200 @@ def test_ready_pull_released(mock_lfs, node, queue, archivefilecopyrequest):
     assert lfs.hsm_state(copy.path) == lfs.HSM_RESTORING
 
 
+@pytest.mark.lfs_hsm_state(
+    {
+        "/node/simpleacq/file1": "released",
+        "/node/simpleacq/file2": "restored",
+    }
+)
+def test_ready_pull_bytes_avail(mock_lfs, node, queue, archivefilecopyrequest):
+    """Completed restores are deducted from the cached free space."""
+
+    for num in [1, 2]:
+        copy = ArchiveFileCopy.get(id=num)
+        node.io.ready_pull(
+            archivefilecopyrequest(
+                file=copy.file, node_from=node.db, group_to=node.db.group
+            )
+        )
+    node.io.after_update()
+    node.io._quota = 10000000
+
+    # Restore file1.  file2 is already restored.
+    task, key = queue.get()
+    task()
+    queue.task_done(key)
+    assert node.io._quota == 10000000
+
+    # Finish the restore
+    lfs = mock_lfs("", "group")
+    lfs.hsm_restore("/node/simpleacq/file1")
+    task()
+
+    # file1's 100 kB are gone
+    assert lfs.hsm_state("/node/simpleacq/file1") == lfs.HSM_RESTORED
+    assert node.io._quota == 10000000 - 100000
+
+
+@pytest.mark.lfs_hsm_state(
+    {
+        "/node/simpleacq/file1": "released",
+        "/node/simpleacq/file2": "released",
+        "/node/simpleacq/file3": "released",
+    }
+)
+@pytest.mark.lfs_hsm_restore_result("wait")
+def test_ready_pull_batch(mock_lfs, node, queue, archivefilecopyrequest):
+    """Test restores for ready_pull are batched and ordered."""
+
+    node.db.avail_gb = 1000
+    node.io._restore_batch_size = 2
+
+    for num in [3, 1, 2]:
+        copy = ArchiveFileCopy.get(id=num)
+        node.io.ready_pull(
+            archivefilecopyrequest(
+                file=copy.file, node_from=node.db, group_to=node.db.group
+            )
+        )
+    node.io.after_update()
+
+    # One task for all the files
+    assert queue.qsize == 1
+
+    # Spy on the (mocked) hsm_restore_many
+    mocked_restore_many = mock_lfs.hsm_restore_many
+    with patch(
+        "alpenhorn.io._lfs.LFS.hsm_restore_many",
+        side_effect=lambda paths: mocked_restore_many(None, paths),
+    ) as restore_many:
+        task, key = queue.get()
+        task()
+        queue.task_done(key)
+
+        # The first two files, in order, are restored together
+        restore_many.assert_called_once()
+        assert [str(path) for path in restore_many.call_args.args[0]] == [
+            "/node/simpleacq/file1",
+            "/node/simpleacq/file2",
+        ]
+
+        # Task is deferred
+        assert queue.deferred_size == 1
+
+        # Next time around, the last file is restored
+        task()
+        assert [str(path) for path in restore_many.call_args.args[0]] == [
+            "/node/simpleacq/file3",
+        ]
+
+    lfs = mock_lfs("", "group")
+    for num in [1, 2, 3]:
+        assert lfs.hsm_state(f"/node/simpleacq/file{num}") == lfs.HSM_RESTORING
+
+
+@pytest.mark.lfs_hsm_state(
+    {
+        "/node/simpleacq/file1": "released",
+        "/node/simpleacq/file2": "released",
+    }
+)
+@pytest.mark.lfs_hsm_restore_result("wait")
+def test_ready_pull_headroom(mock_lfs, node, queue, archivefilecopyrequest):
+    """Test restores for ready_pull are limited by headroom."""
+
+    # 150 kB free above the headroom: enough for file1 (100 kB) but not
+    # file2 (300 kB)
+    node.db.avail_gb = (10250 * 2**10 + 150000) / 2**30
+
+    for num in [1, 2]:
+        copy = ArchiveFileCopy.get(id=num)
+        node.io.ready_pull(
+            archivefilecopyrequest(
+                file=copy.file, node_from=node.db, group_to=node.db.group
+            )
+        )
+    node.io.after_update()
+
+    task, key = queue.get()
+    task()
+    queue.task_done(key)
+
+    lfs = mock_lfs("", "group")
+    assert lfs.hsm_state("/node/simpleacq/file1") == lfs.HSM_RESTORING
+    assert lfs.hsm_state("/node/simpleacq/file2") == lfs.HSM_RELEASED
+
+
+@pytest.mark.lfs_hsm_state(
+    {
+        "/node/simpleacq/file1": "released",
+    }
+)
+@pytest.mark.lfs_hsm_restore_result("wait")
+def test_restore_poll_abandoned(mock_lfs, node, queue, archivefilecopyrequest):
+    """Outstanding restores are forgotten if the poller stops early."""
+
+    copy = ArchiveFileCopy.get(id=1)
+    node.io.ready_pull(
+        archivefilecopyrequest(
+            file=copy.file, node_from=node.db, group_to=node.db.group
+        )
+    )
+    node.io.after_update()
+
+    task, key = queue.get()
+    assert task._requeue
+    task()
+    queue.task_done(key)
+
+    # Restore is in flight
+    assert node.io._restore_poller
+    assert copy.file.id in node.io._restore_inflight
+
+    # Drop the poller
+    task._generator.close()
+
+    assert not node.io._restore_poller
+    assert not node.io._restore_inflight
+    assert not node.io._restore_queue
+    assert not node.io._restoring
+
+    # A new poller can be started
+    node.io.ready_pull(
+        archivefilecopyrequest(
+            file=copy.file, node_from=node.db, group_to=node.db.group
+        )
+    )
+    node.io.after_update()
+    assert node.io._restore_poller
+
+
+@pytest.mark.lfs_hsm_state(
+    {
+        "/node/simpleacq/file1": "released",
+    }
+)
+def test_restore_poll_db_error(mock_lfs, node, queue, archivefilecopyrequest):
+    """Outstanding restores are kept for the requeued poller after a DB error."""
+
+    copy = ArchiveFileCopy.get(id=1)
+    node.io.ready_pull(
+        archivefilecopyrequest(
+            file=copy.file, node_from=node.db, group_to=node.db.group
+        )
+    )
+    node.io.after_update()
+
+    task, key = queue.get()
+    with patch.object(node.io, "_restore_next", side_effect=pw.OperationalError):
+        with pytest.raises(pw.OperationalError):
+            task()
+    queue.task_done(key)
+
+    assert node.io._restore_poller
+    assert node.io._restore_queue == {copy.file.id}
+
+
 def test_idle_update_empty(queue, mock_lfs, node):
     """Test LustreHSMNodeIO.idle_update with no files."""
 
@@ -725,3 +983,18 @@ def test_hsm_restore_fail(xfs, queue, mock_lfs, node):
     # Check the internal bookkeeping
     assert copy.id not in node.io._restoring
     assert copy.id not in node.io._restore_start
+
+
+def test_remote_pull_ready_many(node):
+    """Test LustreHSMNodeRemote.pull_ready_many()."""
+    from alpenhorn.daemon.update import RemoteNode
+    from alpenhorn.db.acquisition import ArchiveFile
+
+    # Make file2 and file4 not ready
+    ArchiveFileCopy.update(ready=False).where(ArchiveFileCopy.id << [2, 4]).execute()
+
+    files = list(ArchiveFile.select().order_by(ArchiveFile.id))
+    remote = RemoteNode(node.db)
+
+    assert remote.io.pull_ready_many(files) == set(files) - {files[1], files[3]}
+    assert remote.io.pull_ready_many([]) == set()
@@ -1,5 +1,8 @@
 """Test LustreQuotaNodeIO."""
 
+import time
+from unittest.mock import patch
+
 import pytest
 
 from alpenhorn.daemon.update import UpdateableNode
@@ -47,6 +50,110 @@ def test_bytes_avail(node):
     assert node.io.bytes_avail() == 1234
 
 
+@pytest.mark.lfs_quota_remaining(1234)
+def test_bytes_avail_fast(node):
+    """Test the quota cache used by LustreQuotaNodeIO.bytes_avail(fast=True)"""
+
+    # Nothing cached yet
+    assert node.io.bytes_avail(fast=True) is None
+
+    # Slow call populates the cache
+    assert node.io.bytes_avail() == 1234
+    assert node.io.bytes_avail(fast=True) == 1234
+
+    # Adjustments are applied to the cache
+    node.io.adjust_bytes_avail(-234)
+    assert node.io.bytes_avail(fast=True) == 1000
+    node.io.adjust_bytes_avail(100)
+    assert node.io.bytes_avail(fast=True) == 1100
+
+    # Slow call resets the cache
+    assert node.io.bytes_avail() == 1234
+    assert node.io.bytes_avail(fast=True) == 1234
+
+
+@pytest.mark.lfs_quota_remaining(1234)
+def test_bytes_avail_fast_ttl(node):
+    """Test expiry of the quota cache."""
+
+    node.io.bytes_avail()
+
+    with patch("time.monotonic", return_value=time.monotonic() + 899):
+        assert node.io.bytes_avail(fast=True) == 1234
+
+    with patch("time.monotonic", return_value=time.monotonic() + 901):
+        assert node.io.bytes_avail(fast=True) is None
+
+
+def test_bytes_avail_fast_failed(node, mock_lfs):
+    """A failed quota query leaves the cache alone."""
+
+    node.io.adjust_bytes_avail(100)
+    node.io.bytes_avail()
+    assert node.io.bytes_avail(fast=True) is None
+
+    with patch.object(node.io._lfs, "quota_remaining", return_value=1000):
+        node.io.bytes_avail()
+    node.io.adjust_bytes_avail(-100)
+
+    # Default mock fails
+    assert node.io.bytes_avail() is None
+    assert node.io.bytes_avail(fast=True) == 900
+
+
+def test_bad_quota_cache_ttl(mock_lfs, queue, simplenode):
+    """Test bad quota_cache_ttl handling."""
+
+    simplenode.io_class = "LustreQuota"
+    simplenode.io_config = (
+        '{"quota_id": "qid", "quota_type": "group", "quota_cache_ttl": 0}'
+    )
+    with pytest.raises(ValueError):
+        UpdateableNode(queue, simplenode)
+
+
+def test_lfs_helper(mock_lfs, queue, simplenode):
+    """Test parsing lfs_helper."""
+
+    simplenode.io_class = "LustreQuota"
+
+    for value, expected in [
+        ("true", True),
+        ('"Yes"', True),
+        ("1", True),
+        ("false", False),
+        ('"false"', False),
+        ('"0"', False),
+    ]:
+        simplenode.io_config = (
+            '{"quota_id": "qid", "quota_type": "group", ' f'"lfs_helper": {value}}}'
+        )
+        unode = UpdateableNode(queue, simplenode)
+        assert (unode.io._lfs._helper is not None) == expected
+
+    for value in ['"maybe"', "2", "null"]:
+        simplenode.io_config = (
+            '{"quota_id": "qid", "quota_type": "group", ' f'"lfs_helper": {value}}}'
+        )
+        with pytest.raises(ValueError):
+            UpdateableNode(queue, simplenode)
+
+
+def test_stop_lfs_helper(mock_lfs, queue, simplenode):
+    """Test stopping the node closes the lfs helper."""
+
+    simplenode.io_class = "LustreQuota"
+    simplenode.io_config = (
+        '{"quota_id": "qid", "quota_type": "group", "lfs_helper": true}'
+    )
+    unode = UpdateableNode(queue, simplenode)
+
+    assert unode.io._lfs._helper is not None
+    with patch("alpenhorn.io._lfshelper.LFSHelper.close") as mock_close:
+        unode.stop()
+    mock_close.assert_called_once_with()
+
+
 @pytest.mark.lfs_dont_mock("quota_remaining")
 def test_quota_type(mock_lfs, queue, simplenode, mock_run_command):
     """Test quota_type handling."""